@@ -22,6 +22,7 @@ from ._C import (
     Server,
     ClosedBatchingQueue,
     AsyncError,
+    tensor_nest,
 )
 
 
@@ -32,4 +33,5 @@ __all__ = [
     "Server",
     "ClosedBatchingQueue",
     "AsyncError",
+    "tensor_nest",
 ]
@@ -19,6 +19,7 @@
 #include <chrono>
 #include <deque>
 #include <future>
+#include <map>
 #include <memory>
 #include <mutex>
 #include <optional>
@@ -31,6 +32,7 @@
 #define USE_NUMPY 1
 
 #include <ATen/core/ivalue.h>
+#include <ATen/record_function.h>
 #include <torch/csrc/autograd/profiler.h>
 #include <torch/csrc/utils/numpy_stub.h>
 #include <torch/extension.h>
@@ -39,20 +41,17 @@
 #include "nest_serialize.h"
 #include "rpcenv.grpc.pb.h"
 #include "rpcenv.pb.h"
+#include "tensor_nest.h"
 
 #include "../nest/nest/nest.h"
 #include "../nest/nest/nest_pybind.h"
 
 namespace py = pybind11;
 
-typedef nest::Nest<torch::Tensor> TensorNest;
-
-TensorNest batch(const std::vector<TensorNest>& tensors, int64_t batch_dim) {
-  // TODO(heiner): Consider using accessors and writing slices ourselves.
-  nest::Nest<std::vector<torch::Tensor>> zipped = TensorNest::zip(tensors);
-  return zipped.map([batch_dim](const std::vector<torch::Tensor>& v) {
-    return torch::cat(v, batch_dim);
-  });
+uint64_t elapsed_ns(std::chrono::steady_clock::time_point start) {
+  return std::chrono::duration_cast<std::chrono::nanoseconds>(
+             std::chrono::steady_clock::now() - start)
+      .count();
 }
 
 struct ClosedBatchingQueue : public std::runtime_error {
@@ -107,22 +106,7 @@ class BatchingQueue {
 
   void enqueue(QueueItem item) {
     if (check_inputs_) {
-      bool is_empty = true;
-
-      item.tensors.for_each([this, &is_empty](const torch::Tensor& tensor) {
-        is_empty = false;
-
-        if (tensor.dim() <= batch_dim_) {
-          throw py::value_error(
-              "Enqueued tensors must have more than batch_dim == " +
-              std::to_string(batch_dim_) + " dimensions, but got " +
-              std::to_string(tensor.dim()));
-        }
-      });
-
-      if (is_empty) {
-        throw py::value_error("Cannot enqueue empty vector of tensors");
-      }
+      check_inputs(item);
     }
 
     bool should_notify = false;
@@ -145,6 +129,39 @@ class BatchingQueue {
     }
   }
 
+  // Like enqueue, but drops the item instead of blocking when
+  // maximum_queue_size is reached. Returns whether the item was enqueued.
+  bool try_enqueue(QueueItem item) {
+    if (check_inputs_) {
+      check_inputs(item);
+    }
+
+    bool should_notify = false;
+    {
+      std::unique_lock<std::mutex> lock(mu_);
+      if (is_closed_) {
+        throw ClosedBatchingQueue("Enqueue to closed queue");
+      }
+      if (maximum_queue_size_ != std::nullopt &&
+          deque_.size() >= *maximum_queue_size_) {
+        ++num_dropped_;
+        return false;
+      }
+      deque_.push_back(std::move(item));
+      should_notify = deque_.size() >= minimum_batch_size_;
+    }
+
+    if (should_notify) {
+      enough_inputs_.notify_one();
+    }
+    return true;
+  }
+
+  uint64_t num_dropped() const {
+    std::unique_lock<std::mutex> lock(mu_);
+    return num_dropped_;
+  }
+
   std::pair<TensorNest, std::vector<T>> dequeue_many() {
     std::vector<TensorNest> tensors;
     std::vector<T> payloads;
@@ -183,7 +200,8 @@ class BatchingQueue {
       deque_.erase(deque_.begin(), deque_.begin() + batch_size);
     }
     can_enqueue_.notify_all();
-    return std::make_pair(batch(tensors, batch_dim_), std::move(payloads));
+    return std::make_pair(tensor_nest::batch(tensors, batch_dim_),
+                          std::move(payloads));
   }
 
   bool is_closed() const {
@@ -205,6 +223,25 @@ class BatchingQueue {
   }
 
  private:
+  void check_inputs(QueueItem& item) const {
+    bool is_empty = true;
+
+    item.tensors.for_each([this, &is_empty](const torch::Tensor& tensor) {
+      is_empty = false;
+
+      if (tensor.dim() <= batch_dim_) {
+        throw py::value_error(
+            "Enqueued tensors must have more than batch_dim == " +
+            std::to_string(batch_dim_) + " dimensions, but got " +
+            std::to_string(tensor.dim()));
+      }
+    });
+
+    if (is_empty) {
+      throw py::value_error("Cannot enqueue empty vector of tensors");
+    }
+  }
+
   mutable std::mutex mu_;
 
   const int64_t batch_dim_;
@@ -217,6 +254,7 @@ class BatchingQueue {
   std::condition_variable can_enqueue_;
 
   bool is_closed_ = false /* GUARDED_BY(mu_) */;
+  uint64_t num_dropped_ = 0 /* GUARDED_BY(mu_) */;
   std::deque<QueueItem> deque_ /* GUARDED_BY(mu_) */;
 
   const bool check_inputs_;
@@ -286,11 +324,12 @@ class DynamicBatcher {
   DynamicBatcher(int64_t batch_dim, int64_t minimum_batch_size,
                  int64_t maximum_batch_size,
                  std::optional<int> timeout_ms = std::nullopt,
-                 bool check_outputs = true)
+                 bool check_outputs = true, bool compact_outputs = false)
       : batching_queue_(batch_dim, minimum_batch_size, maximum_batch_size,
                         timeout_ms),
         batch_dim_(batch_dim),
-        check_outputs_(check_outputs) {}
+        check_outputs_(check_outputs),
+        compact_outputs_(compact_outputs) {}
 
   TensorNest compute(TensorNest tensors) {
     BatchPromise promise;
@@ -315,14 +354,22 @@ class DynamicBatcher {
       }
     }();
 
-    return pair.first->map([batch_dim = batch_dim_,
-                            batch_entry = pair.second](const torch::Tensor& t) {
-      return t.slice(batch_dim, batch_entry, batch_entry + 1);
+    // Slices are views that keep the whole batched output alive for as long
+    // as the caller holds them, e.g. an actor's agent state for a rollout.
+    // Compact outputs copy the entry into its own storage instead.
+    return pair.first->map([batch_dim = batch_dim_, batch_entry = pair.second,
+                            compact = compact_outputs_](const torch::Tensor& t) {
+      torch::Tensor entry = t.slice(batch_dim, batch_entry, batch_entry + 1);
+      return compact ? entry.clone(at::MemoryFormat::Contiguous) : entry;
     });
   }
 
   std::shared_ptr<Batch> get_batch() {
+    auto start = std::chrono::steady_clock::now();
     auto pair = batching_queue_.dequeue_many();
+    dequeue_ns_ += elapsed_ns(start);
+    batch_count_ += 1;
+    batch_items_ += pair.second.size();
     return std::make_shared<Batch>(batch_dim_, std::move(pair.first),
                                    std::move(pair.second), check_outputs_);
   }
@@ -332,12 +379,26 @@ class DynamicBatcher {
   void close() { batching_queue_.close(); }
   bool is_closed() { return batching_queue_.is_closed(); }
 
+  // Cumulative counters. Each <event>_count has matching <event>_ns
+  // (time spent) or <event>_items (total size) entries.
+  std::map<std::string, uint64_t> counters() const {
+    return {{"batch_count", batch_count_},
+            {"batch_items", batch_items_},
+            {"dequeue_count", batch_count_},
+            {"dequeue_ns", dequeue_ns_}};
+  }
+
  private:
   BatchingQueue<std::promise<std::pair<std::shared_ptr<TensorNest>, int64_t>>>
       batching_queue_;
   int64_t batch_dim_;
 
   bool check_outputs_;
+  bool compact_outputs_;
+
+  std::atomic_uint64_t batch_count_{0};
+  std::atomic_uint64_t batch_items_{0};
+  std::atomic_uint64_t dequeue_ns_{0};
 };
 
 class ActorPool {
@@ -347,13 +408,21 @@ class ActorPool {
 	    std::shared_ptr<BatchingQueue<>> replay_queue,
             std::shared_ptr<DynamicBatcher> inference_batcher,
             std::vector<std::string> env_server_addresses,
-            TensorNest initial_agent_state)
+            TensorNest initial_agent_state,
+            bool compress_rollouts = false,
+            std::optional<int64_t> max_terminal_frames = std::nullopt)
       : unroll_length_(unroll_length),
         learner_queue_(std::move(learner_queue)),
         replay_queue_(std::move(replay_queue)),
         inference_batcher_(std::move(inference_batcher)),
         env_server_addresses_(std::move(env_server_addresses)),
-        initial_agent_state_(std::move(initial_agent_state)) {}
+        initial_agent_state_(std::move(initial_agent_state)),
+        compress_rollouts_(compress_rollouts),
+        max_terminal_frames_(max_terminal_frames.value_or(unroll_length)) {
+    if (max_terminal_frames_ < 1) {
+      throw py::value_error("max_terminal_frames must be >= 1");
+    }
+  }
 
   void loop(int64_t loop_index, const std::string& address) {
     std::shared_ptr<grpc::Channel> channel =
@@ -411,18 +480,33 @@ class ActorPool {
           "Expected first entry of agent output to be a (action, ...) tuple");
     }
 
-    TensorNest last(std::vector({env_outputs, agent_outputs}));
+    TensorNest first(std::vector({env_outputs, agent_outputs}));
+
+    // Steps are written in place into preallocated buffers. The learner queue
+    // copies rollouts when batching them, so the buffer handed over with the
+    // previous rollout is usually free again and the two are swapped.
+    RolloutBuffer buffer = new_rollout_buffer(first);
+    RolloutBuffer spare_buffer = new_rollout_buffer(first);
+    write_row(buffer.rollout, 0, first);
+    // The rollout is (env_outputs, agent_outputs).
+    TensorNest* env_rollout = &buffer.rollout.get_vector()[0];
+    TensorNest* agent_rollout = &buffer.rollout.get_vector()[1];
 
     rpcenv::Action action_pb;
-    std::vector<TensorNest> rollout;
-    std::vector<TensorNest> new_obs;
+    // Frames of episodes that ended during the rollout are stored with the
+    // index of their step. All other next observations are in the rollout.
+    int64_t num_terminal = 0;
 
     try {
       while (true) {
-        rollout.push_back(std::move(last));
+        // Shows up in the learner's profiler traces.
+        RECORD_USER_SCOPE("actor");
 
 	for (int t = 1; t <= unroll_length_; t++) {
+          auto start = std::chrono::steady_clock::now();
           all_agent_outputs = inference_batcher_->compute(compute_inputs);
+          inference_ns_ += elapsed_ns(start);
+          inference_count_ += 1;
 
           agent_state = all_agent_outputs.get_vector()[1];
           agent_outputs = all_agent_outputs.get_vector()[0];
@@ -438,45 +522,88 @@ class ActorPool {
                 return fill_ndarray_pb(array, tensor, /*start_dim=*/2);
               });
 
+          start = std::chrono::steady_clock::now();
           stream->Write(action_pb);
           if (!stream->Read(&step_pb)) {
             throw py::connection_error("Read failed.");
           }
-          env_outputs = ActorPool::step_pb_to_nest(&step_pb);
-          TensorNest obs = env_outputs.get_vector()[0];
-
-	  // there's probably a better way to do this
-	  bool done = env_outputs.get_vector()[2].front().is_nonzero();
-	  if (done) {
-	    replay_queue_->enqueue({obs});
-	    new_obs.push_back(std::move(obs));
+          rpc_ns_ += elapsed_ns(start);
+          rpc_count_ += 1;
+          env_step_ns_ += static_cast<uint64_t>(step_pb.step_time() * 1e9);
+          env_step_count_ += 1;
+
+	  if (step_pb.done()) {
+            TensorNest obs = nest_pb_to_nest(step_pb.mutable_observation(),
+                                             array_pb_to_view);
+	    // Never block on the discriminator, drop the frame instead.
+	    replay_queue_->try_enqueue({obs.map(
+                [](const torch::Tensor& t) { return t.clone(); })});
+            if (num_terminal < max_terminal_frames_) {
+              write_row(buffer.terminal_obs, num_terminal, obs);
+              buffer.terminal_index.data_ptr<int64_t>()[num_terminal] = t - 1;
+              num_terminal += 1;
+            } else {
+              // More episodes ended than there is room for. The learner
+              // sees the next episode's first frame for this one instead.
+              terminal_frames_dropped_ += 1;
+            }
 
 	    // resets environment
             if (!stream->Read(&step_pb)) {
               throw py::connection_error("Read failed.");
             }
-            env_outputs = ActorPool::step_pb_to_nest(&step_pb);
-            obs = env_outputs.get_vector()[0];
 	  }
 
-          compute_inputs = TensorNest(std::vector({env_outputs, agent_state})); 
+          write_step(*env_rollout, t, &step_pb);
+          write_row(*agent_rollout, t, agent_outputs);
 
-          last = TensorNest(std::vector({env_outputs, agent_outputs}));
-	  if (!done) {
-	    new_obs.push_back(std::move(obs));
-	  }
-          rollout.push_back(std::move(last));
+          env_outputs = row(*env_rollout, t);
+          compute_inputs = TensorNest(std::vector({env_outputs, agent_state}));
         }
-        last = rollout.back();
+
+        // Pad to a fixed size so rollouts of different actors can be batched.
+        if (num_terminal < max_terminal_frames_) {
+          const int64_t padding = max_terminal_frames_ - num_terminal;
+          buffer.terminal_obs.for_each([&](torch::Tensor& t) {
+            t.narrow(0, num_terminal, padding).zero_();
+          });
+          buffer.terminal_index.narrow(0, num_terminal, padding).fill_(-1);
+        }
+
+        TensorNest rollout = buffer.rollout;  // Copies the structure only.
+        TensorNest terminal_obs = buffer.terminal_obs;
+        if (compress_rollouts_) {
+          // rollout is (env_outputs, agent_outputs), obs is env_outputs[0].
+          compress_canvas(rollout.get_vector()[0].get_vector()[0]);
+          compress_canvas(terminal_obs);
+        }
+        TensorNest terminal_frames(std::vector(
+            {std::move(terminal_obs), TensorNest(buffer.terminal_index)}));
+
         learner_queue_->enqueue({
           TensorNest(
-	    std::vector({batch(rollout, 0), std::move(batch(new_obs, 0)), 
+	    std::vector({std::move(rollout), std::move(terminal_frames),
             std::move(initial_agent_state)})
 	  ),
         });
 
-        rollout.clear();
-	new_obs.clear();
+        std::swap(buffer, spare_buffer);
+        if (!is_free(buffer)) {
+          // Still queued, fall back to a fresh buffer.
+          buffer = new_rollout_buffer(first);
+        }
+        // The last step of this rollout is the first of the next one.
+        TensorNest::for_each(
+            [](torch::Tensor& dst, const torch::Tensor& src) {
+              dst[0].copy_(src[src.size(0) - 1]);
+            },
+            buffer.rollout, spare_buffer.rollout);
+        env_rollout = &buffer.rollout.get_vector()[0];
+        agent_rollout = &buffer.rollout.get_vector()[1];
+        env_outputs = row(*env_rollout, 0);
+        compute_inputs = TensorNest(std::vector({env_outputs, agent_state}));
+
+        num_terminal = 0;
         initial_agent_state = agent_state;  // Copy
         count_ += unroll_length_;
       }
@@ -508,6 +635,92 @@ class ActorPool {
 
   uint64_t count() const { return count_; }
 
+  // Cumulative counters. Each <event>_count has a matching <event>_ns entry.
+  // rpc includes the environment step, env_step is measured by the server.
+  std::map<std::string, uint64_t> counters() const {
+    return {{"env_step_count", env_step_count_},
+            {"env_step_ns", env_step_ns_},
+            {"rpc_count", rpc_count_},
+            {"rpc_ns", rpc_ns_},
+            {"inference_count", inference_count_},
+            {"inference_ns", inference_ns_},
+            {"terminal_frames_dropped", terminal_frames_dropped_}};
+  }
+
+  // Preallocated storage an actor writes its rollouts into.
+  struct RolloutBuffer {
+    TensorNest rollout;            // [T + 1, 1, ...] (env_outputs, agent_outputs).
+    TensorNest terminal_obs;       // [K, 1, ...] observations.
+    torch::Tensor terminal_index;  // [K, 1] int64.
+  };
+
+  // Allocates buffers shaped like `step`, a [1, 1, ...] rollout entry.
+  RolloutBuffer new_rollout_buffer(const TensorNest& step) const {
+    auto allocate = [](int64_t size) {
+      return [size](const torch::Tensor& t) {
+        std::vector<int64_t> sizes = t.sizes().vec();
+        sizes[0] = size;
+        return torch::empty(sizes, t.options());
+      };
+    };
+    return {step.map(allocate(unroll_length_ + 1)),
+            step.get_vector()[0].get_vector()[0].map(
+                allocate(max_terminal_frames_)),
+            torch::empty({max_terminal_frames_, 1}, torch::kInt64)};
+  }
+
+  // True if no one else holds the buffer's tensors or views of them, i.e.
+  // the learner queue batched the rollout that was last written into it.
+  static bool is_free(RolloutBuffer& buffer) {
+    bool free = buffer.terminal_index.use_count() == 1 &&
+                buffer.terminal_index.storage().use_count() == 1;
+    auto check = [&free](const torch::Tensor& t) {
+      free = free && t.use_count() == 1 && t.storage().use_count() == 1;
+    };
+    buffer.rollout.for_each(check);
+    buffer.terminal_obs.for_each(check);
+    return free;
+  }
+
+  // A [1, 1, ...] view of row t of buffer.
+  static TensorNest row(const TensorNest& buffer, int64_t t) {
+    return buffer.map(
+        [t](const torch::Tensor& b) { return b.narrow(0, t, 1); });
+  }
+
+  static void write_row(TensorNest& buffer, int64_t t, const TensorNest& value) {
+    TensorNest::for_each(
+        [t](torch::Tensor& dst, const torch::Tensor& src) {
+          dst.narrow(0, t, 1).copy_(src);
+        },
+        buffer, value);
+  }
+
+  // Like step_pb_to_nest, but copies into row t of env_buffer. Neither the
+  // observation nor the scalars allocate tensor storage.
+  static void write_step(TensorNest& env_buffer, int64_t t,
+                         rpcenv::Step* step_pb) {
+    std::vector<TensorNest>& fields = env_buffer.get_vector();
+    write_row(fields[0], t,
+              nest_pb_to_nest(step_pb->mutable_observation(), array_pb_to_view));
+    fields[1].front().data_ptr<float>()[t] = step_pb->reward();
+    fields[2].front().data_ptr<bool>()[t] = step_pb->done();
+    fields[3].front().data_ptr<int32_t>()[t] = step_pb->episode_step();
+    fields[4].front().data_ptr<float>()[t] = step_pb->episode_return();
+  }
+
+  // Canvases are images in [0, 1] quantized to 256 levels, storing them as
+  // uint8 is lossless. The learner decodes them on its device.
+  static void compress_canvas(TensorNest& obs) {
+    auto* map = std::get_if<std::map<std::string, TensorNest>>(&obs.value);
+    if (map == nullptr) return;
+    auto it = map->find("canvas");
+    if (it == map->end()) return;
+
+    torch::Tensor& canvas = it->second.front();
+    canvas = canvas.mul(255).round_().to(torch::kUInt8);
+  }
+
   static TensorNest array_pb_to_nest(rpcenv::NDArray* array_pb) {
     std::vector<int64_t> shape = {1, 1};  // [T=1, B=1].
     for (int i = 0, length = array_pb->shape_size(); i < length; ++i) {
@@ -521,6 +734,18 @@ class ActorPool {
         /*deleter=*/[data](void*) { delete data; }, dtype));
   }
 
+  // A view of the array's data, only valid until array_pb is modified.
+  static TensorNest array_pb_to_view(rpcenv::NDArray* array_pb) {
+    std::vector<int64_t> shape = {1, 1};  // [T=1, B=1].
+    for (int i = 0, length = array_pb->shape_size(); i < length; ++i) {
+      shape.push_back(array_pb->shape(i));
+    }
+    at::ScalarType dtype = torch::utils::numpy_dtype_to_aten(array_pb->dtype());
+
+    return TensorNest(torch::from_blob(
+        const_cast<char*>(array_pb->data().data()), shape, dtype));
+  }
+
   static TensorNest step_pb_to_nest(rpcenv::Step* step_pb) {
     TensorNest done = TensorNest(
         torch::full({1, 1}, step_pb->done(), torch::dtype(torch::kBool)));
@@ -586,6 +811,13 @@ class ActorPool {
   }
 
   std::atomic_uint64_t count_;
+  std::atomic_uint64_t env_step_count_{0};
+  std::atomic_uint64_t env_step_ns_{0};
+  std::atomic_uint64_t rpc_count_{0};
+  std::atomic_uint64_t rpc_ns_{0};
+  std::atomic_uint64_t inference_count_{0};
+  std::atomic_uint64_t inference_ns_{0};
+  std::atomic_uint64_t terminal_frames_dropped_{0};
 
   const int unroll_length_;
   std::shared_ptr<BatchingQueue<>> learner_queue_;
@@ -593,6 +825,8 @@ class ActorPool {
   std::shared_ptr<DynamicBatcher> inference_batcher_;
   const std::vector<std::string> env_server_addresses_;
   TensorNest initial_agent_state_;
+  const bool compress_rollouts_;
+  const int64_t max_terminal_frames_;
 };
 
 void init_actorpool(py::module& m) {
@@ -605,15 +839,18 @@ void init_actorpool(py::module& m) {
                     std::shared_ptr<BatchingQueue<>>,
                     std::shared_ptr<DynamicBatcher>, 
 		    std::vector<std::string>,
-                    TensorNest>(),
+                    TensorNest, bool, std::optional<int64_t>>(),
            py::arg("unroll_length"), 
 	   py::arg("learner_queue").none(false),
 	   py::arg("replay_queue").none(false),
            py::arg("inference_batcher").none(false),
            py::arg("env_server_addresses"),
-      	   py::arg("initial_agent_state"))
+      	   py::arg("initial_agent_state"),
+           py::arg("compress_rollouts") = false,
+           py::arg("max_terminal_frames") = std::nullopt)
       .def("run", &ActorPool::run, py::call_guard<py::gil_scoped_release>())
-      .def("count", &ActorPool::count);
+      .def("count", &ActorPool::count)
+      .def("counters", &ActorPool::counters);
 
   py::class_<DynamicBatcher::Batch, std::shared_ptr<DynamicBatcher::Batch>>(
       m, "Batch")
@@ -623,20 +860,25 @@ void init_actorpool(py::module& m) {
 
   py::class_<DynamicBatcher, std::shared_ptr<DynamicBatcher>>(m,
                                                               "DynamicBatcher")
-      .def(py::init<int64_t, int64_t, int64_t, std::optional<int>, bool>(),
+      .def(py::init<int64_t, int64_t, int64_t, std::optional<int>, bool,
+                    bool>(),
            py::arg("batch_dim") = 1, py::arg("minimum_batch_size") = 1,
            py::arg("maximum_batch_size") = 1024, py::arg("timeout_ms") = 100,
-           py::arg("check_outputs") = true, R"docstring(
+           py::arg("check_outputs") = true, py::arg("compact_outputs") = false,
+           R"docstring(
              DynamicBatcher class.
              If timeout_ms is set to None, the batcher will not allow data to be
              retrieved until at least minimum_batch_size inputs are provided.
              If timeout_ms is not None (default behaviour), the batcher will
              allow data to be retrieved when the timeout expires, even if the
              number of inputs received is smaller than minimum_batch_size.
+             If compact_outputs is set, compute returns copies of its entry
+             instead of views that keep the whole batched output alive.
            )docstring")
       .def("close", &DynamicBatcher::close)
       .def("is_closed", &DynamicBatcher::is_closed)
       .def("size", &DynamicBatcher::size)
+      .def("counters", &DynamicBatcher::counters)
       .def("compute", &DynamicBatcher::compute,
            py::call_guard<py::gil_scoped_release>())
       .def("__iter__",
@@ -656,6 +898,11 @@ void init_actorpool(py::module& m) {
            [](std::shared_ptr<BatchingQueue<>> queue, TensorNest tensors) {
              queue->enqueue({std::move(tensors), Empty()});
            })
+      .def("try_enqueue",
+           [](std::shared_ptr<BatchingQueue<>> queue, TensorNest tensors) {
+             return queue->try_enqueue({std::move(tensors), Empty()});
+           })
+      .def("num_dropped", &BatchingQueue<>::num_dropped)
       .def("close", &BatchingQueue<>::close)
       .def("is_closed", &BatchingQueue<>::is_closed)
       .def("size", &BatchingQueue<>::size)
@@ -20,8 +20,10 @@ namespace py = pybind11;
 
 void init_actorpool(py::module &);
 void init_rpcenv(py::module &);
+void init_tensor_nest(py::module &);
 
 PYBIND11_MODULE(_C, m) {
   init_actorpool(m);
   init_rpcenv(m);
+  init_tensor_nest(m);
 }
@@ -14,6 +14,7 @@
  * limitations under the License.
  */
 
+#include <chrono>
 #include <iostream>
 #include <tuple>
 
@@ -98,9 +99,12 @@ class EnvServer {
           }
         }
         try {
+          auto start = std::chrono::steady_clock::now();
           // I'm not sure if this is fast, but it's convienient.
 	  set_observation_reward_done(*stepfunc(nest_pb_to_nest(
 	      action_pb.mutable_nest_action(), array_pb_to_nest)));
+          std::chrono::duration<float> step_time =
+              std::chrono::steady_clock::now() - start;
 
           episode_step += 1;
           episode_return += reward;
@@ -110,6 +114,7 @@ class EnvServer {
           step_pb.set_done(done);
           step_pb.set_episode_step(episode_step);
           step_pb.set_episode_return(episode_return);
+          step_pb.set_step_time(step_time.count());
         } catch (const pybind11::error_already_set &e) {
           std::cerr << e.what() << std::endl;
           return grpc::Status(grpc::INTERNAL, e.what());
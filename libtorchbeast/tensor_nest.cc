@@ -0,0 +1,57 @@
+/*
+ * Copyright urw7rs
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+// Nest versions of common tensor functions. Unlike nest.map with a Python
+// function, these don't enter the interpreter for each tensor and run
+// without the GIL.
+
+#include <torch/extension.h>
+
+#include "tensor_nest.h"
+
+#include "../nest/nest/nest_pybind.h"
+
+namespace py = pybind11;
+
+void init_tensor_nest(py::module& m) {
+  py::module sub = m.def_submodule(
+      "tensor_nest", "Tensor functions applied to all tensors of a nest.");
+
+  sub.def("batch", &tensor_nest::batch, py::arg("nests"),
+          py::arg("batch_dim") = 1, py::call_guard<py::gil_scoped_release>(),
+          "Concatenates the corresponding tensors of nests of the same "
+          "structure along batch_dim, as BatchingQueue does.");
+  sub.def("cat", &tensor_nest::batch, py::arg("nests"), py::arg("dim") = 0,
+          py::call_guard<py::gil_scoped_release>(),
+          "torch.cat of the corresponding tensors of nests of the same "
+          "structure.");
+  sub.def("stack", &tensor_nest::stack, py::arg("nests"), py::arg("dim") = 0,
+          py::call_guard<py::gil_scoped_release>(),
+          "torch.stack of the corresponding tensors of nests of the same "
+          "structure.");
+  sub.def("to", &tensor_nest::to, py::arg("nest"), py::arg("device"),
+          py::arg("non_blocking") = false, py::arg("copy") = false,
+          py::call_guard<py::gil_scoped_release>(),
+          "Tensor.to(device) of all tensors.");
+  sub.def("slice", &tensor_nest::slice, py::arg("nest"), py::arg("dim"),
+          py::arg("start") = py::none(), py::arg("end") = py::none(),
+          py::arg("step") = 1, py::call_guard<py::gil_scoped_release>(),
+          "The view of all tensors at start:end:step along dim.");
+  sub.def("flatten", &tensor_nest::flatten, py::arg("nest"),
+          py::arg("start_dim") = 0, py::arg("end_dim") = -1,
+          py::call_guard<py::gil_scoped_release>(),
+          "torch.flatten of all tensors.");
+}
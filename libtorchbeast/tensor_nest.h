@@ -0,0 +1,69 @@
+/*
+ * Copyright urw7rs
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+#pragma once
+
+#include <optional>
+#include <vector>
+
+#include <torch/extension.h>
+
+#include "../nest/nest/nest.h"
+
+typedef nest::Nest<torch::Tensor> TensorNest;
+
+namespace tensor_nest {
+
+// Concatenates corresponding tensors of the nests along batch_dim.
+inline TensorNest batch(const std::vector<TensorNest>& tensors,
+                        int64_t batch_dim) {
+  // TODO(heiner): Consider using accessors and writing slices ourselves.
+  nest::Nest<std::vector<torch::Tensor>> zipped = TensorNest::zip(tensors);
+  return zipped.map([batch_dim](const std::vector<torch::Tensor>& v) {
+    return torch::cat(v, batch_dim);
+  });
+}
+
+inline TensorNest stack(const std::vector<TensorNest>& tensors, int64_t dim) {
+  nest::Nest<std::vector<torch::Tensor>> zipped = TensorNest::zip(tensors);
+  return zipped.map([dim](const std::vector<torch::Tensor>& v) {
+    return torch::stack(v, dim);
+  });
+}
+
+inline TensorNest to(const TensorNest& n, torch::Device device,
+                     bool non_blocking = false, bool copy = false) {
+  return n.map([&device, non_blocking, copy](const torch::Tensor& t) {
+    return t.to(device, non_blocking, copy);
+  });
+}
+
+inline TensorNest slice(const TensorNest& n, int64_t dim,
+                        std::optional<int64_t> start,
+                        std::optional<int64_t> end, int64_t step = 1) {
+  return n.map([dim, start, end, step](const torch::Tensor& t) {
+    return t.slice(dim, start, end, step);
+  });
+}
+
+inline TensorNest flatten(const TensorNest& n, int64_t start_dim = 0,
+                          int64_t end_dim = -1) {
+  return n.map([start_dim, end_dim](const torch::Tensor& t) {
+    return torch::flatten(t, start_dim, end_dim);
+  });
+}
+
+}  // namespace tensor_nest
@@ -16,11 +16,15 @@
 
 #pragma once
 
+#include <algorithm>
 #include <deque>
+#include <iterator>
 #include <map>
 #include <memory>
+#include <stdexcept>
 #include <string>
 #include <variant>
+#include <vector>
 
 namespace nest {
 // Magic from https://en.cppreference.com/w/cpp/utility/variant/visit
@@ -323,4 +327,110 @@ struct Nest {
         nest1.value, nest2.value);
   }
 };
+
+// The shape of a nest without its leaves: its vectors, maps and their keys,
+// as nodes in the order flatten visits them. Nests that don't change
+// shape can be packed from it without walking another nest.
+class Structure {
+ public:
+  enum class Kind { LEAF, VECTOR, MAP };
+
+  struct Node {
+    Kind kind;
+    size_t size;                    // Number of children.
+    std::vector<std::string> keys;  // Sorted, only for maps.
+
+    bool operator==(const Node &other) const {
+      return kind == other.kind && size == other.size && keys == other.keys;
+    }
+  };
+
+  Structure() = default;
+
+  template <typename T>
+  explicit Structure(const Nest<T> &n) {
+    add(n);
+  }
+
+  void add_leaf() {
+    nodes_.push_back({Kind::LEAF, 0, {}});
+    ++num_leaves_;
+  }
+  void add_vector(size_t size) { nodes_.push_back({Kind::VECTOR, size, {}}); }
+  void add_map(std::vector<std::string> keys) {
+    size_t size = keys.size();
+    nodes_.push_back({Kind::MAP, size, std::move(keys)});
+  }
+
+  const std::vector<Node> &nodes() const { return nodes_; }
+  size_t num_leaves() const { return num_leaves_; }
+
+  bool operator==(const Structure &other) const {
+    return nodes_ == other.nodes_;
+  }
+  bool operator!=(const Structure &other) const { return !(*this == other); }
+
+  template <typename T, class InputIt>
+  Nest<T> pack(InputIt first, InputIt last) const {
+    if (std::distance(first, last) != (std::ptrdiff_t)num_leaves_) {
+      throw std::invalid_argument(
+          "Expected " + std::to_string(num_leaves_) + " elements but got " +
+          std::to_string(std::distance(first, last)));
+    }
+    size_t node = 0;
+    return pack<T>(&node, &first);
+  }
+
+ private:
+  template <typename T>
+  void add(const Nest<T> &n) {
+    std::visit(overloaded{[this](const T &) { add_leaf(); },
+                          [this](const std::vector<Nest<T>> &v) {
+                            add_vector(v.size());
+                            for (const Nest<T> &child : v) {
+                              add(child);
+                            }
+                          },
+                          [this](const std::map<std::string, Nest<T>> &m) {
+                            std::vector<std::string> keys;
+                            keys.reserve(m.size());
+                            for (auto &p : m) {
+                              keys.push_back(p.first);
+                            }
+                            add_map(std::move(keys));
+                            for (auto &p : m) {
+                              add(p.second);
+                            }
+                          }},
+               n.value);
+  }
+
+  template <typename T, class InputIt>
+  Nest<T> pack(size_t *node, InputIt *first) const {
+    const Node &n = nodes_[(*node)++];
+    switch (n.kind) {
+      case Kind::LEAF:
+        return Nest<T>(*(*first)++);
+      case Kind::VECTOR: {
+        std::vector<Nest<T>> result;
+        result.reserve(n.size);
+        for (size_t i = 0; i < n.size; ++i) {
+          result.emplace_back(pack<T>(node, first));
+        }
+        return Nest<T>(std::move(result));
+      }
+      case Kind::MAP: {
+        std::map<std::string, Nest<T>> result;
+        for (const std::string &key : n.keys) {
+          result.emplace_hint(result.end(), key, pack<T>(node, first));
+        }
+        return Nest<T>(std::move(result));
+      }
+    }
+    throw std::logic_error("Unknown node kind");
+  }
+
+  std::vector<Node> nodes_;
+  size_t num_leaves_ = 0;
+};
 }  // namespace nest
@@ -14,7 +14,10 @@
  * limitations under the License.
  */
 
+#include <algorithm>
+
 #include <pybind11/functional.h>
+#include <pybind11/operators.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 
@@ -40,6 +43,132 @@ class py_list_back_inserter {
   py::list *list_;
 };
 
+// A nest::Structure of Python nests, that flattens and packs them by
+// walking its nodes instead of converting to and from nest::Nest. Map keys
+// are kept as Python strings, so flattening is a dict lookup per key.
+class PyStructure {
+ public:
+  explicit PyStructure(const py::handle &n) { add(n); }
+
+  size_t num_leaves() const { return structure_.num_leaves(); }
+
+  py::list flatten(const py::handle &n) const {
+    py::list result(structure_.num_leaves());
+    size_t node = 0;
+    size_t leaf = 0;
+    flatten_into(n, &node, result, &leaf);
+    return result;
+  }
+
+  py::object pack(const py::sequence &sequence) const {
+    py::object leaves = py::reinterpret_steal<py::object>(
+        PySequence_Fast(sequence.ptr(), "Expected a sequence"));
+    if (!leaves) throw py::error_already_set();
+
+    size_t size = PySequence_Fast_GET_SIZE(leaves.ptr());
+    if (size != structure_.num_leaves()) {
+      throw py::value_error("Expected " +
+                            std::to_string(structure_.num_leaves()) +
+                            " elements but got " + std::to_string(size));
+    }
+    PyObject **items = PySequence_Fast_ITEMS(leaves.ptr());
+    size_t node = 0;
+    return pack_from(&node, &items);
+  }
+
+  bool operator==(const PyStructure &other) const {
+    return structure_ == other.structure_;
+  }
+
+ private:
+  void add(const py::handle &n) {
+    if (py::isinstance<py::tuple>(n) || py::isinstance<py::list>(n)) {
+      py::sequence seq = py::reinterpret_borrow<py::sequence>(n);
+      structure_.add_vector(seq.size());
+      keys_.emplace_back();
+      for (const py::handle &child : seq) {
+        add(child);
+      }
+    } else if (py::isinstance<py::dict>(n)) {
+      // Sorted like nest::Nest's std::map, so the order matches nest.flatten.
+      std::vector<std::string> keys;
+      for (const auto &p : py::reinterpret_borrow<py::dict>(n)) {
+        keys.push_back(p.first.cast<std::string>());
+      }
+      std::sort(keys.begin(), keys.end());
+      std::vector<py::object> py_keys;
+      for (const std::string &key : keys) {
+        py_keys.push_back(py::str(key));
+      }
+      structure_.add_map(std::move(keys));
+      keys_.push_back(std::move(py_keys));
+      for (const py::object &key : keys_.back()) {
+        add(n[key]);
+      }
+    } else {
+      structure_.add_leaf();
+      keys_.emplace_back();
+    }
+  }
+
+  void flatten_into(const py::handle &n, size_t *node, py::list &result,
+                    size_t *leaf) const {
+    size_t index = (*node)++;
+    const nest::Structure::Node &s = structure_.nodes()[index];
+    switch (s.kind) {
+      case nest::Structure::Kind::LEAF:
+        PyList_SET_ITEM(result.ptr(), (*leaf)++, n.inc_ref().ptr());
+        return;
+      case nest::Structure::Kind::VECTOR: {
+        py::object seq = py::reinterpret_steal<py::object>(
+            PySequence_Fast(n.ptr(), "Expected a sequence"));
+        if (!seq) throw py::error_already_set();
+        if ((size_t)PySequence_Fast_GET_SIZE(seq.ptr()) != s.size) {
+          throw py::value_error("Expected a sequence of length " +
+                                std::to_string(s.size));
+        }
+        PyObject **items = PySequence_Fast_ITEMS(seq.ptr());
+        for (size_t i = 0; i < s.size; ++i) {
+          flatten_into(items[i], node, result, leaf);
+        }
+        return;
+      }
+      case nest::Structure::Kind::MAP:
+        for (const py::object &key : keys_[index]) {
+          flatten_into(n[key], node, result, leaf);
+        }
+        return;
+    }
+  }
+
+  py::object pack_from(size_t *node, PyObject ***items) const {
+    size_t index = (*node)++;
+    const nest::Structure::Node &s = structure_.nodes()[index];
+    switch (s.kind) {
+      case nest::Structure::Kind::LEAF:
+        return py::reinterpret_borrow<py::object>(*(*items)++);
+      case nest::Structure::Kind::VECTOR: {
+        py::tuple result(s.size);
+        for (size_t i = 0; i < s.size; ++i) {
+          PyTuple_SET_ITEM(result.ptr(), i, pack_from(node, items).release().ptr());
+        }
+        return std::move(result);
+      }
+      case nest::Structure::Kind::MAP: {
+        py::dict result;
+        for (const py::object &key : keys_[index]) {
+          result[key] = pack_from(node, items);
+        }
+        return std::move(result);
+      }
+    }
+    throw std::logic_error("Unknown node kind");
+  }
+
+  nest::Structure structure_;
+  std::vector<std::vector<py::object>> keys_;  // Per node, empty if no map.
+};
+
 PYBIND11_MODULE(nest, m) {
   m.def("map", [](py::function f, const PyNest &n) {
     // This says const py::object, but f can actually modify it!
@@ -77,4 +206,18 @@ PYBIND11_MODULE(nest, m) {
     }
   });
   m.def("front", [](const PyNest &n) { return n.front(); });
+
+  py::class_<PyStructure>(m, "Structure")
+      .def(py::init<const py::handle &>(), py::arg("nest"))
+      .def("flatten", &PyStructure::flatten, py::arg("nest"),
+           "Leaves of a nest of this structure, like nest.flatten.")
+      .def("pack", &PyStructure::pack, py::arg("sequence"),
+           "A nest of this structure with leaves from sequence, like "
+           "nest.pack_as.")
+      .def_property_readonly("num_leaves", &PyStructure::num_leaves)
+      .def(py::self == py::self);
+  m.def(
+      "structure", [](const py::handle &n) { return PyStructure(n); },
+      "The structure of a nest, to flatten and pack nests of the same "
+      "structure without looking at it again.");
 }
@@ -83,7 +83,7 @@ class BuildExt(setuptools.command.build_ext.build_ext):
 
 setuptools.setup(
     name="nest",
-    version="0.0.3",
+    version="0.0.4",
     author="TorchBeast team",
     ext_modules=ext_modules,
     headers=["nest/nest.h", "nest/nest_pybind.h"],
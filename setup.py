@@ -116,6 +116,7 @@ def main():
             "libtorchbeast/libtorchbeast.cc",
             "libtorchbeast/actorpool.cc",
             "libtorchbeast/rpcenv.cc",
+            "libtorchbeast/tensor_nest.cc",
             "libtorchbeast/rpcenv.pb.cc",
             "libtorchbeast/rpcenv.grpc.pb.cc",
         ],
@@ -71,6 +71,24 @@ class BatchingQueueTest(unittest.TestCase):
         batch = next(queue)
         np.testing.assert_array_equal(batch, inputs)
 
+    def test_try_enqueue_drops_when_full(self):
+        queue = libtorchbeast.BatchingQueue(
+            batch_dim=0,
+            minimum_batch_size=1,
+            maximum_batch_size=1,
+            maximum_queue_size=1,
+        )
+
+        self.assertTrue(queue.try_enqueue(torch.zeros(1, 2)))
+        self.assertFalse(queue.try_enqueue(torch.ones(1, 2)))
+        self.assertEqual(queue.num_dropped(), 1)
+
+        batch = next(queue)
+        np.testing.assert_array_equal(batch, torch.zeros(1, 2))
+
+        self.assertTrue(queue.try_enqueue(torch.ones(1, 2)))
+        self.assertEqual(queue.num_dropped(), 1)
+
     def test_batched_run(self, batch_size=2):
         queue = libtorchbeast.BatchingQueue(
             batch_dim=0, minimum_batch_size=batch_size, maximum_batch_size=batch_size
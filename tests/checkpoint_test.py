@@ -0,0 +1,243 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for asynchronous checkpointing."""
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import torch
+from torch import nn
+from torchbeast.core import checkpoint
+
+
+class AsyncCheckpointerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "model.tar")
+
+        torch.manual_seed(0)
+        self.model = nn.Linear(3, 2)
+        self.optimizer = torch.optim.Adam(self.model.parameters())
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _state(self, step):
+        return {
+            "model_state_dict": self.model.state_dict(),
+            "optimizer_state_dict": self.optimizer.state_dict(),
+            "stats": {"step": step},
+        }
+
+    def _step(self):
+        self.optimizer.zero_grad()
+        self.model(torch.ones(1, 3)).sum().backward()
+        self.optimizer.step()
+
+    def test_bad_construct(self):
+        with self.assertRaisesRegex(ValueError, "at least one"):
+            checkpoint.AsyncCheckpointer(self.path, keep=0)
+
+    def test_snapshot(self):
+        checkpointer = checkpoint.AsyncCheckpointer(self.path)
+        self.assertFalse(checkpointer.exists())
+
+        weight = self.model.weight.detach().clone()
+        checkpointer.save(self._state(0))
+        # Later updates don't change the saved snapshot.
+        self._step()
+        checkpointer.close()
+
+        self.assertTrue(checkpointer.exists())
+        state = checkpointer.load()
+        torch.testing.assert_close(state["model_state_dict"]["weight"], weight)
+        self.assertEqual(state["stats"], {"step": 0})
+
+    def test_keep(self):
+        checkpointer = checkpoint.AsyncCheckpointer(self.path, keep=3)
+        for step in range(5):
+            checkpointer.save(self._state(step))
+            checkpointer.wait()
+        checkpointer.close()
+
+        self.assertEqual(
+            sorted(os.listdir(self.tmpdir.name)),
+            ["model.tar", "model.tar.1", "model.tar.2"],
+        )
+        for suffix, step in [("", 4), (".1", 3), (".2", 2)]:
+            state = torch.load(self.path + suffix)
+            self.assertEqual(state["stats"], {"step": step})
+
+    def test_per_component(self):
+        checkpointer = checkpoint.AsyncCheckpointer(self.path, per_component=True)
+        checkpointer.save(self._state(0))
+        checkpointer.wait()
+
+        component_dir = os.path.join(self.tmpdir.name, "model.tar.d")
+        manifest = checkpoint.read_manifest(component_dir)
+        self.assertEqual(
+            sorted(manifest), ["model_state_dict", "optimizer_state_dict", "stats"]
+        )
+        self.assertEqual(
+            sorted(os.listdir(component_dir)),
+            sorted(list(manifest.values()) + ["manifest.json"]),
+        )
+        model_path = os.path.join(component_dir, manifest["model_state_dict"])
+        os.utime(model_path, (0, 0))
+
+        # Only stats changed, the model file isn't rewritten.
+        checkpointer.save(self._state(1))
+        checkpointer.close()
+        self.assertEqual(os.stat(model_path).st_mtime, 0)
+        self.assertEqual(
+            checkpoint.read_manifest(component_dir)["model_state_dict"],
+            manifest["model_state_dict"],
+        )
+
+        state = checkpointer.load()
+        self.assertEqual(state["stats"], {"step": 1})
+        torch.testing.assert_close(
+            state["model_state_dict"]["weight"], self.model.weight.detach()
+        )
+
+    def test_per_component_keep(self):
+        checkpointer = checkpoint.AsyncCheckpointer(
+            self.path, keep=2, per_component=True
+        )
+        for step in range(4):
+            self._step()
+            checkpointer.save(self._state(step))
+            checkpointer.wait()
+        checkpointer.close()
+
+        # Two saves are kept, the files of older ones are removed.
+        component_dir = self.path + ".d"
+        manifests = [
+            checkpoint.read_manifest(component_dir, suffix) for suffix in ["", ".1"]
+        ]
+        files = set()
+        for manifest in manifests:
+            files.update(manifest.values())
+        self.assertEqual(
+            sorted(os.listdir(component_dir)),
+            sorted(files | {"manifest.json", "manifest.json.1"}),
+        )
+        self.assertEqual(len(files), 6)
+
+        state = torch.load(os.path.join(component_dir, manifests[1]["stats"]))
+        self.assertEqual(state, {"step": 2})
+
+    def test_per_component_interrupted(self):
+        checkpointer = checkpoint.AsyncCheckpointer(self.path, per_component=True)
+        checkpointer.save(self._state(0))
+        checkpointer.wait()
+        weight = self.model.weight.detach().clone()
+
+        # Dies after writing the components, before the manifest.
+        self._step()
+        with mock.patch.object(
+            checkpoint, "replace_rotating", side_effect=OSError("crash")
+        ):
+            checkpointer.save(self._state(1))
+            checkpointer.wait()
+        checkpointer.close()
+
+        # Loads step 0 entirely rather than mixing it with step 1.
+        state = checkpointer.load()
+        self.assertEqual(state["stats"], {"step": 0})
+        torch.testing.assert_close(state["model_state_dict"]["weight"], weight)
+
+    def test_save_doesnt_block(self):
+        checkpointer = checkpoint.AsyncCheckpointer(self.path)
+        write = checkpointer._write
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_write(state, path):
+            started.set()
+            release.wait()
+            write(state, path)
+
+        with mock.patch.object(checkpointer, "_write", slow_write):
+            checkpointer.save(self._state(0))
+            started.wait()
+            # The writer is busy, newer snapshots replace the pending one.
+            for step in range(1, 4):
+                checkpointer.save(self._state(step))
+            release.set()
+            checkpointer.close()
+
+        self.assertEqual(checkpointer.load()["stats"], {"step": 3})
+
+
+class LoadCheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "model.tar")
+
+        torch.manual_seed(0)
+        self.state = {
+            "flags": {"batch_size": 4},
+            "model_state_dict": nn.Linear(3, 2).state_dict(),
+            "D_state_dict": nn.Linear(2, 1).state_dict(),
+            "optimizer_state_dict": {"state": {}},
+        }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_bad_components(self):
+        with self.assertRaisesRegex(ValueError, "Unknown checkpoint components"):
+            checkpoint.load_checkpoint(self.path, "optimizer")
+
+    def test_components(self):
+        torch.save(self.state, self.path)
+
+        state = checkpoint.load_checkpoint(self.path, "model")
+        self.assertEqual(sorted(state), ["flags", "model_state_dict"])
+        torch.testing.assert_close(
+            state["model_state_dict"]["weight"],
+            self.state["model_state_dict"]["weight"],
+        )
+
+        state = checkpoint.load_checkpoint(self.path, "model+D")
+        self.assertEqual(sorted(state), ["D_state_dict", "flags", "model_state_dict"])
+
+        state = checkpoint.load_checkpoint(self.path)
+        self.assertEqual(sorted(state), sorted(self.state))
+
+    def test_per_component(self):
+        checkpointer = checkpoint.AsyncCheckpointer(self.path, per_component=True)
+        checkpointer.save(self.state)
+        checkpointer.close()
+
+        # Components that aren't requested are never read.
+        component_dir = self.path + ".d"
+        filename = checkpoint.read_manifest(component_dir)["optimizer_state_dict"]
+        with open(os.path.join(component_dir, filename), "w") as f:
+            f.write("corrupt")
+
+        state = checkpoint.load_checkpoint(self.path, "model+D")
+        self.assertEqual(sorted(state), ["D_state_dict", "flags", "model_state_dict"])
+        self.assertEqual(state["flags"], {"batch_size": 4})
+
+        with self.assertRaises(Exception):
+            checkpoint.load_checkpoint(self.path, "full")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -49,6 +49,55 @@ class DynamicBatcherTest(unittest.TestCase):
 
         t.join()
 
+    def test_counters(self):
+        batcher = libtorchbeast.DynamicBatcher(
+            batch_dim=0, minimum_batch_size=2, maximum_batch_size=2
+        )
+        self.assertEqual(batcher.counters()["batch_count"], 0)
+
+        inputs = torch.zeros(1, 2, 3)
+        threads = [
+            threading.Thread(target=batcher.compute, args=(inputs,)) for _ in range(2)
+        ]
+        for t in threads:
+            t.start()
+
+        batch = next(batcher)
+        batch.set_outputs(torch.ones(2, 3))
+        for t in threads:
+            t.join()
+
+        counters = batcher.counters()
+        self.assertEqual(counters["batch_count"], 1)
+        self.assertEqual(counters["batch_items"], 2)
+        self.assertEqual(counters["dequeue_count"], 1)
+        self.assertGreater(counters["dequeue_ns"], 0)
+
+    def test_compact_outputs(self):
+        outputs = torch.arange(6.0).view(1, 6)
+        for compact_outputs in [False, True]:
+            batcher = libtorchbeast.DynamicBatcher(
+                batch_dim=0,
+                minimum_batch_size=1,
+                maximum_batch_size=1,
+                compact_outputs=compact_outputs,
+            )
+            results = []
+
+            def target():
+                results.append(batcher.compute(torch.zeros(1, 2)))
+
+            thread = threading.Thread(target=target)
+            thread.start()
+            next(batcher).set_outputs(outputs)
+            thread.join()
+
+            np.testing.assert_array_equal(results[0], outputs)
+            # Views share the storage of the batched outputs, copies don't.
+            self.assertEqual(
+                results[0].data_ptr() == outputs.data_ptr(), not compact_outputs
+            )
+
     def test_timeout(self):
         timeout_ms = 300
         batcher = libtorchbeast.DynamicBatcher(
@@ -0,0 +1,111 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-step overhead of the observation wrappers, chained versus fused.
+
+Also compares full with incremental warping on a canvas that changes by a
+small stroke each step.
+
+Usage: python env_wrapper_profiling.py [steps] [canvas_width]
+"""
+
+import logging
+import sys
+import timeit
+
+import torch
+from torch.utils.data import TensorDataset
+
+sys.path.append("..")
+from torchbeast import utils
+from env_wrapper_test import CanvasEnv, StrokeEnv
+
+logging.basicConfig(
+    format=(
+        "[%(levelname)s:%(process)d %(module)s:%(lineno)d %(asctime)s] " "%(message)s"
+    ),
+    level=0,
+)
+
+steps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+canvas_width = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+
+
+class StaticCanvasEnv(CanvasEnv):
+    """Returns the same frame every step, so timings are the wrappers'."""
+
+    def __init__(self, canvas_width):
+        super().__init__(canvas_width)
+        self._canvas = super()._obs()["canvas"]
+
+    def _obs(self):
+        return {"canvas": self._canvas}
+
+
+def time_steps(env):
+    action = env.action_space.sample()
+    env.reset()
+    start = timeit.default_timer()
+    for _ in range(steps):
+        env.step(action)
+    return 1e6 * (timeit.default_timer() - start) / steps
+
+
+def main():
+    logging.info("steps=%i, canvas_width=%i", steps, canvas_width)
+    config = dict(canvas_width=canvas_width)
+    dataset = TensorDataset(torch.rand(1, 1, 64, 64), torch.zeros(1))
+
+    raw = time_steps(StaticCanvasEnv(canvas_width))
+    logging.info("raw env %8.1fus/step", raw)
+
+    for name, kwargs in [
+        ("grayscale", dict(grayscale=True)),
+        ("color", dict(grayscale=False)),
+        ("grayscale+target", dict(grayscale=True, dataset=dataset)),
+    ]:
+        overheads = []
+        for fused in [False, True]:
+            env = utils.wrap_env(
+                StaticCanvasEnv(canvas_width), config, fused_observation=fused, **kwargs
+            )
+            overheads.append(time_steps(env) - raw)
+        logging.info(
+            "%-16s chained %8.1fus/step fused %8.1fus/step (%.2fx)",
+            name,
+            overheads[0],
+            overheads[1],
+            overheads[0] / overheads[1],
+        )
+
+    raw = time_steps(StrokeEnv(canvas_width))
+    overheads = []
+    for incremental in [False, True]:
+        env = utils.wrap_env(
+            StrokeEnv(canvas_width),
+            config,
+            fused_observation=True,
+            incremental_warp=incremental,
+        )
+        overheads.append(time_steps(env) - raw)
+    logging.info(
+        "%-16s full    %8.1fus/step incr. %8.1fus/step (%.2fx)",
+        "strokes",
+        overheads[0],
+        overheads[1],
+        overheads[0] / overheads[1],
+    )
+
+
+if __name__ == "__main__":
+    main()
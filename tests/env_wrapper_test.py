@@ -0,0 +1,167 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the fused and incremental observation wrappers."""
+
+import unittest
+
+import gym
+import numpy as np
+import torch
+from gym import spaces
+from torch.utils.data import TensorDataset
+from torchbeast import env_wrapper, utils
+
+
+class CanvasEnv(gym.Env):
+    """Random uint8 canvases with a painting environment's action space."""
+
+    def __init__(self, canvas_width=256, num_colors=3):
+        # Wrappers replace entries of the observation space in place.
+        self._shape = (canvas_width, canvas_width, num_colors)
+        self.observation_space = spaces.Dict(
+            {
+                "canvas": spaces.Box(
+                    low=0,
+                    high=255,
+                    shape=self._shape,
+                    dtype=np.uint8,
+                )
+            }
+        )
+        self.action_space = spaces.MultiDiscrete([2, 1024, 1024, 6])
+        self._rng = np.random.RandomState(0)
+
+    def _obs(self):
+        return {"canvas": self._rng.randint(256, size=self._shape, dtype=np.uint8)}
+
+    def reset(self):
+        return self._obs()
+
+    def step(self, action):
+        return self._obs(), 0.0, False, {}
+
+
+class FusedObservationTest(unittest.TestCase):
+    def _check(self, canvas_width, num_colors, grayscale, dataset=False):
+        config = dict(canvas_width=canvas_width)
+        envs = [
+            utils.wrap_env(
+                CanvasEnv(canvas_width, num_colors),
+                config,
+                grayscale,
+                dataset,
+                fused_observation=fused,
+            )
+            for fused in [False, True]
+        ]
+        self.assertEqual(
+            envs[0].observation_space["canvas"].shape,
+            envs[1].observation_space["canvas"].shape,
+        )
+
+        action = envs[0].action_space.sample()
+        for observe in [lambda env: env.reset(), lambda env: env.step(action)[0]]:
+            # The fused canvas is overwritten by the next step.
+            expected, observed = [observe(env) for env in envs]
+            self.assertEqual(observed["canvas"].dtype, np.float32)
+            np.testing.assert_allclose(
+                expected["canvas"], observed["canvas"], rtol=1e-6
+            )
+            np.testing.assert_array_equal(
+                expected["prev_action"], observed["prev_action"]
+            )
+
+    def test_warp_grayscale(self):
+        self._check(256, 3, grayscale=True)
+
+    def test_warp_color(self):
+        self._check(256, 3, grayscale=False)
+
+    def test_no_warp(self):
+        self._check(utils.frame_width, 3, grayscale=True)
+
+    def test_target(self):
+        dataset = TensorDataset(torch.rand(1, 1, 64, 64), torch.zeros(1))
+        self._check(256, 3, grayscale=True, dataset=dataset)
+
+    def test_default_keeps_frames(self):
+        env = utils.wrap_env(CanvasEnv(256), dict(canvas_width=256))
+        first = env.reset()["canvas"]
+        expected = first.copy()
+        env.step(env.action_space.sample())
+        np.testing.assert_array_equal(first, expected)
+
+
+class StrokeEnv(CanvasEnv):
+    """Paints a small random rectangle onto a persistent canvas each step."""
+
+    def __init__(self, canvas_width=256, num_colors=3):
+        super().__init__(canvas_width, num_colors)
+        self._canvas = np.full(self._shape, 255, dtype=np.uint8)
+
+    def _obs(self):
+        return {"canvas": self._canvas.copy()}
+
+    def step(self, action):
+        y, x = self._rng.randint(self._shape[0] - 8, size=2)
+        h, w = self._rng.randint(1, 9, size=2)
+        self._canvas[y : y + h, x : x + w] = self._rng.randint(256, size=3)[
+            : self._shape[2]
+        ]
+        return super().step(action)
+
+
+class IncrementalWarpTest(unittest.TestCase):
+    def _check(self, canvas_width, num_colors, grayscale, fused):
+        config = dict(canvas_width=canvas_width)
+        envs = [
+            utils.wrap_env(
+                StrokeEnv(canvas_width, num_colors),
+                config,
+                grayscale,
+                fused_observation=fused,
+                incremental_warp=incremental,
+            )
+            for incremental in [False, True]
+        ]
+
+        action = envs[0].action_space.sample()
+        expected, observed = [env.reset()["canvas"].copy() for env in envs]
+        np.testing.assert_array_equal(expected, observed)
+        for _ in range(20):
+            expected, observed = [env.step(action)[0]["canvas"] for env in envs]
+            np.testing.assert_array_equal(expected, observed)
+
+    def test_grayscale(self):
+        self._check(256, 3, grayscale=True, fused=False)
+
+    def test_color(self):
+        self._check(256, 3, grayscale=False, fused=False)
+
+    def test_fused(self):
+        self._check(256, 3, grayscale=True, fused=True)
+
+    def test_non_integer_scale(self):
+        self._check(100, 3, grayscale=True, fused=True)
+
+    def test_unchanged(self):
+        canvas = np.random.RandomState(0).randint(256, size=(128, 128, 3))
+        canvas = canvas.astype(np.uint8)
+        warper = env_wrapper.FrameWarper(canvas.shape, 64, 64, incremental=True)
+        expected = warper(canvas).copy()
+        np.testing.assert_array_equal(warper(canvas.copy()), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the asynchronous FileWriter."""
+
+import csv
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from torchbeast.core import file_writer
+
+
+class FileWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read_last_line(self):
+        path = os.path.join(self.tmpdir.name, "lines.csv")
+        self.assertEqual(file_writer.read_last_line(path), "")
+
+        with open(path, "w") as f:
+            f.write("first\r\n")
+        self.assertEqual(file_writer.read_last_line(path), "first")
+
+        with open(path, "a") as f:
+            f.write("%s\r\nlast,line\r\n\r\n" % ("x" * 100))
+        for block_size in [1, 3, 4096]:
+            self.assertEqual(
+                file_writer.read_last_line(path, block_size=block_size), "last,line"
+            )
+
+    def test_resume(self):
+        writer = file_writer.FileWriter(
+            xpid="test", rootdir=self.tmpdir.name, symlink_to_latest=False
+        )
+        for step in range(3):
+            writer.log({"step": step})
+        writer.log({"step": 3, "loss": 1.0})
+        writer.close()
+
+        writer = file_writer.FileWriter(
+            xpid="test", rootdir=self.tmpdir.name, symlink_to_latest=False
+        )
+        self.assertEqual(writer._tick, 4)
+        self.assertEqual(writer.fieldnames, ["_tick", "_time", "step", "loss"])
+        writer.close()
+
+
+class AsyncFileWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _writer(self, **kwargs):
+        return file_writer.AsyncFileWriter(
+            xpid="test",
+            rootdir=self.tmpdir.name,
+            symlink_to_latest=False,
+            flush_interval=0.01,
+            **kwargs,
+        )
+
+    def test_bad_format(self):
+        with self.assertRaisesRegex(ValueError, "Unknown log format"):
+            self._writer(log_format="parquet")
+
+    def test_csv(self):
+        writer = self._writer()
+        stats = {"step": 0}
+        for step in range(5):
+            stats["step"] = step
+            writer.log(stats)
+        writer.log({"step": 5, "loss": 1.0})
+        writer.close()
+
+        # Rows are copied, the caller's dict isn't touched.
+        self.assertEqual(stats, {"step": 4})
+
+        with open(writer.paths["logs"]) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["# _tick", "_time", "step"])
+        self.assertEqual([row[2] for row in rows[1:]], ["0", "1", "2", "3", "4", "5"])
+        self.assertEqual(rows[-1][3], "1.0")
+
+    def test_npz(self):
+        writer = self._writer(log_format="npz", chunk_size=4)
+        for step in range(6):
+            writer.log({"step": step, "episode_returns": (1.0,) * step})
+        writer.log({"step": 6, "loss": 0.5})
+        writer.close()
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(writer.basepath, "logs"))),
+            ["logs-000000000000.npz", "logs-000000000004.npz"],
+        )
+
+        columns = file_writer.read_npz_logs(writer.basepath)
+        np.testing.assert_array_equal(columns["_tick"], np.arange(7))
+        np.testing.assert_array_equal(columns["step"], np.arange(7))
+        self.assertEqual(columns["episode_returns"][2], (1.0, 1.0))
+        self.assertTrue(np.isnan(columns["loss"][:6]).all())
+        self.assertEqual(columns["loss"][6], 0.5)
+
+    def test_npz_resume(self):
+        writer = self._writer(log_format="npz")
+        writer.log({"step": 0})
+        writer.close()
+
+        writer = self._writer(log_format="npz")
+        writer.log({"step": 1})
+        writer.close()
+
+        columns = file_writer.read_npz_logs(writer.basepath)
+        np.testing.assert_array_equal(columns["_tick"], [0, 1])
+        np.testing.assert_array_equal(columns["step"], [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
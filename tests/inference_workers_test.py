@@ -0,0 +1,88 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for inference in worker processes."""
+
+import unittest
+
+import torch
+from torch import nn
+from torchbeast.core import inference_workers
+from torchbeast.core import prof
+
+
+def forward(model, inputs):
+    (x, done), state = inputs
+    return (model(x), {"done": done.clone()}), (state + 1,)
+
+
+class Batch:
+    def __init__(self, batch_size):
+        self.inputs = (
+            (
+                torch.randn(1, batch_size, 4),
+                torch.rand(1, batch_size) > 0.5,
+            ),
+            torch.arange(batch_size, dtype=torch.float32).view(1, batch_size),
+        )
+        self.outputs = None
+
+    def get_inputs(self):
+        return self.inputs
+
+    def set_outputs(self, outputs):
+        self.outputs = outputs
+
+
+class InferenceWorkersTest(unittest.TestCase):
+    def setUp(self):
+        self.model = nn.Linear(4, 3)
+        self.workers = inference_workers.InferenceWorkers(
+            forward, self.model, num_workers=2, max_batch_size=8
+        )
+
+    def tearDown(self):
+        self.workers.join()
+
+    def serve(self, batches):
+        self.workers.start(batches, prof.ThreadSafeTimings())
+        self.workers.join()
+
+    def assertOutputs(self, batch, model):
+        with torch.no_grad():
+            (y, extra), state = forward(model, batch.inputs)
+        (r_y, r_extra), r_state = batch.outputs
+        torch.testing.assert_close(r_y, y)
+        torch.testing.assert_close(r_extra["done"], extra["done"])
+        torch.testing.assert_close(r_state[0], state[0])
+
+    def test_outputs(self):
+        batches = [Batch(b) for b in [3, 8, 1, 5, 8, 2]]
+        self.serve(batches)
+        for batch in batches:
+            self.assertOutputs(batch, self.model)
+
+    def test_shared_weights(self):
+        with torch.no_grad():
+            self.model.weight.fill_(2.0)
+        batches = [Batch(4)]
+        self.serve(batches)
+        self.assertOutputs(batches[0], self.model)
+
+    def test_batch_too_large(self):
+        with self.assertRaisesRegex(ValueError, "larger than the maximum"):
+            self.workers._serve(0, [Batch(9)], prof.ThreadSafeTimings())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for TorchScript export of the inference models."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import nest
+import torch
+from torchbeast.core import jit
+from torchbeast.core import models
+
+
+class JitTest(unittest.TestCase):
+    def setUp(self):
+        self.obs_shape = (1, 64, 64)
+        self.order = ["control", "end", "flag", "size"]
+        self.action_shape = [1024, 1024, 2, 8]
+        self.device = torch.device("cpu")
+
+        torch.manual_seed(0)
+        self.model = self._net().eval()
+
+    def _net(self):
+        return models.Net(
+            obs_shape=self.obs_shape,
+            order=self.order,
+            action_shape=self.action_shape,
+            grid_shape=(32, 32),
+        )
+
+    def _inputs(self, batch_size):
+        num_actions = len(self.action_shape)
+        obs = dict(
+            canvas=torch.rand((1, batch_size) + self.obs_shape),
+            prev_action=torch.zeros(1, batch_size, num_actions, dtype=torch.int64),
+            action_mask=torch.ones(1, batch_size, num_actions),
+            noise_sample=torch.randn(1, batch_size, 10),
+        )
+        done = torch.zeros(1, batch_size, dtype=torch.bool)
+        return obs, done, self.model.initial_state(batch_size)
+
+    def _assert_same_outputs(self, a, b, batch_size):
+        inputs = self._inputs(batch_size)
+        with torch.no_grad():
+            torch.manual_seed(1)
+            expected = nest.flatten(a(*nest.map(torch.clone, inputs)))
+            torch.manual_seed(1)
+            observed = nest.flatten(b(*nest.map(torch.clone, inputs)))
+
+        for x, y in zip(expected, observed):
+            torch.testing.assert_close(x, y)
+
+    def test_trace_dynamic_batch(self):
+        traced = jit.trace(self.model, self._inputs(2), self.device)
+        self._assert_same_outputs(self.model, traced, batch_size=5)
+
+    def test_publish_weights(self):
+        traced = jit.trace(self.model, self._inputs(2), self.device)
+
+        learner_model = self._net()
+        traced.load_state_dict(learner_model.state_dict())
+        self.model.load_state_dict(learner_model.state_dict())
+
+        self._assert_same_outputs(self.model, traced, batch_size=3)
+
+    def test_cache(self):
+        config = dict(obs_shape=self.obs_shape, action_shape=self.action_shape)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            jit.trace(self.model, self._inputs(2), self.device, cache_dir, config)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            cached = jit.trace(
+                self.model, self._inputs(2), self.device, cache_dir, config
+            )
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self._assert_same_outputs(self.model, cached, batch_size=3)
+
+            config["action_shape"] = [1024, 1024, 2, 6]
+            jit.trace(self.model, self._inputs(2), self.device, cache_dir, config)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            self.model.to(memory_format=torch.channels_last)
+            jit.trace(self.model, self._inputs(2), self.device, cache_dir, config)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+    def test_cache_key_source(self):
+        key = jit.cache_key(self.model, self.device)
+        with mock.patch.object(
+            jit.inspect, "getsource", side_effect=lambda c: "edited " + c.__name__
+        ):
+            self.assertNotEqual(jit.cache_key(self.model, self.device), key)
+
+    def test_trace_discriminator(self):
+        D = models.ComplementDiscriminator((2, 64, 64)).eval()
+        traced = jit.trace(D, torch.zeros(2, 2, 64, 64), self.device)
+
+        frames = torch.rand(7, 2, 64, 64)
+        with torch.no_grad():
+            torch.testing.assert_close(traced(frames), D(frames))
+
+
+if __name__ == "__main__":
+    unittest.main()
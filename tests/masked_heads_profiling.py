@@ -0,0 +1,92 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Inference cost of the action decoder versus the fraction of painting rows.
+
+Compares decoding all heads with skipping the heads that moves ignore.
+
+Usage: python masked_heads_profiling.py [batch_size] [repeats]
+"""
+
+import logging
+import sys
+import timeit
+
+import torch
+from torch import nn
+
+sys.path.append("..")
+from torchbeast.core import models
+
+logging.basicConfig(
+    format=(
+        "[%(levelname)s:%(process)d %(module)s:%(lineno)d %(asctime)s] " "%(message)s"
+    ),
+    level=0,
+)
+
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+PAINT_FRACTIONS = [0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+
+
+def make_decoder(paint_fraction, skip_masked_heads):
+    order = ["flag", "end", "control", "size", "pressure", "red", "green", "blue"]
+    action_shape = [2, 1024, 1024, 6, 10, 20, 20, 20]
+    decoder = models.Decoder(order, action_shape, (32, 32), skip_masked_heads)
+
+    # Paint with probability paint_fraction, whatever the input.
+    flag = decoder.decode["flag"]
+    nn.init.zeros_(flag.weight)
+    with torch.no_grad():
+        flag.bias.copy_(torch.tensor([1 - paint_fraction, paint_fraction]).log())
+    return decoder.eval()
+
+
+def time_decoder(decoder):
+    h = torch.rand(batch_size, 256)
+
+    total = 0.0
+    with torch.no_grad():
+        for i in range(repeats + 1):
+            start = timeit.default_timer()
+            decoder(h)
+            if i > 0:  # Skip the warmup iteration.
+                total += timeit.default_timer() - start
+
+    return 1000 * total / repeats
+
+
+def main():
+    logging.info(
+        "batch_size=%i, repeats=%i, threads=%i",
+        batch_size,
+        repeats,
+        torch.get_num_threads(),
+    )
+    for paint_fraction in PAINT_FRACTIONS:
+        torch.manual_seed(0)
+        full = time_decoder(make_decoder(paint_fraction, skip_masked_heads=False))
+        skip = time_decoder(make_decoder(paint_fraction, skip_masked_heads=True))
+        logging.info(
+            "paint %4.2f all heads %8.3fms skip masked %8.3fms (%.2fx)",
+            paint_fraction,
+            full,
+            skip,
+            full / skip,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-module forward/backward timings in NCHW and channels last layouts.
+
+Usage: python memory_format_profiling.py [batch_size] [repeats]
+"""
+
+import logging
+import sys
+import timeit
+
+import torch
+from torch import nn
+
+sys.path.append("..")
+from torchbeast.core import models
+
+logging.basicConfig(
+    format=(
+        "[%(levelname)s:%(process)d %(module)s:%(lineno)d %(asctime)s] " "%(message)s"
+    ),
+    level=0,
+)
+
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+MEMORY_FORMATS = {
+    "contiguous": torch.contiguous_format,
+    "channels_last": torch.channels_last,
+}
+
+
+def make_modules():
+    order = ["flag", "end", "control", "size", "pressure"]
+    action_shape = [2, 1024, 1024, 6, 10]
+    net = models.Net(
+        obs_shape=(1, 64, 64),
+        order=order,
+        action_shape=action_shape,
+        grid_shape=(32, 32),
+    )
+    trunk = nn.Sequential(net.obs, net.relu, net.base)
+    return {
+        "Net.base": (trunk, (batch_size, 3, 64, 64)),
+        "ResBlock": (models.ResBlock(32), (batch_size, 32, 8, 8)),
+        "Decoder.end": (net.policy.decode["end"], (batch_size, 256)),
+        "Discriminator": (models.Discriminator((1, 64, 64)), (batch_size, 1, 64, 64)),
+    }
+
+
+def time_module(module, shape, memory_format):
+    module = module.to(memory_format=memory_format)
+    x = torch.rand(shape)
+    if x.dim() == 4:
+        x = x.contiguous(memory_format=memory_format)
+
+    forward = backward = 0.0
+    for i in range(repeats + 1):
+        module.zero_grad()
+
+        start = timeit.default_timer()
+        y = module(x)
+        middle = timeit.default_timer()
+        y.sum().backward()
+        end = timeit.default_timer()
+
+        if i > 0:  # Skip the warmup iteration.
+            forward += middle - start
+            backward += end - middle
+
+    return 1000 * forward / repeats, 1000 * backward / repeats
+
+
+def main():
+    logging.info(
+        "batch_size=%i, repeats=%i, threads=%i",
+        batch_size,
+        repeats,
+        torch.get_num_threads(),
+    )
+    for name, (module, shape) in make_modules().items():
+        for format_name, memory_format in MEMORY_FORMATS.items():
+            forward, backward = time_module(module, shape, memory_format)
+            logging.info(
+                "%-14s %-14s forward %8.3fms backward %8.3fms",
+                name,
+                format_name,
+                forward,
+                backward,
+            )
+
+
+if __name__ == "__main__":
+    main()
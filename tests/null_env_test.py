@@ -0,0 +1,87 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the null painting environment."""
+
+import argparse
+import timeit
+import unittest
+
+import numpy as np
+from torchbeast import utils
+from torchbeast.core import null_env
+
+
+def make_flags(**kwargs):
+    flags = argparse.Namespace(
+        env_type="null",
+        episode_length=3,
+        canvas_width=256,
+        brush_sizes=[1, 2, 4, 8, 12, 24],
+        use_pressure=True,
+        use_color=False,
+        use_compound=False,
+        null_step_cost_ms=0.0,
+    )
+    vars(flags).update(kwargs)
+    return flags
+
+
+class NullPaintTest(unittest.TestCase):
+    def test_parse_flags(self):
+        env_name, config = utils.parse_flags(make_flags())
+        self.assertEqual(env_name, "Null-v0")
+
+        env = utils.create_env(env_name, config)
+        self.assertEqual(env.order, ["control", "end", "flag", "size", "pressure"])
+        np.testing.assert_array_equal(env.action_space.nvec, [1024, 1024, 2, 6, 10])
+        self.assertEqual(env.observation_space["canvas"].shape, (1, 64, 64))
+
+    def test_action_space(self):
+        env = null_env.NullPaint()
+        env.configure(use_pressure=False, use_color=True)
+        self.assertEqual(
+            env.order, ["control", "end", "flag", "size", "red", "green", "blue"]
+        )
+        self.assertEqual(env.observation_space["canvas"].shape, (256, 256, 3))
+
+    def test_episode(self):
+        env = null_env.NullPaint()
+        env.configure(episode_length=3)
+        obs = env.reset()
+        self.assertTrue((obs["canvas"] == 255).all())
+
+        # Paint with the largest brush in the top left grid cell.
+        action = np.array([0, 0, 1, 5, 0])
+        dones = []
+        for _ in range(3):
+            obs, reward, done, _ = env.step(action)
+            dones.append(done)
+        self.assertEqual(dones, [False, False, True])
+        self.assertEqual(obs["canvas"][4, 4, 0], 0)
+        self.assertTrue((obs["canvas"][32:] == 255).all())
+
+        obs = env.reset()
+        self.assertTrue((obs["canvas"] == 255).all())
+
+    def test_step_cost(self):
+        env = null_env.NullPaint()
+        env.configure(step_cost_ms=5.0)
+        env.reset()
+        start = timeit.default_timer()
+        env.step(env.action_space.sample())
+        self.assertGreaterEqual(timeit.default_timer() - start, 0.005)
+
+
+if __name__ == "__main__":
+    unittest.main()
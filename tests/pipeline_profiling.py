@@ -0,0 +1,398 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Throughput of each pipeline stage on the null environment, saved as JSON.
+
+Runs on a CPU-only machine without brushes or datasets:
+  env:        in-process steps/sec of the raw and wrapped environment.
+  rpc:        steps/sec through env servers and the actor pool, with random
+              actions instead of a model.
+  inference:  the same with the policy, and how full the inference batches are.
+  e2e:        learner steps/sec of a short polybeast run.
+The stages that need servers are run for each of --num_actors. Pass
+--baseline with the output of an earlier run to log ratios against it.
+With --replay_path, recorded episodes are replayed instead.
+
+Usage: python pipeline_profiling.py [--output FILE] [--baseline FILE]
+           [--benchmarks env rpc inference e2e] [--num_actors N [N ...]]
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+import numpy as np
+import torch
+
+sys.path.append("..")
+import libtorchbeast
+from torchbeast import env_wrapper
+from torchbeast import polybeast_env
+from torchbeast import polybeast_learner
+from torchbeast import utils
+from torchbeast.core import models
+
+logging.basicConfig(
+    format=(
+        "[%(levelname)s:%(process)d %(module)s:%(lineno)d %(asctime)s] " "%(message)s"
+    ),
+    level=0,
+)
+
+BENCHMARKS = ["env", "rpc", "inference", "e2e"]
+
+# yapf: disable
+parser = argparse.ArgumentParser(description="Pipeline benchmarks")
+parser.add_argument("--output", default="pipeline_profiling.json",
+                    help="Where to write the results.")
+parser.add_argument("--baseline", default=None,
+                    help="Results of an earlier run to compare with.")
+parser.add_argument("--benchmarks", nargs="+", default=BENCHMARKS,
+                    choices=BENCHMARKS, help="Which stages to run.")
+parser.add_argument("--num_actors", nargs="+", type=int, default=[1, 4, 16],
+                    help="Numbers of actors to run the server stages with.")
+parser.add_argument("--duration", default=10.0, type=float,
+                    help="Seconds to measure each server stage for.")
+parser.add_argument("--env_steps", default=2000, type=int,
+                    help="Steps of the in-process environment benchmark.")
+parser.add_argument("--e2e_steps", default=20000, type=int,
+                    help="Total steps of each end-to-end run.")
+parser.add_argument("--null_step_cost_ms", default=0.0, type=float,
+                    help="CPU time each environment step takes.")
+parser.add_argument("--replay_path", default=None,
+                    help="Replay these recorded episodes instead.")
+parser.add_argument("--canvas_width", default=256, type=int,
+                    help="Canvas render width.")
+parser.add_argument("--unroll_length", default=20, type=int,
+                    help="The unroll length (time dimension).")
+parser.add_argument("--batch_size", default=8, type=int,
+                    help="Learner batch size.")
+parser.add_argument("--num_inference_threads", default=2, type=int,
+                    help="Number of inference threads.")
+parser.add_argument("--intra_op_threads", default="1",
+                    help="Thread budgets of the e2e run, see polybeast_learner.")
+parser.add_argument("--pipes_basename", default="unix:/tmp/pipeline_profiling",
+                    help="Basename for the env server pipes.")
+# yapf: enable
+
+
+def env_flags(flags):
+    return argparse.Namespace(
+        env_type="null" if flags.replay_path is None else "replay",
+        episode_length=20,
+        canvas_width=flags.canvas_width,
+        brush_sizes=[1, 2, 4, 8, 12, 24],
+        use_pressure=True,
+        use_color=False,
+        use_compound=False,
+        null_step_cost_ms=flags.null_step_cost_ms,
+        replay_path=flags.replay_path,
+    )
+
+
+def benchmark_env(flags):
+    env_name, config = utils.parse_flags(env_flags(flags))
+
+    results = {}
+    for name, env in [
+        ("raw", env_wrapper.make_raw(env_name, config)),
+        ("wrapped", utils.create_env(env_name, config, fused_observation=True)),
+    ]:
+        env.reset()
+        start = timeit.default_timer()
+        for _ in range(flags.env_steps):
+            _, _, done, _ = env.step(env.action_space.sample())
+            if done:
+                env.reset()
+        results[name + "_sps"] = flags.env_steps / (timeit.default_timer() - start)
+        logging.info("env %-8s %10.1f steps/sec", name, results[name + "_sps"])
+    return results
+
+
+def start_servers(flags, num_actors):
+    env_name, config = utils.parse_flags(env_flags(flags))
+    processes = []
+    for i in range(num_actors):
+        p = mp.Process(
+            target=polybeast_env.serve,
+            args=(
+                env_name,
+                config,
+                True,
+                None,
+                None,
+                None,
+                f"{flags.pipes_basename}.{i}",
+            ),
+            daemon=True,
+        )
+        p.start()
+        processes.append(p)
+
+    env = utils.create_env(env_name, config)
+    return processes, env
+
+
+def run_actors(flags, num_actors, initial_agent_state, infer):
+    """Steps `num_actors` actors for --duration seconds with `infer`."""
+    learner_queue = libtorchbeast.BatchingQueue(
+        batch_dim=1,
+        minimum_batch_size=1,
+        maximum_batch_size=num_actors,
+        timeout_ms=100,
+        check_inputs=True,
+        maximum_queue_size=num_actors,
+    )
+    replay_queue = libtorchbeast.BatchingQueue(
+        batch_dim=1,
+        minimum_batch_size=1,
+        maximum_batch_size=num_actors,
+        timeout_ms=100,
+        check_inputs=True,
+        maximum_queue_size=num_actors,
+    )
+    inference_batcher = libtorchbeast.DynamicBatcher(
+        batch_dim=1,
+        minimum_batch_size=1,
+        maximum_batch_size=512,
+        timeout_ms=100,
+        check_outputs=True,
+    )
+    actors = libtorchbeast.ActorPool(
+        unroll_length=flags.unroll_length,
+        learner_queue=learner_queue,
+        replay_queue=replay_queue,
+        inference_batcher=inference_batcher,
+        env_server_addresses=[f"{flags.pipes_basename}.{i}" for i in range(num_actors)],
+        initial_agent_state=initial_agent_state,
+    )
+
+    def dequeue(queue):
+        for tensor in queue:
+            del tensor
+
+    threads = [
+        threading.Thread(target=actors.run, name="actorpool-thread"),
+        threading.Thread(target=dequeue, args=(learner_queue,)),
+        threading.Thread(target=dequeue, args=(replay_queue,)),
+    ] + [
+        threading.Thread(target=infer, args=(inference_batcher,))
+        for _ in range(flags.num_inference_threads)
+    ]
+    for t in threads:
+        t.start()
+
+    # Leave out connecting and the first batches.
+    time.sleep(min(flags.duration / 2, 5))
+    start_counters = (actors.counters(), inference_batcher.counters())
+    start = timeit.default_timer()
+    time.sleep(flags.duration)
+    end_counters = (actors.counters(), inference_batcher.counters())
+    elapsed = timeit.default_timer() - start
+
+    inference_batcher.close()
+    learner_queue.close()
+    replay_queue.close()
+    for t in threads:
+        t.join()
+
+    results = {}
+    for prefix, end, last in zip(["actor_", "batcher_"], end_counters, start_counters):
+        for key, value in polybeast_learner.counter_stats(end, last).items():
+            results[prefix + key] = value
+    steps = end_counters[0]["env_step_count"] - start_counters[0]["env_step_count"]
+    results["sps"] = steps / elapsed
+    batch_count = end_counters[1]["batch_count"] - start_counters[1]["batch_count"]
+    batch_items = end_counters[1]["batch_items"] - start_counters[1]["batch_items"]
+    # Mean fraction of the actors whose step is in each inference batch.
+    results["batch_fill"] = batch_items / max(batch_count, 1) / num_actors
+    return results
+
+
+def random_actions(env):
+    def infer(inference_batcher):
+        for batch in inference_batcher:
+            (_, _, done, *_), agent_state = batch.get_inputs()
+            B = done.shape[1]
+            action = np.stack([env.action_space.sample() for _ in range(B)])
+            action = torch.from_numpy(action).view(1, B, -1)
+            batch.set_outputs(((action,), ()))
+
+    return infer
+
+
+def policy(env):
+    flags = polybeast_learner.parser.parse_args([])
+    flags.actor_device = torch.device("cpu")
+    model = models.Net(
+        obs_shape=env.observation_space["canvas"].shape,
+        order=env.order,
+        action_shape=env.action_space.nvec,
+        grid_shape=(utils.grid_width, utils.grid_width),
+    ).eval()
+
+    def infer(inference_batcher):
+        polybeast_learner.inference(flags, inference_batcher, model)
+
+    return model.initial_state(), infer
+
+
+def benchmark_servers(flags, name):
+    results = []
+    for num_actors in flags.num_actors:
+        processes, env = start_servers(flags, num_actors)
+        try:
+            if name == "rpc":
+                initial_agent_state, infer = (), random_actions(env)
+            else:
+                initial_agent_state, infer = policy(env)
+            result = run_actors(flags, num_actors, initial_agent_state, infer)
+        finally:
+            for p in processes:
+                p.terminate()
+        result["num_actors"] = num_actors
+        logging.info(
+            "%s num_actors=%i %10.1f steps/sec, batch fill %.2f",
+            name,
+            num_actors,
+            result["sps"],
+            result["batch_fill"],
+        )
+        results.append(result)
+    return results
+
+
+def benchmark_e2e(flags):
+    env_args = ["--env_type=null"]
+    if flags.replay_path is not None:
+        env_args = [
+            "--env_type=replay",
+            "--replay_path=%s" % os.path.abspath(flags.replay_path),
+        ]
+
+    results = []
+    for num_actors in flags.num_actors:
+        with tempfile.TemporaryDirectory() as savedir:
+            xpid = "e2e-%i" % num_actors
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "torchbeast.polybeast",
+                    *env_args,
+                    "--dataset=fake",
+                    "--disable_cuda",
+                    "--disable_checkpoint",
+                    "--log_format=csv",
+                    "--null_step_cost_ms=%f" % flags.null_step_cost_ms,
+                    "--canvas_width=%i" % flags.canvas_width,
+                    "--unroll_length=%i" % flags.unroll_length,
+                    "--batch_size=%i" % flags.batch_size,
+                    "--num_actors=%i" % num_actors,
+                    "--intra_op_threads=%s" % flags.intra_op_threads,
+                    "--total_steps=%i" % flags.e2e_steps,
+                    "--savedir=%s" % savedir,
+                    "--xpid=%s" % xpid,
+                    "--pipes_basename=%s" % flags.pipes_basename,
+                ],
+                cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."),
+                check=True,
+            )
+            result = dict(num_actors=num_actors, sps=learner_sps(savedir, xpid))
+        logging.info("e2e num_actors=%i %10.1f steps/sec", num_actors, result["sps"])
+        results.append(result)
+    return results
+
+
+def learner_sps(savedir, xpid):
+    """Steps/sec between the first and last learner log entry."""
+    basepath = os.path.join(savedir, xpid)
+    with open(os.path.join(basepath, "fields.csv")) as f:
+        fieldnames = list(csv.reader(f))[-1]
+    with open(os.path.join(basepath, "logs.csv")) as f:
+        lines = (line for line in f if not line.startswith("#"))
+        rows = list(csv.DictReader(lines, fieldnames=fieldnames))
+    first, last = rows[0], rows[-1]
+    return (int(last["step"]) - int(first["step"])) / (
+        float(last["_time"]) - float(first["_time"])
+    )
+
+
+def compare(results, baseline):
+    """Log the ratio of each throughput to the one in `baseline`."""
+
+    def entries(results):
+        for name, result in results.items():
+            for entry in result if isinstance(result, list) else [result]:
+                if "num_actors" in entry:
+                    name_actors = "%s num_actors=%i" % (name, entry["num_actors"])
+                else:
+                    name_actors = name
+                for key, value in entry.items():
+                    if key.endswith("sps"):
+                        yield "%s %s" % (name_actors, key), value
+
+    old = dict(entries(baseline["results"]))
+    for key, value in entries(results):
+        if old.get(key):
+            logging.info("%s: %.2fx of baseline", key, value / old[key])
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    flags = parser.parse_args()
+
+    results = {}
+    for name in flags.benchmarks:
+        if name == "env":
+            results[name] = benchmark_env(flags)
+        elif name == "e2e":
+            results[name] = benchmark_e2e(flags)
+        else:
+            results[name] = benchmark_servers(flags, name)
+
+    output = dict(
+        commit=commit(),
+        time=time.time(),
+        torch_threads=torch.get_num_threads(),
+        flags=vars(flags),
+        results=results,
+    )
+    with open(flags.output, "w") as f:
+        json.dump(output, f, indent=2)
+    logging.info("Wrote results to %s", flags.output)
+
+    if flags.baseline is not None:
+        with open(flags.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
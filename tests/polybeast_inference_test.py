@@ -20,6 +20,7 @@ from unittest import mock
 import torch
 from torchbeast import polybeast_learner as polybeast
 from torchbeast.core import models
+from torchbeast.core import vtrace
 
 
 class InferenceTest(unittest.TestCase):
@@ -65,14 +66,23 @@ class InferenceTest(unittest.TestCase):
         self.mock_inference_batcher = mock.MagicMock()
         self.mock_inference_batcher.__iter__.return_value = iter([self.mock_batch])
 
-    def _test_inference(self, use_color, device):
+        # Preparing the mock flags. Could do with just a dict but using
+        # a Mock object for consistency. Options default to off, a Mock
+        # attribute would be truthy.
+        self.mock_flags = mock.Mock()
+        self.mock_flags.behavior_log_probs = False
+        self.mock_flags.precision = "fp32"
+
+    def _make_model(self, device):
         model = models.Net(
             obs_shape=self.obs_shape,
             order=self.order,
             action_shape=self.action_shape,
             grid_shape=self.grid_shape,
         )
-        model.to(device)
+        return model.to(device)
+
+    def _run_inference(self, model, device):
         agent_state = model.initial_state(self.batch_size)
 
         inputs = (
@@ -90,12 +100,14 @@ class InferenceTest(unittest.TestCase):
         self.mock_batch.get_inputs = mock.Mock(return_value=inputs)
         self.mock_batch.set_outputs = mock.Mock()
 
-        # Preparing the mock flags. Could do with just a dict but using
-        # a Mock object for consistency.
-        mock_flags = mock.Mock()
-        mock_flags.actor_device = device
+        self.mock_flags.actor_device = device
+
+        polybeast.inference(self.mock_flags, self.mock_inference_batcher, model)
+        return inputs
 
-        polybeast.inference(mock_flags, self.mock_inference_batcher, model)
+    def _test_inference(self, use_color, device):
+        model = self._make_model(device)
+        self._run_inference(model, device)
 
         # Assert the batch is used only once.
         self.mock_batch.get_inputs.assert_called_once()
@@ -124,12 +136,40 @@ class InferenceTest(unittest.TestCase):
         self.assertEqual(len(core_state), 2)
         for core_state_element in core_state:
             self.assertSequenceEqual(
-                core_state_element.shape, (1, self.batch_size, self.core_output_size),
+                core_state_element.shape,
+                (1, self.batch_size, self.core_output_size),
             )
 
     def test_inference_cpu(self):
         self._test_inference(use_color=False, device=torch.device("cpu"))
 
+    def test_behavior_log_probs(self):
+        device = torch.device("cpu")
+        self.mock_flags.behavior_log_probs = True
+        model = self._make_model(device)
+
+        torch.manual_seed(0)
+        inputs = self._run_inference(model, device)
+        (action, log_probs, baseline), _ = self.mock_batch.set_outputs.call_args[0][0]
+
+        # The same seed samples the same actions.
+        (obs, _, done, *_), agent_state = inputs
+        torch.manual_seed(0)
+        with torch.no_grad():
+            (expected_action, logits, expected_baseline), _ = model(
+                dict(obs), done, agent_state
+            )
+
+        self.assertSequenceEqual(
+            log_probs.shape,
+            (self.unroll_length, self.batch_size, len(self.action_shape)),
+        )
+        torch.testing.assert_close(action, expected_action)
+        torch.testing.assert_close(baseline, expected_baseline)
+        torch.testing.assert_close(
+            log_probs, vtrace.head_log_probs(logits, expected_action)
+        )
+
     def test_inference_cuda(self):
         if not torch.cuda.is_available():
             warnings.warn("Not testing cuda as it's not available")
@@ -20,7 +20,7 @@ from unittest import mock
 import numpy as np
 import torch
 from torchbeast import polybeast_learner as polybeast
-from torchbeast.core import models
+from torchbeast.core import models, vtrace
 
 
 def _state_dict_to_numpy(state_dict):
@@ -95,6 +95,7 @@ class LearnTest(unittest.TestCase):
         mock_flags.grad_norm_clipping = 40
         mock_flags.use_tca = True
         mock_flags.condition = True
+        mock_flags.behavior_log_probs = False
 
         # Prepare content for mock_learner_queue.
         obs = dict(
@@ -108,12 +109,14 @@ class LearnTest(unittest.TestCase):
         episode_step = torch.ones(unroll_length, batch_size)
         episode_return = torch.ones(unroll_length, batch_size)
 
-        new_frame = dict(
-            canvas=torch.ones([unroll_length - 1, batch_size] + obs_shape),
-            prev_action=torch.ones(unroll_length - 1, batch_size, len(action_shape)),
-            action_mask=torch.ones(unroll_length - 1, batch_size, len(action_shape)),
-            noise_sample=torch.ones(unroll_length - 1, batch_size, 10),
+        # No episode ends, the single terminal frame is padding.
+        terminal_obs = dict(
+            canvas=torch.zeros([1, batch_size] + obs_shape),
+            prev_action=torch.zeros(1, batch_size, len(action_shape)),
+            action_mask=torch.zeros(1, batch_size, len(action_shape)),
+            noise_sample=torch.zeros(1, batch_size, 10),
         )
+        terminal_index = torch.full((1, batch_size), -1)
 
         env_outputs = (obs, rewards, done, episode_step, episode_return)
         actor_outputs = (
@@ -142,7 +145,12 @@ class LearnTest(unittest.TestCase):
             torch.rand(unroll_length, batch_size),
         )
         initial_agent_state = self.model.initial_state(batch_size)
-        tensors = ((env_outputs, actor_outputs), new_frame, initial_agent_state)
+        tensors = (
+            (env_outputs, actor_outputs),
+            (terminal_obs, terminal_index),
+            initial_agent_state,
+        )
+        self.tensors = tensors
 
         # Mock learner_queue.
         mock_learner_queue = mock.MagicMock()
@@ -361,6 +369,73 @@ class LearnTest(unittest.TestCase):
         self.assertNotEqual(self.stats["fake_loss"], 0.0)
         self.assertNotEqual(self.stats["real_loss"], 0.0)
 
+    def test_next_frames(self):
+        """Check that terminal frames replace the reset frames after them."""
+        canvas = torch.arange(4.0).view(4, 1).expand(4, 3)
+        terminal_frame = torch.tensor([[10.0, 11.0, 12.0], [13.0, 14.0, 15.0]])
+        terminal_index = torch.tensor([[0, -1, 2], [2, -1, -1]])
+
+        new_frame = polybeast.next_frames(canvas, terminal_frame, terminal_index)
+
+        np.testing.assert_array_equal(
+            new_frame.numpy(), [[10.0, 1.0, 1.0], [2.0, 2.0, 2.0], [13.0, 3.0, 12.0]]
+        )
+        # The rollout itself is unchanged.
+        np.testing.assert_array_equal(canvas[:, 0].numpy(), [0.0, 1.0, 2.0, 3.0])
+
+    def test_compressed_rollouts(self):
+        """Check that uint8 canvases give the same loss as float canvases."""
+        (env_outputs, actor_outputs), terminal, initial_agent_state = self.tensors
+        terminal_obs, terminal_index = terminal
+        obs = env_outputs[0]
+        obs["canvas"] = torch.randint(256, obs["canvas"].shape) / 255
+
+        def compress(obs):
+            # Same as ActorPool with compress_rollouts.
+            obs = dict(obs)
+            obs["canvas"] = obs["canvas"].mul(255).round().to(torch.uint8)
+            return obs
+
+        compressed = (
+            ((compress(obs),) + env_outputs[1:], actor_outputs),
+            (compress(terminal_obs), terminal_index),
+            initial_agent_state,
+        )
+
+        losses = []
+        for tensors in [copy.deepcopy(self.tensors), compressed]:
+            self.model.load_state_dict(self.initial_model_dict)
+            self.learn_args[1].__iter__.return_value = iter([tensors])
+
+            polybeast.learn(*self.learn_args)
+            losses.append(self.stats["total_loss"])
+
+        self.assertAlmostEqual(losses[0], losses[1], places=5)
+
+    def test_behavior_log_probs(self):
+        """Check that behavior log-probs give the same loss as full logits."""
+        (env_outputs, actor_outputs), terminal, initial_agent_state = self.tensors
+        action, logits, baseline = actor_outputs
+        log_probs_tensors = (
+            (env_outputs, (action, vtrace.head_log_probs(logits, action), baseline)),
+            terminal,
+            initial_agent_state,
+        )
+
+        losses = []
+        for behavior_log_probs, tensors in [
+            (False, self.tensors),
+            (True, log_probs_tensors),
+        ]:
+            self.learn_args[0].behavior_log_probs = behavior_log_probs
+            self.model.load_state_dict(self.initial_model_dict)
+            self.learn_args[1].__iter__.return_value = iter([copy.deepcopy(tensors)])
+
+            polybeast.learn(*self.learn_args)
+            losses.append(self.stats["pg_loss"])
+
+        self.assertAlmostEqual(losses[0], losses[1], places=5)
+
 
 if __name__ == "__main__":
     unittest.main()
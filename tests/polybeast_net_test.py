@@ -13,9 +13,12 @@
 # limitations under the License.
 """Tests for polybeast Net class implementation."""
 
+import copy
 import unittest
 
+import nest
 import torch
+from torch import nn
 from torchbeast.core import models
 
 
@@ -89,6 +92,61 @@ class NetTest(unittest.TestCase):
                 core_state_element.shape, (1, self.batch_size, self.core_output_size),
             )
 
+    def test_channels_last_matches_contiguous(self):
+        torch.manual_seed(0)
+        model = models.Net(
+            obs_shape=self.obs_shape,
+            order=self.order,
+            action_shape=self.action_shape,
+            grid_shape=self.grid_shape,
+        )
+        channels_last_model = copy.deepcopy(model).to(memory_format=torch.channels_last)
+        core_state = model.initial_state(self.batch_size)
+
+        obs = dict(self.inputs[0], canvas=torch.rand(self.inputs[0]["canvas"].shape))
+        done = self.inputs[1]
+        expected = model(dict(obs), done, core_state)
+        observed = channels_last_model(dict(obs), done, core_state)
+
+        for x, y in zip(nest.flatten(expected), nest.flatten(observed)):
+            torch.testing.assert_close(x, y, rtol=1e-4, atol=1e-4)
+
+    def test_skip_masked_heads(self):
+        torch.manual_seed(0)
+        model = models.Net(
+            obs_shape=self.obs_shape,
+            order=self.order,
+            action_shape=self.action_shape,
+            grid_shape=self.grid_shape,
+            skip_masked_heads=True,
+        ).eval()
+        # Move (flag 0) and paint (flag 1) with equal probability.
+        nn.init.zeros_(model.policy.decode["flag"].weight)
+        nn.init.ones_(model.policy.decode["flag"].bias)
+        core_state = model.initial_state(self.batch_size)
+
+        with torch.no_grad():
+            (action, policy_logits, _), _ = model(
+                dict(self.inputs[0]), self.inputs[1], core_state
+            )
+        logits = dict(zip(self.order, policy_logits))
+        move = action[..., self.order.index("flag")] == 0
+        self.assertTrue(move.any() and not move.all())
+
+        # Heads ignored while moving are skipped, end is always decoded.
+        for i, k in enumerate(self.order):
+            skipped = (logits[k] == 0).all(dim=-1)
+            if k in models.Decoder.MOVE_ACTIONS:
+                self.assertFalse(skipped.any())
+            else:
+                self.assertTrue(torch.equal(skipped, move))
+                self.assertTrue((action[..., i][move] == 0).all())
+
+        head_mask = model.policy.head_mask(action)
+        self.assertTrue(torch.equal(head_mask[..., 0], (~move).float()))
+        self.assertTrue((head_mask[..., 1:3] == 1).all())
+        self.assertTrue(torch.equal(head_mask[..., 3], (~move).float()))
+
 
 if __name__ == "__main__":
     unittest.main()
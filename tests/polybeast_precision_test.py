@@ -0,0 +1,165 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Parity tests for mixed-precision learn and learn_D against fp32."""
+
+import copy
+import unittest
+from unittest import mock
+
+import torch
+from torchbeast import polybeast_learner as polybeast
+from torchbeast.core import models
+
+
+class PrecisionTest(unittest.TestCase):
+    def setUp(self):
+        unroll_length = 3
+        batch_size = 4
+        frame_dimension = 64
+        order = ["control", "end", "flag", "size", "pressure"]
+        action_shape = [1024, 1024, 2, 8, 10]
+        obs_shape = [2, frame_dimension, frame_dimension]
+        self.batch_size = batch_size
+
+        torch.manual_seed(0)
+
+        self.model = models.Net(
+            obs_shape=obs_shape,
+            order=order,
+            action_shape=action_shape,
+            grid_shape=[32, 32],
+        )
+        self.D = models.ComplementDiscriminator(obs_shape, spectral_norm=False)
+
+        self.flags = mock.Mock()
+        self.flags.learner_device = torch.device("cpu")
+        self.flags.discounting = 0.99
+        self.flags.baseline_cost = 0.5
+        self.flags.entropy_cost = 0.0006
+        self.flags.unroll_length = unroll_length - 1
+        self.flags.batch_size = batch_size
+        self.flags.grad_norm_clipping = 40
+        self.flags.use_tca = True
+        self.flags.condition = True
+        self.flags.behavior_log_probs = False
+
+        obs = dict(
+            canvas=torch.rand([unroll_length, batch_size] + obs_shape),
+            prev_action=torch.ones(unroll_length, batch_size, len(action_shape)),
+            action_mask=torch.ones(unroll_length, batch_size, len(action_shape)),
+            noise_sample=torch.randn(unroll_length, batch_size, 10),
+        )
+        env_outputs = (
+            obs,
+            torch.ones(unroll_length, batch_size),
+            torch.zeros(unroll_length, batch_size, dtype=torch.bool),
+            torch.ones(unroll_length, batch_size),
+            torch.ones(unroll_length, batch_size),
+        )
+        actor_outputs = (
+            torch.cat(
+                [
+                    torch.randint(0, n, (unroll_length, batch_size, 1))
+                    for n in action_shape
+                ],
+                dim=-1,
+            ),
+            [torch.randn(unroll_length, batch_size, n) for n in action_shape],
+            torch.rand(unroll_length, batch_size),
+        )
+        terminal_obs = dict(canvas=torch.zeros([1, batch_size] + obs_shape))
+        terminal_index = torch.full((1, batch_size), -1)
+        self.tensors = (
+            (env_outputs, actor_outputs),
+            (terminal_obs, terminal_index),
+            self.model.initial_state(batch_size),
+        )
+        self.real = torch.rand(batch_size, 1, frame_dimension, frame_dimension)
+        self.fake = torch.rand([batch_size] + obs_shape)
+
+    def _learn(self, precision):
+        self.flags.precision = precision
+        model = copy.deepcopy(self.model)
+        actor_model = copy.deepcopy(self.model)
+        D_eval = copy.deepcopy(self.D).eval()
+        optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+        scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=10)
+
+        learner_queue = mock.MagicMock()
+        learner_queue.__iter__.return_value = iter([copy.deepcopy(self.tensors)])
+
+        stats = {}
+        polybeast.learn(
+            self.flags,
+            learner_queue,
+            model,
+            actor_model,
+            D_eval,
+            optimizer,
+            scheduler,
+            stats,
+            mock.Mock(),
+        )
+        return stats
+
+    def _learn_D(self, precision):
+        self.flags.precision = precision
+        D = copy.deepcopy(self.D)
+        D_eval = copy.deepcopy(self.D).eval()
+        optimizer = torch.optim.SGD(D.parameters(), lr=0.1)
+        scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=10)
+
+        dataloader = mock.MagicMock()
+        dataloader.__iter__.return_value = iter([(self.real, None)])
+        replay_queue = mock.MagicMock()
+        replay_queue.is_closed.return_value = True
+        replay_buffer = mock.MagicMock()
+        replay_buffer.sample.return_value = self.fake
+
+        stats = {}
+        polybeast.learn_D(
+            self.flags,
+            dataloader,
+            replay_queue,
+            replay_buffer,
+            D,
+            D_eval,
+            optimizer,
+            scheduler,
+            stats,
+            mock.Mock(),
+        )
+        return stats
+
+    def test_bf16_learn_loss_parity(self):
+        expected = self._learn("fp32")
+        observed = self._learn("bf16")
+
+        for key in ["total_loss", "pg_loss", "baseline_loss", "entropy_loss"]:
+            self.assertAlmostEqual(
+                observed[key], expected[key], delta=0.05 * abs(expected[key]) + 1e-3
+            )
+
+    def test_bf16_learn_D_loss_parity(self):
+        expected = self._learn_D("fp32")
+        observed = self._learn_D("bf16")
+
+        for key in ["D_loss", "real_loss", "fake_loss"]:
+            self.assertAlmostEqual(
+                observed[key], expected[key], delta=0.05 * abs(expected[key]) + 1e-3
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the thread-safe timings."""
+
+import threading
+import unittest
+
+from torchbeast.core import prof
+
+
+class ThreadSafeTimingsTest(unittest.TestCase):
+    def test_means_match_timings(self):
+        timings = prof.Timings()
+        thread_safe = prof.ThreadSafeTimings()
+        for x in [0.1, 0.2, 0.6]:
+            timings.add("a", x)
+            thread_safe.add("a", x)
+
+        self.assertAlmostEqual(thread_safe.means()["a"], timings.means()["a"])
+        self.assertAlmostEqual(thread_safe.stds()["a"], timings.stds()["a"])
+
+    def test_percentiles(self):
+        timings = prof.ThreadSafeTimings()
+        for i in range(101):
+            timings.add("a", i / 1000)
+
+        percentiles = timings.percentiles(qs=(0, 50, 100))
+        self.assertAlmostEqual(percentiles["a_p0_ms"], 0.0)
+        self.assertAlmostEqual(percentiles["a_p50_ms"], 50.0)
+        self.assertAlmostEqual(percentiles["a_p100_ms"], 100.0)
+
+    def test_window(self):
+        timings = prof.ThreadSafeTimings(window=10)
+        for _ in range(10):
+            timings.add("a", 1.0)
+        for _ in range(10):
+            timings.add("a", 0.0)
+
+        self.assertEqual(timings.percentiles(qs=(100,))["a_p100_ms"], 0.0)
+        self.assertAlmostEqual(timings.means()["a"], 0.5)
+
+    def test_timer(self):
+        timings = prof.ThreadSafeTimings()
+        with timings.timer("a"):
+            pass
+        self.assertIn("a", timings.means())
+        self.assertIn("a_p50_ms", timings.percentiles())
+
+    def test_threads(self):
+        timings = prof.ThreadSafeTimings()
+
+        def run():
+            for _ in range(1000):
+                timings.add("a", 1.0)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertAlmostEqual(timings.means()["a"], 1.0)
+        self.assertEqual(timings._counts["a"], 4000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the policy/discriminator update rate controller."""
+
+import threading
+import timeit
+import unittest
+
+from torchbeast.core import rate_control
+
+
+class UpdateRateControllerTest(unittest.TestCase):
+    def test_bad_construct(self):
+        with self.assertRaisesRegex(ValueError, "must be >= 0"):
+            rate_control.UpdateRateController(policy_steps_per_D_step=-1)
+
+    def test_unlimited(self):
+        controller = rate_control.UpdateRateController()
+        for _ in range(10):
+            self.assertTrue(controller.wait_D_step())
+            controller.D_step()
+
+        rates = controller.rates()
+        self.assertEqual(rates["policy_steps_per_second"], 0.0)
+        self.assertGreater(rates["D_steps_per_second"], 0.0)
+
+    def test_ratio(self):
+        controller = rate_control.UpdateRateController(policy_steps_per_D_step=2)
+        D_steps = 0
+
+        def learn_D():
+            nonlocal D_steps
+            while controller.wait_D_step():
+                D_steps += 1
+                controller.D_step()
+
+        thread = threading.Thread(target=learn_D)
+        thread.start()
+
+        for _ in range(10):
+            controller.policy_step()
+
+        controller.close()
+        thread.join()
+
+        # The first D step is free, afterwards one per two policy steps.
+        self.assertLessEqual(D_steps, 6)
+
+    def test_max_D_steps_per_second(self):
+        controller = rate_control.UpdateRateController(max_D_steps_per_second=50)
+
+        start = timeit.default_timer()
+        for _ in range(5):
+            self.assertTrue(controller.wait_D_step())
+            controller.D_step()
+        elapsed = timeit.default_timer() - start
+
+        self.assertGreaterEqual(elapsed, 4 / 50)
+
+    def test_close_wakes_waiter(self):
+        controller = rate_control.UpdateRateController(policy_steps_per_D_step=1)
+        self.assertTrue(controller.wait_D_step())
+        controller.D_step()
+
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(controller.wait_D_step())
+        )
+        thread.start()
+        controller.close()
+        thread.join()
+
+        self.assertEqual(result, [False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the discriminator replay buffer."""
+
+import unittest
+
+import torch
+from torchbeast.core import replay_buffer
+
+
+class ReplayBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.obs_shape = (1, 4, 4)
+
+    def _frames(self, *values):
+        return torch.stack(
+            [torch.full(self.obs_shape, v / 255.0) for v in values], dim=0
+        )
+
+    def test_bad_construct(self):
+        with self.assertRaisesRegex(ValueError, "capacity must be >= 1"):
+            replay_buffer.ReplayBuffer(0, self.obs_shape)
+        with self.assertRaisesRegex(ValueError, "Unknown sampling"):
+            replay_buffer.ReplayBuffer(1, self.obs_shape, sampling="prioritized")
+
+    def test_sample_empty(self):
+        buffer = replay_buffer.ReplayBuffer(4, self.obs_shape)
+        with self.assertRaisesRegex(RuntimeError, "empty"):
+            buffer.sample(1)
+
+    def test_ring_overwrites_oldest(self):
+        buffer = replay_buffer.ReplayBuffer(3, self.obs_shape, sampling="latest")
+
+        buffer.add(self._frames(1, 2))
+        self.assertEqual(len(buffer), 2)
+
+        buffer.add(self._frames(3, 4))
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.num_added(), 4)
+
+        frames = buffer.sample(3)
+        self.assertEqual(list(frames.shape), [3] + list(self.obs_shape))
+        self.assertEqual(frames.dtype, torch.float32)
+        values = [round(v * 255) for v in frames[:, 0, 0, 0].tolist()]
+        self.assertEqual(values, [2, 3, 4])
+
+    def test_add_more_than_capacity(self):
+        buffer = replay_buffer.ReplayBuffer(2, self.obs_shape, sampling="latest")
+        buffer.add(self._frames(1, 2, 3))
+
+        values = [round(v * 255) for v in buffer.sample(2)[:, 0, 0, 0].tolist()]
+        self.assertEqual(values, [2, 3])
+
+    def test_uniform_sample_from_filled_slots(self):
+        buffer = replay_buffer.ReplayBuffer(8, self.obs_shape)
+        buffer.add(self._frames(7, 9))
+
+        frames = buffer.sample(64)
+        values = set(round(v * 255) for v in frames[:, 0, 0, 0].tolist())
+        self.assertTrue(values <= {7, 9})
+
+    def test_round_trip_precision(self):
+        buffer = replay_buffer.ReplayBuffer(1, self.obs_shape)
+        frames = torch.rand((1,) + self.obs_shape)
+        buffer.add(frames)
+
+        self.assertLessEqual((buffer.sample(1) - frames).abs().max().item(), 0.5 / 255)
+
+
+if __name__ == "__main__":
+    unittest.main()
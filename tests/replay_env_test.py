@@ -0,0 +1,103 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for recording and replaying episodes."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from torchbeast import env_wrapper, utils
+from torchbeast.core import replay_env
+
+from null_env_test import make_flags
+
+
+def run_episodes(env, num_episodes, action=None):
+    episodes = []
+    for _ in range(num_episodes):
+        steps = [(env.reset(), 0.0, False)]
+        done = False
+        while not done:
+            step_action = env.action_space.sample() if action is None else action
+            obs, reward, done, _ = env.step(step_action)
+            steps.append((obs, reward, done))
+        episodes.append(steps)
+    return episodes
+
+
+class ReplayEnvTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env_name, self.config = utils.parse_flags(make_flags())
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def record(self, filename, num_episodes):
+        path = os.path.join(self.tmpdir.name, filename)
+        env = replay_env.RecordEpisodes(
+            env_wrapper.make_raw(self.env_name, self.config), path, num_episodes
+        )
+        episodes = run_episodes(env, num_episodes + 1)
+        return env, episodes[:num_episodes]
+
+    def replay(self, path):
+        return env_wrapper.make_raw("Replay-v0", dict(replay_path=path))
+
+    def assertEpisodesEqual(self, expected, replayed):
+        self.assertEqual(len(expected), len(replayed))
+        for expected_episode, replayed_episode in zip(expected, replayed):
+            self.assertEqual(len(expected_episode), len(replayed_episode))
+            for (obs, reward, done), (r_obs, r_reward, r_done) in zip(
+                expected_episode, replayed_episode
+            ):
+                np.testing.assert_array_equal(obs["canvas"], r_obs["canvas"])
+                self.assertEqual(reward, r_reward)
+                self.assertEqual(done, r_done)
+
+    def test_replay(self):
+        recorded_env, episodes = self.record("0.npz", 2)
+        env = self.replay(os.path.join(self.tmpdir.name, "0.npz"))
+
+        self.assertEqual(env.order, recorded_env.order)
+        np.testing.assert_array_equal(
+            env.action_space.nvec, recorded_env.action_space.nvec
+        )
+        self.assertEqual(
+            env.observation_space["canvas"], recorded_env.observation_space["canvas"]
+        )
+
+        # Actions are ignored and episodes repeat.
+        action = np.zeros_like(env.action_space.nvec)
+        self.assertEpisodesEqual(episodes * 2, run_episodes(env, 4, action))
+
+    def test_directory(self):
+        _, episodes = self.record("0.npz", 1)
+        _, more_episodes = self.record("1.npz", 2)
+        env = self.replay(self.tmpdir.name)
+        self.assertEpisodesEqual(episodes + more_episodes, run_episodes(env, 3))
+
+    def test_create_env(self):
+        self.record("0.npz", 1)
+        flags = make_flags(
+            env_type="replay", replay_path=os.path.join(self.tmpdir.name, "0.npz")
+        )
+        env_name, config = utils.parse_flags(flags)
+        env = utils.create_env(env_name, config)
+        self.assertEqual(env.reset()["canvas"].shape, (1, 64, 64))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for libtorchbeast.tensor_nest."""
+
+import unittest
+
+import nest
+import numpy as np
+import torch
+from libtorchbeast import tensor_nest
+
+
+def make_nest(offset=0):
+    return (
+        {"canvas": torch.arange(24.0).view(2, 3, 4) + offset, "done": torch.ones(2, 3)},
+        [torch.arange(6).view(2, 3) + offset],
+    )
+
+
+class TensorNestTest(unittest.TestCase):
+    def assertNestEqual(self, n1, n2):
+        nest.map_many2(np.testing.assert_array_equal, n1, n2)
+        self.assertEqual(len(nest.flatten(n1)), len(nest.flatten(n2)))
+
+    def test_to(self):
+        n = make_nest()
+        result = tensor_nest.to(n, torch.device("cpu"), copy=True)
+        self.assertNestEqual(result, n)
+        self.assertNotEqual(result[0]["canvas"].data_ptr(), n[0]["canvas"].data_ptr())
+
+    def test_slice(self):
+        n = make_nest()
+        self.assertNestEqual(tensor_nest.slice(n, 0, 1), nest.map(lambda t: t[1:], n))
+        self.assertNestEqual(
+            tensor_nest.slice(n, 0, end=-1), nest.map(lambda t: t[:-1], n)
+        )
+        self.assertNestEqual(
+            tensor_nest.slice(n, 1, 0, 3, 2), nest.map(lambda t: t[:, 0:3:2], n)
+        )
+
+    def test_flatten(self):
+        n = make_nest()
+        self.assertNestEqual(
+            tensor_nest.flatten(n, 0, 1), nest.map(lambda t: torch.flatten(t, 0, 1), n)
+        )
+
+    def test_cat_stack(self):
+        nests = [make_nest(), make_nest(100)]
+        for name in ["cat", "stack"]:
+            f = getattr(torch, name)
+            self.assertNestEqual(
+                getattr(tensor_nest, name)(nests, dim=1),
+                nest.map_many(lambda ts: f(ts, 1), *nests),
+            )
+        self.assertNestEqual(
+            tensor_nest.batch(nests, batch_dim=1), tensor_nest.cat(nests, dim=1)
+        )
+
+    def test_mismatched_structure(self):
+        with self.assertRaises(ValueError):
+            tensor_nest.cat([make_nest(), make_nest()[0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
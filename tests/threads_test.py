@@ -0,0 +1,146 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the intra-op thread budgets."""
+
+import argparse
+import threading
+import unittest
+from unittest import mock
+
+import torch
+
+from torchbeast.core import threads
+
+
+class ParseBudgetsTest(unittest.TestCase):
+    def test_all_roles(self):
+        self.assertEqual(threads.parse_budgets("4"), dict.fromkeys(threads.ROLES, 4))
+
+    def test_roles(self):
+        self.assertEqual(
+            threads.parse_budgets("learner=8, inference=2"),
+            dict(learner=8, d_learner=1, inference=2, env=1),
+        )
+
+    def test_auto(self):
+        self.assertIsNone(threads.parse_budgets("auto"))
+
+    def test_errors(self):
+        with self.assertRaisesRegex(ValueError, "Unknown role"):
+            threads.parse_budgets("actor=2")
+        with self.assertRaisesRegex(ValueError, "positive"):
+            threads.parse_budgets("learner=0")
+        with self.assertRaises(ValueError):
+            threads.parse_budgets("many")
+
+
+class SplitTest(unittest.TestCase):
+    def test_proportional(self):
+        self.assertEqual(
+            threads.split(dict(a=2.0, b=1.0, c=1.0), 64), dict(a=32, b=16, c=16)
+        )
+
+    def test_remainders(self):
+        budgets = threads.split(dict(a=1.0, b=1.0, c=1.0), 8)
+        self.assertEqual(sum(budgets.values()), 8)
+        self.assertEqual(sorted(budgets.values()), [2, 3, 3])
+
+    def test_at_least_one(self):
+        self.assertEqual(
+            threads.split(dict(a=100.0, b=0.0, c=0.0), 4), dict(a=2, b=1, c=1)
+        )
+        self.assertEqual(threads.split(dict(a=0.0, b=0.0), 4), dict(a=2, b=2))
+
+
+class ThreadBudgetsTest(unittest.TestCase):
+    def make_flags(self, spec, num_actors=4):
+        return argparse.Namespace(intra_op_threads=spec, num_actors=num_actors)
+
+    def test_fixed(self):
+        budgets = threads.ThreadBudgets.from_flags(self.make_flags("learner=8"))
+        self.assertFalse(budgets.auto)
+        self.assertEqual(budgets.get("learner"), 8)
+        self.assertEqual(budgets.rebalance(), budgets.budgets())
+
+    def test_auto(self):
+        budgets = threads.ThreadBudgets.from_flags(
+            self.make_flags("auto", num_actors=16), num_cpus=64
+        )
+        self.assertTrue(budgets.auto)
+        self.assertEqual(
+            budgets.budgets(), dict(learner=24, d_learner=12, inference=12, env=1)
+        )
+
+    def test_auto_small_machine(self):
+        budgets = threads.ThreadBudgets({}, auto=True, num_cpus=2, env_cpus=4)
+        for role in threads.LEARNER_ROLES:
+            self.assertEqual(budgets.get(role), 1)
+
+    def test_rebalance(self):
+        budgets = threads.ThreadBudgets({}, auto=True, num_cpus=48)
+        with mock.patch("timeit.default_timer", return_value=10.0):
+            budgets.rebalance()
+        # The learner was busy all the time, the others rarely.
+        budgets._busy.update(learner=10.0, d_learner=1.0, inference=1.0)
+        with mock.patch("timeit.default_timer", return_value=20.0):
+            new_budgets = budgets.rebalance()
+
+        self.assertGreater(new_budgets["learner"], 24)
+        self.assertLess(new_budgets["d_learner"], 12)
+        self.assertLess(new_budgets["inference"], 12)
+        self.assertEqual(sum(new_budgets[r] for r in threads.LEARNER_ROLES), 48)
+
+    def test_rebalance_pinned(self):
+        budgets = threads.ThreadBudgets({}, auto=True, num_cpus=48)
+        budgets.pin("inference")
+        # Inference runs elsewhere, its idle time here doesn't shrink it.
+        budgets._busy.update(learner=1.0, d_learner=1.0)
+        new_budgets = budgets.rebalance()
+
+        self.assertEqual(new_budgets["inference"], 12)
+        self.assertEqual(new_budgets["learner"] + new_budgets["d_learner"], 36)
+
+    def test_busy(self):
+        budgets = threads.ThreadBudgets({})
+        with budgets.busy("inference"):
+            pass
+        self.assertGreater(budgets._busy["inference"], 0.0)
+
+    def test_apply(self):
+        budgets = threads.ThreadBudgets(dict(learner=8, d_learner=4, inference=2))
+        applied = threading.Barrier(3)
+        num_threads = {}
+
+        def run(role):
+            budgets.apply(role)
+            # Like learn_D waiting for its turn, the other roles apply their
+            # budgets before this thread's first op.
+            applied.wait()
+            torch.ones(4).add(1)
+            budgets.apply(role)
+            num_threads[role] = torch.get_num_threads()
+
+        role_threads = [
+            threading.Thread(target=run, args=(role,))
+            for role in ("learner", "d_learner", "inference")
+        ]
+        for thread in role_threads:
+            thread.start()
+        for thread in role_threads:
+            thread.join()
+        self.assertEqual(num_threads, dict(learner=8, d_learner=4, inference=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
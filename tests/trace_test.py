@@ -0,0 +1,113 @@
+# Copyright urw7rs.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the windowed profiler."""
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import torch
+from torchbeast.core import trace
+
+
+def learner_step(profiler):
+    with torch.profiler.record_function("learn"):
+        torch.ones(4, 4).mm(torch.ones(4, 4))
+    profiler.step()
+
+
+def record(name, stop):
+    while not stop.is_set():
+        with torch.profiler.record_function(name):
+            torch.ones(4, 4).mm(torch.ones(4, 4))
+
+
+def learner(profiler, num_steps):
+    for _ in range(num_steps):
+        learner_step(profiler)
+        # Let the other threads run, as during the learner's forward/backward.
+        time.sleep(0.01)
+
+
+class WindowedProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.trace_dir = os.path.join(self.tmpdir.name, "traces")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_bad_construct(self):
+        with self.assertRaisesRegex(ValueError, "steps >= 1"):
+            trace.WindowedProfiler(self.trace_dir, steps=0)
+
+    def test_every(self):
+        profiler = trace.WindowedProfiler(self.trace_dir, steps=2, every=5)
+        for _ in range(11):
+            learner_step(profiler)
+        profiler.close()
+
+        self.assertEqual(
+            sorted(os.listdir(self.trace_dir)), ["trace-10.json.gz", "trace-5.json.gz"]
+        )
+
+        with gzip.open(os.path.join(self.trace_dir, "trace-5.json.gz")) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertIn("learn", [event.get("name") for event in events])
+
+    def test_request(self):
+        profiler = trace.WindowedProfiler(self.trace_dir, steps=1)
+        for _ in range(3):
+            learner_step(profiler)
+        self.assertFalse(os.path.exists(self.trace_dir))
+
+        profiler.request()
+        for _ in range(3):
+            learner_step(profiler)
+        profiler.wait()
+        self.assertEqual(os.listdir(self.trace_dir), ["trace-4.json.gz"])
+
+    @unittest.skipIf(trace.all_threads_config() is None, "Needs PyTorch 2.7")
+    def test_threads(self):
+        profiler = trace.WindowedProfiler(self.trace_dir, steps=4, every=3)
+
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=record, args=(name, stop))
+            for name in ("inference", "learn_D")
+        ]
+        threads += [
+            threading.Thread(target=learner, args=(profiler, 4)) for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads[2:]:
+            thread.join()
+        stop.set()
+        for thread in threads[:2]:
+            thread.join()
+        profiler.close()
+
+        self.assertEqual(os.listdir(self.trace_dir), ["trace-3.json.gz"])
+        with gzip.open(os.path.join(self.trace_dir, "trace-3.json.gz")) as f:
+            names = {event.get("name") for event in json.load(f)["traceEvents"]}
+        self.assertEqual({"inference", "learn_D", "learn"} - names, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -148,6 +148,19 @@ class ActionLogProbsTest(unittest.TestCase):
     def test_action_log_probs_batch_1(self):
         self.test_action_log_probs(1)
 
+    def test_action_log_probs_head_mask(self):
+        action_shape = [2, 4, 3]
+        policy_logits = [torch.randn(7, 2, n) for n in action_shape]
+        actions = torch.stack([torch.randint(n, (7, 2)) for n in action_shape], -1)
+        head_mask = torch.tensor([1.0, 0.0, 1.0]).expand(7, 2, 3)
+
+        head_log_probs = vtrace.head_log_probs(policy_logits, actions)
+        self.assertEqual(head_log_probs.shape, (7, 2, 3))
+        assert_allclose(
+            vtrace.action_log_probs(policy_logits, actions, head_mask),
+            head_log_probs[..., 0] + head_log_probs[..., 2],
+        )
+
 
 class VtraceTest(unittest.TestCase):
     def test_vtrace(self, batch_size=5):
@@ -0,0 +1,251 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Checkpoints written from a background thread."""
+
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+
+import torch
+
+# Checkpoint entries needed for common uses, None loads everything.
+COMPONENTS = {
+    "model": ["flags", "model_state_dict"],
+    "model+D": ["flags", "model_state_dict", "D_state_dict"],
+    "full": None,
+}
+
+MANIFEST = "manifest.json"
+
+
+def read_manifest(component_dir, suffix=""):
+    """The component files of a per-component checkpoint, by entry name."""
+    with open(os.path.join(component_dir, MANIFEST + suffix)) as f:
+        return json.load(f)
+
+
+def load_checkpoint(path, components="full", map_location=None, per_component=None):
+    """Load `components` of a checkpoint written by AsyncCheckpointer.
+
+    Tensors are memory-mapped, so state dicts that aren't requested are never
+    read from disk. With `per_component=None` the newer of `path` and its
+    per-component directory is loaded.
+    """
+    if components not in COMPONENTS:
+        raise ValueError("Unknown checkpoint components %s" % components)
+    keys = COMPONENTS[components]
+
+    component_dir = path + ".d"
+    manifest_path = os.path.join(component_dir, MANIFEST)
+    if per_component is None:
+        per_component = os.path.exists(manifest_path) and (
+            not os.path.exists(path)
+            or os.path.getmtime(manifest_path) > os.path.getmtime(path)
+        )
+
+    def load(filename):
+        # Our own files, which store flags and numpy stats.
+        return torch.load(
+            filename, map_location=map_location, mmap=True, weights_only=False
+        )
+
+    if not per_component:
+        state = load(path)
+        if keys is None:
+            return state
+        return {k: state[k] for k in keys if k in state}
+
+    # The manifest names the files of one save, so components of different
+    # saves are never mixed.
+    manifest = read_manifest(component_dir)
+    if keys is None:
+        keys = sorted(manifest)
+    return {
+        k: load(os.path.join(component_dir, manifest[k])) for k in keys if k in manifest
+    }
+
+
+def to_cpu(state):
+    """Copy all tensors in a (nested) state dict to the CPU."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return type(state)((k, to_cpu(v)) for k, v in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(to_cpu(v) for v in state)
+    return state
+
+
+def replace_rotating(tmp_path, path, keep=1):
+    """Atomically move `tmp_path` to `path`, keeping `keep - 1` old versions.
+
+    Old versions are kept as `path.1` (newest) to `path.<keep - 1>`. `path`
+    exists at all times once it was written.
+    """
+    if keep > 1 and os.path.exists(path):
+        for i in range(keep - 2, 0, -1):
+            if os.path.exists("%s.%i" % (path, i)):
+                os.replace("%s.%i" % (path, i), "%s.%i" % (path, i + 1))
+        tmp_old_path = "%s.1.%i.tmp" % (path, os.getpid())
+        try:
+            os.link(path, tmp_old_path)
+        except OSError:
+            shutil.copyfile(path, tmp_old_path)
+        os.replace(tmp_old_path, path + ".1")
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointer:
+    """Writes checkpoints from a background thread.
+
+    `save` copies the state to the CPU, which the caller should do while
+    holding the locks of the modules being saved, and returns without
+    waiting for the disk. A snapshot still waiting to be written is replaced
+    by the newer one. Writes are atomic.
+
+    With `per_component` each top-level entry is saved to
+    `<path>.d/<name>-<digest>.pt`, so unchanged entries are shared between
+    saves instead of rewritten. A save is committed by atomically replacing
+    `<path>.d/manifest.json`, which lists its files. `keep` rotates the
+    manifests and files no kept manifest refers to are deleted.
+    """
+
+    def __init__(self, path, keep=1, per_component=False):
+        if keep < 1:
+            raise ValueError("Need to keep at least one checkpoint")
+
+        self.path = path
+        self.keep = keep
+        self.per_component = per_component
+
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(
+            target=self._run, name="checkpoint-thread", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def component_dir(self):
+        return self.path + ".d"
+
+    def exists(self):
+        if self.per_component and self._has_manifest():
+            return True
+        return os.path.exists(self.path)
+
+    def _has_manifest(self):
+        return os.path.exists(os.path.join(self.component_dir, MANIFEST))
+
+    def save(self, state):
+        """Snapshot `state` and queue it, replacing a snapshot not written yet."""
+        snapshot = to_cpu(state)
+        while True:
+            try:
+                self._queue.put_nowait(snapshot)
+                return
+            except queue.Full:
+                pass
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                logging.info("Checkpoint superseded before it was written")
+            except queue.Empty:
+                pass
+
+    def wait(self):
+        """Block until all queued checkpoints are written."""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def load(self, components="full", map_location=None):
+        return load_checkpoint(
+            self.path,
+            components,
+            map_location,
+            per_component=self.per_component and self._has_manifest(),
+        )
+
+    def _run(self):
+        while True:
+            state = self._queue.get()
+            try:
+                if state is None:
+                    return
+                if self.per_component:
+                    self._write_components(state)
+                else:
+                    self._write(state, self.path)
+                    logging.info("Saved checkpoint to %s", self.path)
+            except Exception:
+                logging.exception("Failed to write checkpoint")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, state, path):
+        tmp_path = "%s.%i.tmp" % (path, os.getpid())
+        torch.save(state, tmp_path)
+        replace_rotating(tmp_path, path, self.keep)
+
+    def _write_components(self, state):
+        os.makedirs(self.component_dir, exist_ok=True)
+
+        manifest = {}
+        written = []
+        for name, component in state.items():
+            buffer = io.BytesIO()
+            torch.save(component, buffer)
+            data = buffer.getvalue()
+
+            filename = "%s-%s.pt" % (name, hashlib.sha1(data).hexdigest()[:16])
+            manifest[name] = filename
+            path = os.path.join(self.component_dir, filename)
+            if os.path.exists(path):
+                continue  # Unchanged since a kept save.
+
+            tmp_path = "%s.%i.tmp" % (path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            written.append(name)
+
+        manifest_path = os.path.join(self.component_dir, MANIFEST)
+        tmp_path = "%s.%i.tmp" % (manifest_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        replace_rotating(tmp_path, manifest_path, self.keep)
+
+        self._remove_unreferenced()
+        logging.info(
+            "Saved checkpoint components %s to %s", written, self.component_dir
+        )
+
+    def _remove_unreferenced(self):
+        referenced = set()
+        for suffix in [""] + [".%i" % i for i in range(1, self.keep)]:
+            try:
+                referenced.update(read_manifest(self.component_dir, suffix).values())
+            except FileNotFoundError:
+                pass
+        for path in glob.glob(os.path.join(self.component_dir, "*.pt")):
+            if os.path.basename(path) not in referenced:
+                os.remove(path)
@@ -16,12 +16,18 @@
 import copy
 import csv
 import datetime
+import glob
 import json
 import logging
+import numbers
 import os
+import queue
+import threading
 import time
 from typing import Dict
 
+import numpy as np
+
 
 def gather_metadata() -> Dict:
     date_start = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
@@ -61,6 +67,26 @@ def gather_metadata() -> Dict:
     )
 
 
+def read_last_line(path: str, block_size: int = 4096) -> str:
+    """Return the last non-empty line of `path`, reading it from the end."""
+    if not os.path.exists(path):
+        return ""
+
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        data = b""
+        while end > 0:
+            start = max(end - block_size, 0)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+
+            stripped = data.rstrip(b"\r\n")
+            if b"\n" in stripped:
+                return stripped.rsplit(b"\n", 1)[1].decode()
+        return data.rstrip(b"\r\n").decode()
+
+
 class FileWriter:
     def __init__(
         self,
@@ -150,21 +176,17 @@ class FileWriter:
             self._logger.warning(
                 "Path to log file already exists. " "New data will be appended."
             )
+            # Only the last lines are needed, so don't read the whole files.
             # Override default fieldnames.
-            with open(self.paths["fields"], "r") as csvfile:
-                reader = csv.reader(csvfile)
-                lines = list(reader)
-                if len(lines) > 0:
-                    self.fieldnames = lines[-1]
+            line = read_last_line(self.paths["fields"])
+            if line:
+                self.fieldnames = next(csv.reader([line]))
             # Override default tick: use the last tick from the logs file plus 1.
-            with open(self.paths["logs"], "r") as csvfile:
-                reader = csv.reader(csvfile)
-                lines = list(reader)
-                # Need at least two lines in order to read the last tick:
-                # the first is the csv header and the second is the first line
-                # of data.
-                if len(lines) > 1:
-                    self._tick = int(lines[-1][0]) + 1
+            line = read_last_line(self.paths["logs"])
+            # The csv header starts with '#', it's followed by the first line
+            # of data.
+            if line and not line.startswith("#"):
+                self._tick = int(next(csv.reader([line]))[0]) + 1
 
         self._fieldfile = open(self.paths["fields"], "a")
         self._fieldwriter = csv.writer(self._fieldfile)
@@ -174,10 +196,13 @@ class FileWriter:
     def log(self, to_log: Dict, tick: int = None, verbose: bool = False) -> None:
         if tick is not None:
             raise NotImplementedError
-        else:
-            to_log["_tick"] = self._tick
-            self._tick += 1
         to_log["_time"] = time.time()
+        self._write(to_log, verbose)
+        self._logfile.flush()
+
+    def _write(self, to_log: Dict, verbose: bool = False) -> None:
+        to_log["_tick"] = self._tick
+        self._tick += 1
 
         old_len = len(self.fieldnames)
         for k in to_log:
@@ -197,7 +222,6 @@ class FileWriter:
             )
 
         self._logwriter.writerow(to_log)
-        self._logfile.flush()
 
     def close(self, successful: bool = True) -> None:
         self.metadata["date_end"] = datetime.datetime.now().strftime(
@@ -212,3 +236,151 @@ class FileWriter:
     def _save_metadata(self) -> None:
         with open(self.paths["meta"], "w") as jsonfile:
             json.dump(self.metadata, jsonfile, indent=4, sort_keys=True)
+
+
+class AsyncFileWriter(FileWriter):
+    """FileWriter that writes from a background thread.
+
+    `log` only copies the row into a bounded queue. Rows are written in
+    batches every `flush_interval` seconds. When the queue is full, rows are
+    dropped and counted in `num_dropped`.
+
+    With `log_format="npz"` rows go to numpy chunks of `chunk_size` rows in
+    `<basepath>/logs/` instead of logs.csv, see `read_npz_logs`.
+    """
+
+    LOG_FORMATS = ["csv", "npz"]
+
+    def __init__(
+        self,
+        *args,
+        log_format: str = "csv",
+        flush_interval: float = 5.0,
+        max_queue_size: int = 10000,
+        chunk_size: int = 10000,
+        **kwargs,
+    ):
+        if log_format not in self.LOG_FORMATS:
+            raise ValueError("Unknown log format %s" % log_format)
+
+        super().__init__(*args, **kwargs)
+
+        self.log_format = log_format
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        self.num_dropped = 0
+
+        if log_format == "npz":
+            # Continue after the last chunk instead of logs.csv.
+            paths = sorted(glob.glob(os.path.join(self.basepath, "logs", "*.npz")))
+            if paths:
+                with np.load(paths[-1], allow_pickle=True) as data:
+                    self._tick = int(data["_tick"][-1]) + 1
+
+        self._chunk = []
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(
+            target=self._run, name="file-writer-thread", daemon=True
+        )
+        self._thread.start()
+
+    def log(self, to_log: Dict, tick: int = None, verbose: bool = False) -> None:
+        if tick is not None:
+            raise NotImplementedError
+        row = dict(to_log)
+        row["_time"] = time.time()
+        try:
+            self._queue.put_nowait((row, verbose))
+        except queue.Full:
+            self.num_dropped += 1
+
+    def close(self, successful: bool = True) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        super().close(successful)
+
+    def _run(self):
+        closed = False
+        while not closed:
+            rows = []
+            deadline = time.time() + self.flush_interval
+            while not closed:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closed = True
+                else:
+                    rows.append(item)
+
+            if rows:
+                self._write_rows(rows)
+
+    def _write_rows(self, rows):
+        if self.log_format == "csv":
+            for row, verbose in rows:
+                self._write(row, verbose)
+            self._logfile.flush()
+            return
+
+        for row, verbose in rows:
+            row["_tick"] = self._tick
+            self._tick += 1
+            for k in row:
+                if k not in self.fieldnames:
+                    self.fieldnames.append(k)
+            self._chunk.append(row)
+
+            if len(self._chunk) == self.chunk_size:
+                self._write_chunk()
+                self._chunk = []
+        if self._chunk:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        # Rewritten on every flush until the chunk is full.
+        directory = os.path.join(self.basepath, "logs")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "logs-%012i.npz" % self._chunk[0]["_tick"])
+
+        columns = {}
+        for field in self.fieldnames:
+            values = [row.get(field) for row in self._chunk]
+            if all(v is None or isinstance(v, numbers.Number) for v in values):
+                columns[field] = np.array(
+                    [np.nan if v is None else v for v in values], dtype=np.float64
+                )
+            else:
+                # Keep tuples such as episode_returns as single objects.
+                columns[field] = np.empty(len(values), dtype=object)
+                for i, v in enumerate(values):
+                    columns[field][i] = v
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **columns)
+        os.replace(tmp_path, path)
+
+
+def read_npz_logs(basepath: str) -> Dict[str, np.ndarray]:
+    """Concatenate the npz chunks written by AsyncFileWriter into columns."""
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(basepath, "logs", "*.npz"))):
+        with np.load(path, allow_pickle=True) as data:
+            chunks.append({k: data[k] for k in data.files})
+
+    fields = []
+    for chunk in chunks:
+        fields.extend(k for k in chunk if k not in fields)
+
+    columns = {}
+    for field in fields:
+        parts = []
+        for chunk in chunks:
+            if field in chunk:
+                parts.append(chunk[field])
+            else:
+                parts.append(np.full(len(chunk["_tick"]), np.nan))
+        columns[field] = np.concatenate(parts)
+    return columns
@@ -0,0 +1,209 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Inference in worker processes, outside the learner's interpreter.
+
+The batcher lives in the learner process, so each worker is served by a
+thread there. The thread copies the batch inputs into shared memory buffers
+allocated once at the maximum batch size, sends the worker the batch size
+and waits for it to write the outputs into shared buffers of its own. Only
+the batch size and, once, the buffers go through the pipe.
+
+The workers hold the actor model itself, moved to shared memory, so loading
+a new state dict into it in the learner updates the workers too.
+"""
+
+import logging
+import threading
+import traceback
+
+import nest
+import torch
+import torch.multiprocessing as mp
+from libtorchbeast import tensor_nest
+
+
+def _shared_empty(tensor, max_batch_size, batch_dim):
+    shape = list(tensor.shape)
+    shape[batch_dim] = max_batch_size
+    return tensor.new_empty(shape).share_memory_()
+
+
+def _narrow(tensors, batch_dim, batch_size):
+    return [t.narrow(batch_dim, 0, batch_size) for t in tensors]
+
+
+def _work(conn, forward, model, max_batch_size, batch_dim, num_threads):
+    torch.set_num_threads(num_threads)
+
+    inputs = structure = output_leaves = None
+    try:
+        with torch.no_grad():
+            while True:
+                message = conn.recv()
+                if message is None:
+                    return
+                if not isinstance(message, int):
+                    inputs = message
+                    continue
+
+                outputs = forward(
+                    model, tensor_nest.slice(inputs, batch_dim, 0, message)
+                )
+
+                new_buffers = None
+                if structure is None:
+                    structure = nest.structure(outputs)
+                    new_buffers = nest.map(
+                        lambda t: _shared_empty(t, max_batch_size, batch_dim),
+                        outputs,
+                    )
+                    output_leaves = nest.flatten(new_buffers)
+
+                for dst, src in zip(
+                    _narrow(output_leaves, batch_dim, message),
+                    structure.flatten(outputs),
+                ):
+                    dst.copy_(src)
+                conn.send(new_buffers)
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except Exception:
+        logging.error("Exception in inference worker!")
+        traceback.print_exc()
+    finally:
+        conn.close()
+
+
+class InferenceWorkers:
+    """Runs `forward(model, inputs)` on the batches of a batcher in processes.
+
+    `forward` has to be picklable, e.g. a module level function or a
+    `functools.partial` of one. The model has to be on the CPU.
+    """
+
+    def __init__(
+        self,
+        forward,
+        model,
+        num_workers,
+        num_threads=1,
+        max_batch_size=512,
+        batch_dim=1,
+    ):
+        self._max_batch_size = max_batch_size
+        self._batch_dim = batch_dim
+        self._threads = []
+
+        model.share_memory()
+
+        ctx = mp.get_context("spawn")
+        self._conns = []
+        self._processes = []
+        for i in range(num_workers):
+            conn, worker_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_work,
+                name="inference-worker-%i" % i,
+                args=(
+                    worker_conn,
+                    forward,
+                    model,
+                    max_batch_size,
+                    batch_dim,
+                    num_threads,
+                ),
+                daemon=True,
+            )
+            process.start()
+            worker_conn.close()
+            self._conns.append(conn)
+            self._processes.append(process)
+
+    def _serve(self, index, batcher, timings):
+        conn = self._conns[index]
+        input_structure = input_leaves = None
+        output_structure = output_leaves = None
+        try:
+            for batch in batcher:
+                inputs = batch.get_inputs()
+                if input_structure is None:
+                    input_structure = nest.structure(inputs)
+                    buffers = nest.map(
+                        lambda t: _shared_empty(
+                            t, self._max_batch_size, self._batch_dim
+                        ),
+                        inputs,
+                    )
+                    input_leaves = nest.flatten(buffers)
+                    conn.send(buffers)
+
+                with timings.timer("inference_worker"):
+                    leaves = input_structure.flatten(inputs)
+                    batch_size = leaves[0].shape[self._batch_dim]
+                    if batch_size > self._max_batch_size:
+                        raise ValueError(
+                            "Batch of %i is larger than the maximum of %i"
+                            % (batch_size, self._max_batch_size)
+                        )
+                    for dst, src in zip(
+                        _narrow(input_leaves, self._batch_dim, batch_size), leaves
+                    ):
+                        dst.copy_(src)
+
+                    conn.send(batch_size)
+                    try:
+                        new_buffers = conn.recv()
+                    except EOFError:
+                        raise RuntimeError("Inference worker %i exited" % index)
+
+                    if new_buffers is not None:
+                        output_structure = nest.structure(new_buffers)
+                        output_leaves = nest.flatten(new_buffers)
+
+                    # The buffers are reused, the actors get copies.
+                    outputs = [
+                        t.clone()
+                        for t in _narrow(output_leaves, self._batch_dim, batch_size)
+                    ]
+                batch.set_outputs(output_structure.pack(outputs))
+        finally:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def start(self, batcher, timings):
+        """Serves batches from `batcher` until it is closed."""
+        for i in range(len(self._processes)):
+            thread = threading.Thread(
+                target=self._serve,
+                name="inference-worker-thread-%i" % i,
+                args=(i, batcher, timings),
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+        for conn in self._conns:
+            # Workers without a thread haven't been told to stop yet.
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        for conn in self._conns:
+            conn.close()
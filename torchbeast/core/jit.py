@@ -0,0 +1,102 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""TorchScript export of inference models with an on-disk cache."""
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+
+import torch
+
+
+def _source_hash(module):
+    """Hash the code of `module` and its submodules, so edits invalidate."""
+    sha = hashlib.sha1()
+    classes = {type(m) for m in module.modules()}
+    for cls in sorted(classes, key=lambda c: (c.__module__, c.__qualname__)):
+        sha.update(("%s.%s" % (cls.__module__, cls.__qualname__)).encode())
+        if cls.__module__.startswith("torch."):
+            continue  # Covered by the torch version.
+        try:
+            sha.update(inspect.getsource(cls).encode())
+        except (OSError, TypeError):
+            pass
+    return sha.hexdigest()
+
+
+def _memory_format(module):
+    for p in module.parameters():
+        if p.dim() == 4 and not p.is_contiguous():
+            if p.is_contiguous(memory_format=torch.channels_last):
+                return "channels_last"
+    return "contiguous"
+
+
+def cache_key(module, device, config=None):
+    """Return a key identifying a traced `module` built from `config`.
+
+    The key covers the source of the module's classes and the memory format
+    of its weights, the cache is shared between experiments.
+    """
+    description = dict(
+        module=type(module).__name__,
+        source=_source_hash(module),
+        memory_format=_memory_format(module),
+        device=str(device),
+        torch=torch.__version__,
+        config=config or {},
+    )
+    encoded = json.dumps(description, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def trace(module, example_inputs, device, cache_dir=None, config=None):
+    """Trace `module` in eval mode, loading from `cache_dir` when possible.
+
+    The returned ScriptModule holds a copy of `module`'s current weights.
+    Later weights are published with `load_state_dict` as usual. Traced
+    models are specialised to the example's time dimension but not to the
+    batch dimension.
+    """
+    module.eval()
+
+    path = None
+    if cache_dir is not None:
+        filename = "%s-%s.pt" % (
+            type(module).__name__,
+            cache_key(module, device, config),
+        )
+        path = os.path.join(cache_dir, filename)
+
+    if path is not None and os.path.exists(path):
+        logging.info("Loading traced %s from %s", type(module).__name__, path)
+        traced = torch.jit.load(path, map_location=device)
+    else:
+        logging.info("Tracing %s", type(module).__name__)
+        with torch.no_grad():
+            # Sampling actions makes outputs nondeterministic, skip the check.
+            traced = torch.jit.trace(
+                module, example_inputs, strict=False, check_trace=False
+            )
+
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = "%s.%i.tmp" % (path, os.getpid())
+            torch.jit.save(traced, tmp_path)
+            os.replace(tmp_path, path)
+
+    traced.load_state_dict(module.state_dict())
+    return traced.eval()
@@ -22,7 +22,9 @@ import collections
 
 
 class Net(nn.Module):
-    def __init__(self, obs_shape, order, action_shape, grid_shape):
+    def __init__(
+        self, obs_shape, order, action_shape, grid_shape, skip_masked_heads=False
+    ):
         super(Net, self).__init__()
         self._num_actions = len(action_shape)
 
@@ -71,7 +73,7 @@ class Net(nn.Module):
 
         self.lstm = nn.LSTM(256, 256, num_layers=1)
 
-        self.policy = Decoder(order, action_shape, grid_shape)
+        self.policy = Decoder(order, action_shape, grid_shape, skip_masked_heads)
         self.baseline = nn.Linear(256, 1)
 
     def _grid(self, batch, h, w):
@@ -129,6 +131,8 @@ class Net(nn.Module):
 
 class Decoder(nn.Module):
     SPATIAL_ACTIONS = ["end", "control"]
+    # The only heads the environment uses when flag == 0 moves the brush.
+    MOVE_ACTIONS = ["flag", "end"]
     ORDER = [
         "flag",
         "end",
@@ -141,12 +145,16 @@ class Decoder(nn.Module):
         "blue",
     ]
 
-    def __init__(self, order, action_shape, grid_shape):
+    def __init__(self, order, action_shape, grid_shape, skip_masked_heads=False):
         super(Decoder, self).__init__()
         self._order = [k for k in self.ORDER if k in order]
         self._action_order = order
+        # Move actions are decoded first, so no head skipped while moving
+        # feeds into one that is used.
+        self._skip_masked_heads = skip_masked_heads and "flag" in order
 
         action_shape = dict(zip(self._action_order, action_shape))
+        self._action_shape = action_shape
 
         modules = {}
         for k in self._action_order:
@@ -211,9 +219,17 @@ class Decoder(nn.Module):
         else:
             dict_actions = collections.OrderedDict({k: None for k in self._action_order})
 
+            paint = None
             for k in self._order:
-                logit = self.decode[k](h)
-                action = torch.multinomial(F.softmax(logit, dim=1), num_samples=1)
+                if paint is None or k in self.MOVE_ACTIONS:
+                    logit, action = self._sample(k, h)
+                else:
+                    logit, action = self._sample_rows(k, h, paint)
+
+                if self._skip_masked_heads and k == "flag":
+                    paint = action[:, 0].nonzero(as_tuple=True)[0]
+                    if len(paint) == len(action):
+                        paint = None
 
                 dict_actions[k] = action
                 dict_logits[k] = logit
@@ -229,6 +245,38 @@ class Decoder(nn.Module):
             logits = list(dict_logits.values())
             return actions, logits
 
+    def _sample(self, k, h):
+        logit = self.decode[k](h)
+        action = torch.multinomial(F.softmax(logit, dim=1), num_samples=1)
+        return logit, action
+
+    def _sample_rows(self, k, h, rows):
+        """Sample head `k` for `rows` only, others get zero logits and action 0."""
+        logit = h.new_zeros(h.size(0), self._action_shape[k])
+        action = torch.zeros(h.size(0), 1, dtype=torch.long, device=h.device)
+        if len(rows) > 0:
+            rows_logit, rows_action = self._sample(k, h[rows])
+            logit = logit.to(rows_logit.dtype)
+            logit[rows] = rows_logit
+            action[rows] = rows_action
+        return logit, action
+
+    def head_mask(self, actions):
+        """Float mask of the heads used by `actions`, in `order`.
+
+        Heads the environment ignores while moving are 0 when skipped, so
+        their sampled action 0 doesn't enter the losses.
+        """
+        mask = torch.ones_like(actions, dtype=torch.float)
+        if not self._skip_masked_heads:
+            return mask
+
+        paint = actions[..., self._action_order.index("flag")] != 0
+        for i, k in enumerate(self._action_order):
+            if k not in self.MOVE_ACTIONS:
+                mask[..., i] = paint.float()
+        return mask
+
 
 class ConvDecoder(nn.Module):
     def __init__(self):
@@ -0,0 +1,119 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A painting environment without a renderer, for benchmarking the pipeline."""
+
+import time
+
+import gym
+import numpy as np
+from gym import spaces
+
+PRESSURE_BINS = 10
+COLOR_BINS = 20
+
+
+class NullPaint(gym.Env):
+    """Numpy stand-in for the libmypaint environment.
+
+    Has the observation and action spaces of `Libmypaint`, but painting
+    stamps a square at the end point of the stroke. Each step busy-waits
+    until `step_cost_ms` have passed, to stand in for the renderer's CPU
+    time.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(
+        self,
+        episode_length=20,
+        canvas_width=256,
+        grid_width=32,
+        brush_sizes=(1, 2, 4, 8, 12, 24),
+        use_pressure=True,
+        use_color=False,
+        step_cost_ms=0.0,
+        **kwargs,
+    ):
+        self._episode_length = episode_length
+        self._canvas_width = canvas_width
+        self._grid_width = grid_width
+        self._brush_sizes = brush_sizes
+        self._use_color = use_color
+        self._step_cost = step_cost_ms / 1000
+
+        shape = dict(
+            control=grid_width * grid_width,
+            end=grid_width * grid_width,
+            flag=2,
+            size=len(brush_sizes),
+        )
+        if use_pressure:
+            shape["pressure"] = PRESSURE_BINS
+        if use_color:
+            shape.update(red=COLOR_BINS, green=COLOR_BINS, blue=COLOR_BINS)
+        self.order = list(shape)
+
+        self.observation_space = spaces.Dict(
+            {
+                "canvas": spaces.Box(
+                    low=0,
+                    high=255,
+                    shape=(canvas_width, canvas_width, 3),
+                    dtype=np.uint8,
+                )
+            }
+        )
+        self.action_space = spaces.MultiDiscrete([shape[k] for k in self.order])
+
+        self._canvas = np.full((canvas_width, canvas_width, 3), 255, dtype=np.uint8)
+        self._episode_step = 0
+
+    def _obs(self):
+        return {"canvas": self._canvas.copy()}
+
+    def reset(self):
+        self._canvas.fill(255)
+        self._episode_step = 0
+        return self._obs()
+
+    def step(self, action):
+        start = time.perf_counter()
+
+        action = dict(zip(self.order, action))
+        if action["flag"]:
+            self._paint(action)
+
+        self._episode_step += 1
+        done = self._episode_step >= self._episode_length
+
+        obs = self._obs()
+        while time.perf_counter() - start < self._step_cost:
+            pass
+        return obs, 0.0, done, {}
+
+    def _paint(self, action):
+        cell = self._canvas_width / self._grid_width
+        y, x = divmod(int(action["end"]), self._grid_width)
+        y, x = int((y + 0.5) * cell), int((x + 0.5) * cell)
+        radius = max(int(self._brush_sizes[action["size"]]) // 2, 1)
+
+        color = 0
+        if self._use_color:
+            color = [
+                action[k] * 255 // (COLOR_BINS - 1) for k in ["red", "green", "blue"]
+            ]
+        self._canvas[
+            max(y - radius, 0) : y + radius, max(x - radius, 0) : x + radius
+        ] = color
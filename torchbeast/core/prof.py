@@ -14,6 +14,8 @@
 """Naive profiling using timeit. (Used in MonoBeast.)"""
 
 import collections
+import contextlib
+import threading
 import timeit
 
 
@@ -44,6 +46,10 @@ class Timings:
         x = now - self.last_time
         self.last_time = now
 
+        self.add(name, x)
+
+    def add(self, name, x):
+        """Save a duration `x` in seconds for event `name`."""
         n = self._counts[name]
 
         mean = self._means[name] + (x - self._means[name]) / (n + 1)
@@ -79,3 +85,57 @@ class Timings:
             )
         result += "\nTotal: %.6fms" % (1000 * total)
         return result
+
+
+class ThreadSafeTimings(Timings):
+    """Timings shared between threads.
+
+    Durations are measured with `timer` or passed to `add` directly rather
+    than taken between consecutive `time` calls, which only makes sense
+    within one thread. A window of the most recent durations per event is
+    kept for percentiles.
+    """
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=self._window)
+        )
+        super().__init__()
+
+    def add(self, name, x):
+        with self._lock:
+            super().add(name, x)
+            self._samples[name].append(x)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.add(name, timeit.default_timer() - start)
+
+    def means(self):
+        with self._lock:
+            return dict(self._means)
+
+    def vars(self):
+        with self._lock:
+            return dict(self._vars)
+
+    def stds(self):
+        return {k: v ** 0.5 for k, v in self.vars().items()}
+
+    def percentiles(self, qs=(50, 90, 99)):
+        """Return `{"<name>_p<q>_ms": ...}` over the recent window."""
+        with self._lock:
+            samples = {k: sorted(v) for k, v in self._samples.items() if v}
+
+        result = {}
+        for name, values in samples.items():
+            for q in qs:
+                index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+                result["%s_p%i_ms" % (name, q)] = 1000 * values[index]
+        return result
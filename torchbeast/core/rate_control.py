@@ -0,0 +1,101 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rate control between the policy learner and the discriminator learner."""
+
+import threading
+import timeit
+
+
+class UpdateRateController:
+    """Throttles discriminator updates relative to policy updates. Thread-safe.
+
+    With `policy_steps_per_D_step` > 0 the discriminator may only take its
+    n-th step once the policy has taken `policy_steps_per_D_step * n` steps.
+    With `max_D_steps_per_second` > 0 discriminator steps are additionally
+    spaced out in time. Zero disables the respective limit. The policy
+    learner is never throttled.
+    """
+
+    def __init__(self, policy_steps_per_D_step=0.0, max_D_steps_per_second=0.0):
+        if policy_steps_per_D_step < 0 or max_D_steps_per_second < 0:
+            raise ValueError("Update rates must be >= 0")
+
+        self._ratio = policy_steps_per_D_step
+        self._min_interval = (
+            1.0 / max_D_steps_per_second if max_D_steps_per_second > 0 else 0.0
+        )
+
+        self._cond = threading.Condition()
+        self._closed = False
+        self._policy_steps = 0
+        self._D_steps = 0
+        self._last_D_step_time = None
+
+        self._last_rates_time = timeit.default_timer()
+        self._last_rates_steps = (0, 0)
+
+    def policy_step(self):
+        with self._cond:
+            self._policy_steps += 1
+            self._cond.notify_all()
+
+    def wait_D_step(self):
+        """Block until the discriminator may update. Returns False once closed."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._closed
+                or self._ratio <= 0
+                or self._policy_steps >= self._ratio * self._D_steps
+            )
+
+            if self._min_interval > 0 and self._last_D_step_time is not None:
+                delay = (
+                    self._last_D_step_time + self._min_interval - timeit.default_timer()
+                )
+                if delay > 0:
+                    self._cond.wait_for(lambda: self._closed, timeout=delay)
+
+            if self._closed:
+                return False
+
+            self._last_D_step_time = timeit.default_timer()
+            return True
+
+    def D_step(self):
+        with self._cond:
+            self._D_steps += 1
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def rates(self):
+        """Return achieved update rates since the last call."""
+        with self._cond:
+            now = timeit.default_timer()
+            elapsed = max(now - self._last_rates_time, 1e-6)
+            last_policy_steps, last_D_steps = self._last_rates_steps
+
+            policy_steps = self._policy_steps - last_policy_steps
+            D_steps = self._D_steps - last_D_steps
+
+            self._last_rates_time = now
+            self._last_rates_steps = (self._policy_steps, self._D_steps)
+
+        return dict(
+            policy_steps_per_second=policy_steps / elapsed,
+            D_steps_per_second=D_steps / elapsed,
+            policy_steps_per_D_step=policy_steps / max(D_steps, 1),
+        )
@@ -0,0 +1,86 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fixed-capacity replay buffer of final canvases for the discriminator."""
+
+import threading
+
+import torch
+
+
+class ReplayBuffer:
+    """Ring buffer of frames stored as uint8. Thread-safe.
+
+    Frames are expected to be float tensors in [0, 1] of shape [N, C, H, W].
+    Storage is preallocated so filling the buffer never allocates.
+    """
+
+    SAMPLING = ["uniform", "latest"]
+
+    def __init__(self, capacity, obs_shape, sampling="uniform"):
+        if capacity < 1:
+            raise ValueError("Replay buffer capacity must be >= 1")
+        if sampling not in self.SAMPLING:
+            raise ValueError("Unknown sampling method '%s'" % sampling)
+
+        self._capacity = capacity
+        self._sampling = sampling
+        self._frames = torch.zeros((capacity,) + tuple(obs_shape), dtype=torch.uint8)
+
+        self._lock = threading.Lock()
+        self._index = 0
+        self._size = 0
+        self._num_added = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._size
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def num_added(self):
+        with self._lock:
+            return self._num_added
+
+    def add(self, frames):
+        frames = frames.mul(255).round_().clamp_(0, 255).to(torch.uint8)
+        frames = frames[-self._capacity :]
+        n = frames.shape[0]
+
+        with self._lock:
+            indices = torch.arange(self._index, self._index + n) % self._capacity
+            self._frames[indices] = frames
+
+            self._index = (self._index + n) % self._capacity
+            self._size = min(self._size + n, self._capacity)
+            self._num_added += n
+
+    def sample(self, batch_size, device=None):
+        with self._lock:
+            if self._size == 0:
+                raise RuntimeError("Cannot sample from an empty replay buffer")
+
+            if self._sampling == "uniform":
+                indices = torch.randint(self._size, (batch_size,))
+            else:
+                indices = torch.arange(self._index - batch_size, self._index)
+                indices = indices % self._size
+
+            frames = self._frames[indices]
+
+        # Copy uint8 frames to the device before converting to save bandwidth.
+        if device is not None:
+            frames = frames.to(device, non_blocking=True)
+        return frames.float().div_(255)
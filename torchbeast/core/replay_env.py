@@ -0,0 +1,162 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Record episodes of an environment and replay them, ignoring actions."""
+
+import glob
+import logging
+import os
+
+import gym
+import numpy as np
+from gym import spaces
+
+OBS_PREFIX = "obs."
+
+
+def save_episodes(path, episodes, order, nvec):
+    """Write `episodes`, lists of (obs, reward, done) starting with the reset.
+
+    Observations are dicts of arrays. Everything is stacked over steps and
+    compressed into a single `.npz` file, written atomically.
+    """
+    steps = [step for episode in episodes for step in episode]
+    data = {
+        OBS_PREFIX + key: np.stack([obs[key] for obs, _, _ in steps])
+        for key in steps[0][0]
+    }
+    data["reward"] = np.array([reward for _, reward, _ in steps], dtype=np.float32)
+    data["done"] = np.array([done for _, _, done in steps], dtype=bool)
+    data["episode_start"] = np.cumsum([0] + [len(e) for e in episodes[:-1]])
+    data["order"] = np.array(order)
+    data["nvec"] = np.array(nvec)
+
+    tmp_path = "%s.%i.tmp.npz" % (path, os.getpid())
+    np.savez_compressed(tmp_path, **data)
+    os.replace(tmp_path, path)
+
+
+def load_episodes(path):
+    """Load the files at `path`, a `.npz` file or a directory of them."""
+    if os.path.isdir(path):
+        paths = sorted(glob.glob(os.path.join(path, "*.npz")))
+    else:
+        paths = [path]
+    if not paths:
+        raise ValueError("No recorded episodes in %s" % path)
+
+    files = [dict(np.load(p)) for p in paths]
+    for f in files[1:]:
+        if list(f["order"]) != list(files[0]["order"]):
+            raise ValueError("Recordings in %s have different actions" % path)
+
+    data = {
+        k: np.concatenate([f[k] for f in files])
+        for k in files[0]
+        if k not in ["episode_start", "order", "nvec"]
+    }
+    offsets = np.cumsum([0] + [len(f["reward"]) for f in files[:-1]])
+    data["episode_start"] = np.concatenate(
+        [f["episode_start"] + offset for f, offset in zip(files, offsets)]
+    )
+    data["order"], data["nvec"] = files[0]["order"], files[0]["nvec"]
+    return data
+
+
+class RecordEpisodes(gym.Wrapper):
+    """Saves the first `num_episodes` episodes to `path`, then passes through."""
+
+    def __init__(self, env, path, num_episodes=100):
+        super().__init__(env)
+        self._path = path
+        self._num_episodes = num_episodes
+        self._episodes = []
+        self._episode = None
+
+    def _record(self, obs, reward, done):
+        if self._episode is not None:
+            # The environment may reuse its arrays.
+            obs = {k: np.array(v, copy=True) for k, v in obs.items()}
+            self._episode.append((obs, reward, done))
+
+    def reset(self):
+        obs = self.env.reset()
+        if len(self._episodes) < self._num_episodes:
+            self._episode = []
+        self._record(obs, 0.0, False)
+        return obs
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        self._record(obs, reward, done)
+        if done and self._episode is not None:
+            self._episodes.append(self._episode)
+            self._episode = None
+            if len(self._episodes) == self._num_episodes:
+                save_episodes(
+                    self._path, self._episodes, self.env.order, self.action_space.nvec
+                )
+                logging.info("Saved %i episodes to %s", self._num_episodes, self._path)
+        return obs, reward, done, info
+
+
+class ReplayPaint(gym.Env):
+    """Replays recorded episodes in order and from the start when done.
+
+    Actions are ignored. The spaces and action order are the recorded
+    environment's, so it can stand in for it anywhere.
+    """
+
+    def configure(self, replay_path, **kwargs):
+        data = load_episodes(replay_path)
+        self._obs = {
+            k[len(OBS_PREFIX) :]: v for k, v in data.items() if k.startswith(OBS_PREFIX)
+        }
+        self._reward = data["reward"]
+        self._done = data["done"]
+        self._episode_start = data["episode_start"]
+        self._episode = -1
+        self._index = 0
+
+        self.order = [str(k) for k in data["order"]]
+        self.action_space = spaces.MultiDiscrete(data["nvec"])
+        self.observation_space = spaces.Dict(
+            {
+                k: (
+                    spaces.Box(low=0, high=255, shape=v.shape[1:], dtype=v.dtype)
+                    if v.dtype == np.uint8
+                    else spaces.Box(
+                        low=-np.inf, high=np.inf, shape=v.shape[1:], dtype=v.dtype
+                    )
+                )
+                for k, v in self._obs.items()
+            }
+        )
+
+    def _observation(self):
+        # A new dict, as wrappers replace entries.
+        return {k: v[self._index] for k, v in self._obs.items()}
+
+    def reset(self):
+        self._episode = (self._episode + 1) % len(self._episode_start)
+        self._index = self._episode_start[self._episode]
+        return self._observation()
+
+    def step(self, action):
+        self._index += 1
+        return (
+            self._observation(),
+            float(self._reward[self._index]),
+            bool(self._done[self._index]),
+            {},
+        )
@@ -0,0 +1,203 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Intra-op thread budgets of the learner process roles and env servers.
+
+With the OpenMP backend `torch.set_num_threads` sizes the parallel regions of
+the calling thread, so every role thread sets its own budget instead of the
+whole process running on one core. It also sets the process wide number that
+other threads start with on their first op. The threads of a role take turns behind a
+lock, so a role's budget is the number of cores it uses at a time.
+
+Budgets are given as "N" for every role, as "learner=8,inference=2" with the
+other roles at 1, or as "auto" to split the cores by measured demand.
+"""
+
+import contextlib
+import os
+import threading
+import timeit
+
+import torch
+
+ROLES = ("learner", "d_learner", "inference", "env")
+
+# Roles of the learner process, the ones "auto" rebalances.
+LEARNER_ROLES = ("learner", "d_learner", "inference")
+
+# Initial "auto" split, before any demand is measured.
+AUTO_WEIGHTS = dict(learner=2.0, d_learner=1.0, inference=1.0)
+
+
+def available_cpus():
+    """The number of cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _positive(value):
+    num_threads = int(value)
+    if num_threads < 1:
+        raise ValueError("Thread budgets must be positive, got %i" % num_threads)
+    return num_threads
+
+
+def parse_budgets(spec):
+    """Returns the budget of each role in `spec`, or None for "auto"."""
+    spec = spec.strip()
+    if spec == "auto":
+        return None
+    if "=" not in spec:
+        return dict.fromkeys(ROLES, _positive(spec))
+
+    budgets = dict.fromkeys(ROLES, 1)
+    for item in spec.split(","):
+        role, _, value = item.partition("=")
+        role = role.strip()
+        if role not in ROLES:
+            raise ValueError(
+                "Unknown role '%s' in '%s', expected one of %s"
+                % (role, spec, ", ".join(ROLES))
+            )
+        budgets[role] = _positive(value)
+    return budgets
+
+
+def split(weights, num_cpus):
+    """Splits `num_cpus` between roles proportionally to `weights`.
+
+    Every role gets one thread, the other cores are split and the ones left
+    over by rounding down go to the largest remainders.
+    """
+    total = sum(weights.values())
+    if total <= 0:
+        weights = dict.fromkeys(weights, 1.0)
+        total = len(weights)
+
+    num_shared = max(num_cpus - len(weights), 0)
+    shares = {role: num_shared * weight / total for role, weight in weights.items()}
+    budgets = {role: 1 + int(share) for role, share in shares.items()}
+    leftover = num_shared + len(weights) - sum(budgets.values())
+    by_remainder = sorted(
+        shares, key=lambda role: shares[role] - int(shares[role]), reverse=True
+    )
+    for role in by_remainder[: max(leftover, 0)]:
+        budgets[role] += 1
+    return budgets
+
+
+class ThreadBudgets:
+    """The intra-op threads of each role.
+
+    Role threads call `apply` once per iteration and time their compute with
+    `busy`. In auto mode `rebalance` moves cores to the roles that were busy
+    with the cores they had. Roles without a budget are left alone, pinned
+    roles keep theirs.
+    """
+
+    def __init__(self, budgets, auto=False, num_cpus=None, env_cpus=0):
+        self.auto = auto
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._busy = dict.fromkeys(LEARNER_ROLES, 0.0)
+        self._pinned = set()
+        self._last_rebalance = timeit.default_timer()
+
+        if num_cpus is None:
+            num_cpus = available_cpus()
+        # Env servers are single threaded in auto mode and share the machine.
+        self.num_cpus = max(num_cpus - env_cpus, len(LEARNER_ROLES))
+
+        self._budgets = dict(budgets)
+        if auto:
+            self._budgets.update(split(AUTO_WEIGHTS, self.num_cpus))
+            self._budgets["env"] = 1
+
+    @classmethod
+    def from_flags(cls, flags, num_cpus=None):
+        budgets = parse_budgets(flags.intra_op_threads)
+        if budgets is None:
+            return cls({}, auto=True, num_cpus=num_cpus, env_cpus=flags.num_actors)
+        return cls(budgets, num_cpus=num_cpus)
+
+    def pin(self, role):
+        """Keeps `role`'s budget out of `rebalance`.
+
+        For roles that run in other processes, whose busy time isn't measured
+        here and whose threads can't be resized.
+        """
+        self._pinned.add(role)
+
+    def budgets(self):
+        return dict(self._budgets)
+
+    def get(self, role):
+        return self._budgets.get(role)
+
+    def apply(self, role):
+        """Sets the intra-op threads of the calling thread to `role`'s budget.
+
+        Only calls into torch when the budget changed since the last call in
+        this thread.
+        """
+        num_threads = self._budgets.get(role)
+        if num_threads is None:
+            return
+        if getattr(self._local, "num_threads", None) != num_threads:
+            # A thread's first op sets its threads to the process wide number,
+            # the last one any thread set. Get that over with first so it
+            # can't override the budget later.
+            torch.get_num_threads()
+            torch.set_num_threads(num_threads)
+            self._local.num_threads = num_threads
+
+    @contextlib.contextmanager
+    def busy(self, role):
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            duration = timeit.default_timer() - start
+            with self._lock:
+                self._busy[role] += duration
+
+    def rebalance(self):
+        """Splits the cores by the demand measured since the last call.
+
+        A role's demand is the core-seconds it used, the time it was busy
+        times its budget. Budgets move halfway to the demanded split to damp
+        oscillations. Does nothing unless in auto mode. Returns the budgets.
+        """
+        now = timeit.default_timer()
+        with self._lock:
+            busy, self._busy = self._busy, dict.fromkeys(LEARNER_ROLES, 0.0)
+            elapsed, self._last_rebalance = now - self._last_rebalance, now
+
+        if not self.auto or elapsed <= 0:
+            return self.budgets()
+
+        roles = [role for role in LEARNER_ROLES if role not in self._pinned]
+        num_cpus = self.num_cpus - sum(self._budgets[role] for role in self._pinned)
+        num_cpus = max(num_cpus, len(roles))
+
+        demand = {role: busy[role] / elapsed * self._budgets[role] for role in roles}
+        total = sum(demand.values())
+        if roles and total > 0:
+            weights = {
+                role: self._budgets[role] + num_cpus * demand[role] / total
+                for role in roles
+            }
+            self._budgets.update(split(weights, num_cpus))
+        return self.budgets()
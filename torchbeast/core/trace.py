@@ -0,0 +1,150 @@
+# Copyright urw7rs
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sampled profiler traces of a few learner steps at a time."""
+
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+
+import torch
+
+
+def all_threads_config():
+    """Profiler config recording every thread, None if torch can't (< 2.7)."""
+    try:
+        return torch._C._profiler._ExperimentalConfig(profile_all_threads=True)
+    except (AttributeError, TypeError):
+        return None
+
+
+class WindowedProfiler:
+    """Profiles windows of `steps` learner steps. Thread-safe.
+
+    A window starts every `every` steps (0 disables this) or at the next
+    step after `request` was called, e.g. from a SIGUSR1 handler. Each
+    window is written to `trace_dir` as a gzipped chrome trace, so long
+    runs never buffer more than one window of events.
+
+    Kineto has to start and stop a session in the same thread, so the
+    learner threads calling `step` only count and a profiler thread owns
+    the session. It records the events of all threads, e.g. inference and
+    the D learner, which needs PyTorch 2.7.
+    """
+
+    def __init__(self, trace_dir, steps=5, every=0):
+        if steps < 1 or every < 0:
+            raise ValueError("Need steps >= 1 and every >= 0")
+
+        self._trace_dir = trace_dir
+        self._steps = steps
+        self._every = every
+
+        self._lock = threading.Lock()
+        self._requested = False
+        self._step = 0
+        self._window_start = None
+
+        self._profile = None
+        self._commands = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="profiler-thread", daemon=True
+        )
+        self._thread.start()
+
+    def request(self, *args):
+        """Profile the next window. Usable as a signal handler."""
+        # No lock, signal handlers must not block.
+        self._requested = True
+
+    def step(self):
+        with self._lock:
+            self._step += 1
+
+            if self._window_start is not None:
+                if self._step - self._window_start >= self._steps:
+                    self._commands.put(("stop", self._window_start))
+                    self._window_start = None
+            elif self._requested or (self._every and self._step % self._every == 0):
+                self._requested = False
+                self._window_start = self._step
+                self._commands.put(("start", self._step))
+                # Hold all learner threads until the window is recording so
+                # it covers `steps` of their steps. Traces are written in the
+                # background.
+                self.wait()
+
+    def wait(self):
+        """Block until started and finished windows are handled."""
+        self._commands.join()
+
+    def close(self):
+        with self._lock:
+            if self._window_start is not None:
+                self._commands.put(("stop", self._window_start))
+                self._window_start = None
+        self._commands.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            command = self._commands.get()
+            try:
+                if command is None:
+                    return
+                action, window_start = command
+                if action == "start":
+                    self._start(window_start)
+                elif self._profile is not None:
+                    self._stop(window_start)
+            except Exception:
+                logging.exception("Profiler failed")
+                self._profile = None
+            finally:
+                self._commands.task_done()
+
+    def _start(self, window_start):
+        config = all_threads_config()
+        if config is None:
+            logging.warning(
+                "Skipping the profiler window at step %i, recording all "
+                "threads needs PyTorch 2.7",
+                window_start,
+            )
+            return
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+        logging.info("Profiling %i steps from step %i", self._steps, window_start)
+        self._profile = torch.profiler.profile(
+            activities=activities, experimental_config=config
+        )
+        self._profile.start()
+
+    def _stop(self, window_start):
+        self._profile.stop()
+
+        os.makedirs(self._trace_dir, exist_ok=True)
+        path = os.path.join(self._trace_dir, "trace-%i.json" % window_start)
+        self._profile.export_chrome_trace(path)
+        with open(path, "rb") as f, gzip.open(path + ".gz", "wb") as g:
+            shutil.copyfileobj(f, g)
+        os.remove(path)
+
+        logging.info("Wrote profiler trace to '%s.gz'", path)
+        self._profile = None
@@ -50,16 +50,26 @@ VTraceFromLogitsReturns = collections.namedtuple(
 VTraceReturns = collections.namedtuple("VTraceReturns", "vs pg_advantages")
 
 
-def action_log_probs(policy_logits, actions):
-    log_prob = 0
+def head_log_probs(policy_logits, actions):
+    """Log-probabilities of `actions` under each head, stacked on the last dim."""
+    log_probs = []
     for i, logit in enumerate(policy_logits):
         action = actions[..., i]
-        log_prob += -F.nll_loss(
-            F.log_softmax(torch.flatten(logit, 0, 1), dim=-1),
-            torch.flatten(action.long(), 0, 1),
-            reduction="none",
-        ).view_as(action)
-    return log_prob
+        log_probs.append(
+            -F.nll_loss(
+                F.log_softmax(torch.flatten(logit, 0, 1), dim=-1),
+                torch.flatten(action.long(), 0, 1),
+                reduction="none",
+            ).view_as(action)
+        )
+    return torch.stack(log_probs, dim=-1)
+
+
+def action_log_probs(policy_logits, actions, head_mask=None):
+    log_probs = head_log_probs(policy_logits, actions)
+    if head_mask is not None:
+        log_probs = log_probs * head_mask
+    return log_probs.sum(dim=-1)
 
 
 def from_logits(
@@ -72,10 +82,42 @@ def from_logits(
     bootstrap_value,
     clip_rho_threshold=1.0,
     clip_pg_rho_threshold=1.0,
+    head_mask=None,
 ):
     """V-trace for softmax policies."""
-    target_action_log_probs = action_log_probs(target_policy_logits, actions)
-    behavior_action_log_probs = action_log_probs(behavior_policy_logits, actions)
+    return from_log_probs(
+        behavior_action_log_probs=action_log_probs(
+            behavior_policy_logits, actions, head_mask
+        ),
+        target_policy_logits=target_policy_logits,
+        actions=actions,
+        discounts=discounts,
+        rewards=rewards,
+        values=values,
+        bootstrap_value=bootstrap_value,
+        clip_rho_threshold=clip_rho_threshold,
+        clip_pg_rho_threshold=clip_pg_rho_threshold,
+        head_mask=head_mask,
+    )
+
+
+def from_log_probs(
+    behavior_action_log_probs,
+    target_policy_logits,
+    actions,
+    discounts,
+    rewards,
+    values,
+    bootstrap_value,
+    clip_rho_threshold=1.0,
+    clip_pg_rho_threshold=1.0,
+    head_mask=None,
+):
+    """V-trace for softmax policies given the behavior log-probs of `actions`.
+
+    Heads where `head_mask` is 0 are left out of the target log-probs.
+    """
+    target_action_log_probs = action_log_probs(target_policy_logits, actions, head_mask)
     log_rhos = target_action_log_probs - behavior_action_log_probs
     vtrace_returns = from_importance_weights(
         log_rhos=log_rhos,
@@ -33,13 +33,104 @@ cv2.ocl.setUseOpenCL(False)
 
 from torch.utils.data import DataLoader
 
+from torchbeast.core import null_env
+from torchbeast.core import replay_env
+
+
+class FrameWarper:
+    """Grayscale conversion and INTER_AREA resizing into a reused frame.
+
+    With `incremental` and an integer scale, each output pixel is the mean
+    of its own block of source pixels. The last source frame is kept, and
+    only the output blocks in the rectangle around changed source pixels
+    are recomputed. A brush stroke touches a small part of the canvas, so
+    most steps resize a fraction of it.
+    """
+
+    def __init__(self, shape, width, height, grayscale=True, incremental=False):
+        h, w, num_colors = shape
+        self._size = (width, height)
+        self._grayscale = grayscale and num_colors == 3
+        if self._grayscale:
+            self._gray = np.empty((h, w), dtype=np.uint8)
+        if grayscale:
+            num_colors = 1
+
+        self._scale = (h // height, w // width)
+        self._incremental = incremental and (h % height, w % width) == (0, 0)
+        self._previous = None
+
+        # cv2 drops the channel dimension of single channel images.
+        self.frame = np.empty(
+            (height, width) if num_colors == 1 else (height, width, num_colors),
+            dtype=np.uint8,
+        )
+
+    def __call__(self, frame):
+        """Warp `frame` into `self.frame`, which is returned."""
+        if self._incremental:
+            if self._previous is not None:
+                return self._update(frame)
+            self._previous = np.array(frame, copy=True)
+
+        if self._grayscale:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=self._gray)
+        cv2.resize(frame, self._size, dst=self.frame, interpolation=cv2.INTER_AREA)
+        return self.frame
+
+    def _update(self, frame):
+        height, width = self.frame.shape[:2]
+        sy, sx = self._scale
+
+        # Rows of output blocks with any changed source byte.
+        changed = _changed(frame, self._previous, height)
+        block_rows = np.flatnonzero(changed)
+        if len(block_rows) == 0:
+            return self.frame
+        by0, by1 = block_rows[0], block_rows[-1] + 1
+        band = slice(by0 * sy, by1 * sy)
+
+        # Columns of output blocks with any change within those rows.
+        changed = np.not_equal(frame[band], self._previous[band])
+        changed = changed.reshape(changed.shape[0], width, -1).any(axis=(0, 2))
+        block_cols = np.flatnonzero(changed)
+        bx0, bx1 = block_cols[0], block_cols[-1] + 1
+
+        region = frame[band, bx0 * sx : bx1 * sx]
+        if self._grayscale:
+            region = cv2.cvtColor(region, cv2.COLOR_RGB2GRAY)
+        self.frame[by0:by1, bx0:bx1] = cv2.resize(
+            region, (bx1 - bx0, by1 - by0), interpolation=cv2.INTER_AREA
+        ).reshape(self.frame[by0:by1, bx0:bx1].shape)
+
+        self._previous[band] = frame[band]
+        return self.frame
+
+
+def _changed(frame, previous, num_blocks):
+    """Whether each of `num_blocks` horizontal bands differs, by 8 byte words."""
+    frame = frame.reshape(num_blocks, -1)
+    previous = previous.reshape(num_blocks, -1)
+    if frame.shape[1] % 8 == 0 and frame.flags.c_contiguous:
+        frame, previous = frame.view(np.uint64), previous.view(np.uint64)
+    return np.not_equal(frame, previous).any(axis=1)
+
 
 class WarpFrame(gym.ObservationWrapper):
-    def __init__(self, env, width=64, height=64, grayscale=True, dict_space_key=None):
+    def __init__(
+        self,
+        env,
+        width=64,
+        height=64,
+        grayscale=True,
+        dict_space_key=None,
+        incremental=False,
+    ):
         """
         Warp frames to 84x84 as done in the Nature paper and later work.
         If the environment uses dictionary observations, `dict_space_key` can be specified which indicates which
         observation should be warped.
+        With `incremental`, only the parts of the frame that changed are warped.
         """
         super().__init__(env)
         self._width = width
@@ -72,17 +163,26 @@ class WarpFrame(gym.ObservationWrapper):
 
         assert original_space.dtype == np.uint8 and len(original_space.shape) in [1, 3]
 
+        self._warper = None
+        if incremental and len(original_space.shape) == 3:
+            self._warper = FrameWarper(
+                original_space.shape, width, height, grayscale, incremental=True
+            )
+
     def observation(self, obs):
         if self._key is None:
             frame = obs
         else:
             frame = obs[self._key]
 
-        if self._grayscale:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        frame = cv2.resize(
-            frame, (self._width, self._height), interpolation=cv2.INTER_AREA
-        )
+        if self._warper is not None:
+            frame = self._warper(frame).copy()
+        else:
+            if self._grayscale:
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+            frame = cv2.resize(
+                frame, (self._width, self._height), interpolation=cv2.INTER_AREA
+            )
         if self._expand_dims:
             frame = np.expand_dims(frame, -1)
 
@@ -179,8 +279,98 @@ class SavePrevAction(gym.Wrapper):
         return obs, reward, done, info
 
 
+class FusedObservation(gym.Wrapper):
+    """WarpFrame, FloatNCHW and optionally ConcatTarget in a single pass.
+
+    Canvases are written into a float32 (C, H, W) buffer that is reused
+    across steps, with the target copied in once per episode. The returned
+    canvas is only valid until the next call to `step` or `reset`.
+    Frames are only warped if `width` and `height` are given.
+    """
+
+    def __init__(
+        self,
+        env,
+        width=None,
+        height=None,
+        grayscale=True,
+        dataset=None,
+        dict_space_key="canvas",
+        incremental_warp=False,
+    ):
+        super().__init__(env)
+        self._key = dict_space_key
+
+        original_space = env.observation_space.spaces[self._key]
+        assert original_space.dtype == np.uint8 and len(original_space.shape) == 3
+        h, w, num_colors = original_space.shape
+
+        self._warper = None
+        if width is not None and height is not None:
+            self._warper = FrameWarper(
+                original_space.shape, width, height, grayscale, incremental_warp
+            )
+            h, w = height, width
+            if grayscale:
+                num_colors = 1
+        self._num_colors = num_colors
+
+        self._dataloader = None
+        low, num_channels = 0.0, num_colors
+        if dataset is not None:
+            self._dataloader = DataLoader(dataset, shuffle=True, pin_memory=True)
+            self._iterator = iter(self._dataloader)
+            low, num_channels = -1.0, 2 * num_colors
+
+        self._canvas = np.zeros((num_channels, h, w), dtype=np.float32)
+
+        new_space = env.observation_space.spaces
+        new_space[self._key] = spaces.Box(
+            low=low, high=1.0, shape=self._canvas.shape, dtype=np.float32
+        )
+        self.observation_space = spaces.Dict(new_space)
+
+    def _next_target(self):
+        try:
+            target, _ = next(self._iterator)
+        except StopIteration:
+            self._iterator = iter(self._dataloader)
+            target, _ = next(self._iterator)
+        return target.squeeze(0).numpy()
+
+    def _write(self, obs):
+        frame = obs[self._key]
+        if self._warper is not None:
+            frame = self._warper(frame)
+        frame = frame.reshape(frame.shape[0], frame.shape[1], -1)
+
+        np.divide(
+            frame.transpose(2, 0, 1),
+            np.float32(255.0),
+            out=self._canvas[: self._num_colors],
+            dtype=np.float32,
+        )
+        obs[self._key] = self._canvas
+        return obs
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        return self._write(obs), reward, done, info
+
+    def reset(self):
+        if self._dataloader is not None:
+            self._canvas[self._num_colors :] = self._next_target()
+        return self._write(self.env.reset())
+
+
 def make_raw(env_id, config):
-    env = gym.make("spiral:" + env_id)
+    if env_id.startswith("Null"):
+        # Doesn't need the spiral package, nor brushes.
+        env = null_env.NullPaint()
+    elif env_id.startswith("Replay"):
+        env = replay_env.ReplayPaint()
+    else:
+        env = gym.make("spiral:" + env_id)
     if len(config) > 0:
         env.configure(**config)
     return env
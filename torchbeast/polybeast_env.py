@@ -18,10 +18,13 @@ import argparse
 import multiprocessing as mp
 import time
 
+import cv2
+import torch
 from torch.utils.data import Subset
 import libtorchbeast
 
 from torchbeast import utils
+from torchbeast.core import threads
 
 # yapf: disable
 parser = argparse.ArgumentParser(description='Remote Environment Server')
@@ -39,7 +42,13 @@ SHADERS_BASEDIR = os.path.join(os.getcwd(), "third_party/paint/shaders")
 SHADERS_BASEDIR = os.path.abspath(SHADERS_BASEDIR)
 
 parser.add_argument("--env_type", type=str, default="libmypaint",
-                    help="Environment. Ignored if --no_start_servers is passed.")
+                    help="Environment, libmypaint, fluid, null or replay. "
+                    "Ignored if --no_start_servers is passed.")
+parser.add_argument("--null_step_cost_ms", type=float, default=0.0,
+                    help="CPU time each step of the null environment takes.")
+parser.add_argument("--replay_path", default=None,
+                    help="Episodes the replay environment plays back, a file "
+                    "or a directory of files written with --record_dir.")
 parser.add_argument("--episode_length", type=int, default=20,
                     help="Set epiosde length")
 parser.add_argument("--canvas_width", type=int, default=256, metavar="W",
@@ -62,16 +71,54 @@ parser.add_argument("--stroke_length_penalty", type=float, default=0.0,
 parser.add_argument("--condition", action="store_true",
                     help='condition flag')
 parser.add_argument("--dataset",
-                    help="Dataset name. MNIST, Omniglot, CelebA, CelebA-HQ is supported")
+                    help="Dataset name. MNIST, Omniglot, CelebA, CelebA-HQ is supported, "
+                    "fake gives random images")
+parser.add_argument("--incremental_warp", action="store_true",
+                    help="Only downsample the parts of the canvas that changed.")
+parser.add_argument("--record_dir", default=None,
+                    help="Save the first episodes of each server to this "
+                    "directory, for --env_type replay.")
+parser.add_argument("--record_episodes", default=100, type=int,
+                    help="Number of episodes each server saves.")
+parser.add_argument("--intra_op_threads", default="1",
+                    help="Thread budgets as for the learner, each server "
+                    "uses the env budget, auto is 1.")
 
 # yapf: enable
 
 
-def serve(env_name, config, grayscale, dataset, start, end, server_address):
+def serve(
+    env_name,
+    config,
+    grayscale,
+    dataset,
+    start,
+    end,
+    server_address,
+    incremental_warp=False,
+    record_path=None,
+    record_episodes=100,
+    num_threads=None,
+):
+    if num_threads is not None:
+        # Each server is its own process, this covers all of its threads.
+        torch.set_num_threads(num_threads)
+        cv2.setNumThreads(num_threads)
+
     if isinstance(dataset, str):
         dataset = utils.create_dataset(dataset, grayscale)
         dataset = Subset(dataset, range(start, end + 1))
-    init = lambda: utils.create_env(env_name, config, grayscale, dataset)
+    init = lambda: utils.create_env(
+        env_name,
+        config,
+        grayscale,
+        dataset,
+        # The server sends each observation before the next step reuses it.
+        fused_observation=True,
+        incremental_warp=incremental_warp,
+        record_path=record_path,
+        record_episodes=record_episodes,
+    )
     server = libtorchbeast.Server(init, server_address=server_address)
     server.run()
 
@@ -92,8 +139,17 @@ def main(flags):
     else:
         dataset = start = end = None
 
+    budgets = threads.parse_budgets(flags.intra_op_threads)
+    num_threads = 1 if budgets is None else budgets["env"]
+
+    if flags.record_dir is not None:
+        os.makedirs(flags.record_dir, exist_ok=True)
+
     processes = []
     for i in range(flags.num_actors):
+        record_path = None
+        if flags.record_dir is not None:
+            record_path = os.path.join(flags.record_dir, "%i.npz" % i)
         if flags.condition:
             start = per_actor * i
             end = min(start + per_actor, len(dataset))
@@ -108,6 +164,10 @@ def main(flags):
                 start,
                 end,
                 f"{flags.pipes_basename}.{i}",
+                flags.incremental_warp,
+                record_path,
+                flags.record_episodes,
+                num_threads,
             ),
             daemon=True,
         )
@@ -15,20 +15,29 @@
 
 import argparse
 import collections
+import contextlib
+import functools
 import logging
 import os
+import signal
 import threading
 import time
 import timeit
 import traceback
 
-os.environ["OMP_NUM_THREADS"] = "1"  # Necessary for multithreading.
+# Start single threaded, the learner, D learner and inference threads set
+# their own budgets. See `--intra_op_threads`. Threads we don't manage aren't
+# pinned to this: their first op uses the number of threads last set by any
+# role thread.
+os.environ["OMP_NUM_THREADS"] = "1"
 
 import nest
 import torch
 import torch.optim as optim
 import libtorchbeast
+from libtorchbeast import tensor_nest
 from torch import nn
+from torch.profiler import record_function
 from torch.nn import functional as F
 from torch.utils.data import DataLoader
 
@@ -37,9 +46,17 @@ import numpy as np
 from gym import spaces
 
 from torchbeast import utils
+from torchbeast.core import checkpoint as ckpt
 from torchbeast.core import file_writer
+from torchbeast.core import inference_workers
+from torchbeast.core import jit
 from torchbeast.core import vtrace
 from torchbeast.core import models
+from torchbeast.core import prof
+from torchbeast.core import trace
+from torchbeast.core import rate_control
+from torchbeast.core import threads as thread_budgets
+from torchbeast.core import replay_buffer as replay
 
 # yapf: disable
 parser = argparse.ArgumentParser(description="PyTorch Scalable Agent")
@@ -60,7 +77,13 @@ parser.set_defaults(start_servers=True)
 
 # Environment settings
 parser.add_argument("--env_type", type=str, default="libmypaint",
-                    help="Environment. Ignored if --no_start_servers is passed.")
+                    help="Environment, libmypaint, fluid, null or replay. "
+                    "Ignored if --no_start_servers is passed.")
+parser.add_argument("--null_step_cost_ms", type=float, default=0.0,
+                    help="CPU time each step of the null environment takes.")
+parser.add_argument("--replay_path", default=None,
+                    help="Episodes the replay environment plays back, a file "
+                    "or a directory of files written with --record_dir.")
 parser.add_argument("--episode_length", type=int, default=20,
                     help="Set epiosde length")
 parser.add_argument("--canvas_width", type=int, default=256, metavar="W",
@@ -84,6 +107,13 @@ parser.add_argument("--stroke_length_penalty", type=float, default=0.0,
 # Training settings.
 parser.add_argument("--disable_checkpoint", action="store_true",
                     help="Disable saving checkpoint.")
+parser.add_argument("--checkpoint_interval", default=10 * 60, type=float,
+                    help="Seconds between checkpoints.")
+parser.add_argument("--checkpoint_keep", default=1, type=int, metavar="K",
+                    help="Number of checkpoints to keep.")
+parser.add_argument("--checkpoint_per_component", action="store_true",
+                    help="Save each state dict to its own file and only "
+                    "rewrite changed ones.")
 parser.add_argument("--savedir", default="~/logs/torchbeast",
                     help="Root dir where experiment data will be saved.")
 parser.add_argument("--num_actors", default=4, type=int, metavar="N",
@@ -96,8 +126,45 @@ parser.add_argument("--num_learner_threads", default=2, type=int,
                     metavar="N", help="Number learner threads.")
 parser.add_argument("--num_inference_threads", default=2, type=int,
                     metavar="N", help="Number learner threads.")
+parser.add_argument("--num_inference_workers", default=0, type=int,
+                    metavar="N", help="Run inference in N processes with "
+                    "their own interpreter instead of in threads. Needs the "
+                    "actors on the CPU and --inference_backend eager.")
+parser.add_argument("--intra_op_threads", default="1",
+                    help="Intra-op threads of the learner, D learner, "
+                    "inference threads and env servers. N for all of them, "
+                    "role=N pairs like learner=8,d_learner=4,inference=2,env=1 "
+                    "with the others at 1, or auto to split the cores by "
+                    "measured demand.")
 parser.add_argument("--disable_cuda", action="store_true",
                     help="Disable CUDA.")
+parser.add_argument("--precision", default="fp32",
+                    choices=["fp32", "bf16", "fp16"],
+                    help="Autocast precision of the learner, discriminator "
+                    "and inference forward passes.")
+parser.add_argument("--memory_format", default="contiguous",
+                    choices=["contiguous", "channels_last"],
+                    help="Memory format of the conv weights and activations.")
+parser.add_argument("--inference_backend", default="eager",
+                    choices=["eager", "jit"],
+                    help="Run the actor model and the reward discriminator "
+                    "eagerly or as traced TorchScript modules.")
+parser.add_argument("--compress_rollouts", action="store_true",
+                    help="Store canvases in the learner queue as uint8.")
+parser.add_argument("--max_terminal_frames", default=None, type=int, metavar="K",
+                    help="Maximum episodes ending per rollout. Defaults to "
+                    "ceil(unroll_length / episode_length), which holds for "
+                    "fixed length episodes. Final frames of further episodes "
+                    "are dropped with a warning.")
+parser.add_argument("--skip_masked_heads", action="store_true",
+                    help="Don't decode the action heads the environment "
+                    "ignores when the brush only moves.")
+parser.add_argument("--behavior_log_probs", action="store_true",
+                    help="Actors send the log-probs of their actions under "
+                    "each head instead of the full policy logits.")
+parser.add_argument("--compact_inference_outputs", action="store_true",
+                    help="Copy each actor's inference outputs instead of "
+                    "keeping views of the whole batch.")
 parser.add_argument("--max_learner_queue_size", default=None, type=int, metavar="N",
                     help="Optional maximum learner queue size. Defaults to batch_size.")
 parser.add_argument("--unroll_length", default=20, type=int, metavar="T",
@@ -107,7 +174,13 @@ parser.add_argument("--condition", action="store_true",
 parser.add_argument("--use_tca", action="store_true",
                     help="temporal credit assignment flag")
 parser.add_argument("--dataset", default="celeba-hq",
-                    help="Dataset name. MNIST, Omniglot, CelebA, CelebA-HQ is supported")
+                    help="Dataset name. MNIST, Omniglot, CelebA, CelebA-HQ is supported, "
+                    "fake gives random images")
+parser.add_argument("--replay_buffer_size", default=10000, type=int, metavar="N",
+                    help="Number of final canvases kept for the discriminator.")
+parser.add_argument("--replay_sampling", default="uniform",
+                    choices=replay.ReplayBuffer.SAMPLING,
+                    help="How fake canvases are sampled from the replay buffer.")
 
 # Loss settings.
 parser.add_argument("--entropy_cost", default=0.01, type=float,
@@ -124,11 +197,24 @@ parser.add_argument("--discriminator_learning_rate", default=0.0001, type=float,
                     metavar="LRD", help="Discriminator learning rate.")
 parser.add_argument("--grad_norm_clipping", default=40.0, type=float,
                     help="Global gradient norm clip.")
+parser.add_argument("--policy_steps_per_D_step", default=0.0, type=float,
+                    metavar="K", help="Policy updates per discriminator update. "
+                    "0 doesn't limit the discriminator.")
+parser.add_argument("--max_D_steps_per_second", default=0.0, type=float,
+                    help="Maximum discriminator updates per second. "
+                    "0 doesn't limit the discriminator.")
 
 # Misc settings.
-parser.add_argument("--write_profiler_trace", action="store_true",
-                    help="Collect and write a profiler trace "
-                    "for chrome://tracing/.")
+parser.add_argument("--log_format", default="csv",
+                    choices=file_writer.AsyncFileWriter.LOG_FORMATS,
+                    help="Write logs.csv or columnar logs/*.npz chunks.")
+parser.add_argument("--log_flush_interval", default=5.0, type=float,
+                    help="Seconds between log writes.")
+parser.add_argument("--profile_every", default=0, type=int, metavar="N",
+                    help="Write a profiler trace for chrome://tracing/ every "
+                    "N learner steps. 0 disables, SIGUSR1 always triggers one.")
+parser.add_argument("--profile_steps", default=5, type=int, metavar="K",
+                    help="Learner steps per profiler trace.")
 
 # yapf: enable
 
@@ -160,35 +246,159 @@ def compute_entropy_loss(logits):
     return entropy
 
 
-def compute_policy_gradient_loss(logits, actions, advantages):
+def compute_policy_gradient_loss(logits, actions, advantages, head_mask=None):
     cross_entropy = 0.0
     for i, logit in enumerate(logits):
-        cross_entropy = cross_entropy + F.nll_loss(
+        head_cross_entropy = F.nll_loss(
             F.log_softmax(torch.flatten(logit, 0, 1), dim=-1),
             target=torch.flatten(actions[..., i].long(), 0, 1),
             reduction="none",
         )
+        if head_mask is not None:
+            head_cross_entropy = head_cross_entropy * torch.flatten(
+                head_mask[..., i], 0, 1
+            )
+        cross_entropy = cross_entropy + head_cross_entropy
 
     cross_entropy = cross_entropy.view_as(advantages)
     return torch.sum(cross_entropy * advantages.detach())
 
 
-def inference(flags, inference_batcher, model, lock=threading.Lock()):
-    with torch.no_grad():
-        for batch in inference_batcher:
-            batched_env_outputs, agent_state = batch.get_inputs()
+AUTOCAST_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+CPU = torch.device("cpu")
+MAX_INFERENCE_BATCH_SIZE = 512
+MEMORY_FORMATS = {
+    "contiguous": torch.contiguous_format,
+    "channels_last": torch.channels_last,
+}
 
-            obs, _, done, *_ = batched_env_outputs
 
-            obs, done, agent_state = nest.map(
-                lambda t: t.to(flags.actor_device, non_blocking=True),
-                [obs, done, agent_state],
-            )
+def autocast(flags, device):
+    dtype = AUTOCAST_DTYPES.get(flags.precision)
+    return torch.autocast(device.type, dtype=dtype, enabled=dtype is not None)
+
+
+def to_fp32(t):
+    return t.float() if t.is_floating_point() else t
+
+
+def decode_canvas(canvas):
+    """Undo ActorPool's uint8 rollout compression, on the learner device."""
+    if canvas.dtype == torch.uint8:
+        return canvas.float().div_(255)
+    return canvas
+
+
+def next_frames(canvas, terminal_frame, terminal_index):
+    """Return the frame after each step of a [T + 1, B, ...] rollout canvas.
+
+    That is canvas[t + 1], unless the episode ended at step t and the actor
+    sent its final frame in `terminal_frame[k, b]` with `terminal_index[k, b]
+    == t`. Unused entries have index -1.
+    """
+    new_frame = canvas[1:].clone()
+    k, b = (terminal_index >= 0).nonzero(as_tuple=True)
+    new_frame[terminal_index[k, b], b] = terminal_frame[k, b]
+    return new_frame
+
+
+def backward_and_step(
+    loss, optimizer, parameters=None, max_norm=None, scaler=None, timings=None
+):
+    if timings is None:
+        timings = prof.ThreadSafeTimings()
+
+    if scaler is None:
+        with timings.timer("learner_backward"):
+            loss.backward()
+        with timings.timer("learner_optimizer_step"):
+            if max_norm is not None:
+                nn.utils.clip_grad_norm_(parameters, max_norm)
+            optimizer.step()
+        return
+
+    with timings.timer("learner_backward"):
+        scaler.scale(loss).backward()
+    with timings.timer("learner_optimizer_step"):
+        if max_norm is not None:
+            # Clip the real gradients, not the scaled ones.
+            scaler.unscale_(optimizer)
+            nn.utils.clip_grad_norm_(parameters, max_norm)
+        scaler.step(optimizer)
+        scaler.update()
+
+
+def counter_stats(counters, last_counters):
+    """Turn cumulative C++ counters into per-event means since `last_counters`.
+
+    Each `<event>_count` counter is paired with `<event>_ns` (reported as
+    `<event>_ms`) and/or `<event>_items` (reported as `<event>_size`).
+    """
+    delta = {k: v - last_counters.get(k, 0) for k, v in counters.items()}
+
+    stats = {}
+    for key, value in delta.items():
+        event, _, unit = key.rpartition("_")
+        count = max(delta.get(event + "_count", 0), 1)
+        if unit == "ns":
+            stats[event + "_ms"] = value / count / 1e6
+        elif unit == "items":
+            stats[event + "_size"] = value / count
+    return stats
+
+
+def infer(flags, model, inputs, forward_context=contextlib.nullcontext):
+    """The actor model's outputs for the inputs of an inference batch, on CPU.
+
+    The forward pass runs in `forward_context()`.
+    """
+    batched_env_outputs, agent_state = inputs
+
+    obs, _, done, *_ = batched_env_outputs
+
+    obs, done, agent_state = tensor_nest.to(
+        [obs, done, agent_state], flags.actor_device, non_blocking=True
+    )
+
+    with forward_context(), autocast(flags, flags.actor_device):
+        outputs = model(obs, done, agent_state)
+
+    if flags.behavior_log_probs:
+        # Only V-trace needs the logits, and only for the actions taken.
+        (action, logits, baseline), agent_state = outputs
+        logits = vtrace.head_log_probs(nest.map(to_fp32, logits), action)
+        outputs = (action, logits, baseline), agent_state
+
+    outputs = tensor_nest.to(outputs, CPU)
+    if flags.precision in AUTOCAST_DTYPES:
+        # Rollouts are kept in fp32 so V-trace sees full precision logits.
+        outputs = nest.map(to_fp32, outputs)
+    return outputs
 
-            with lock:
-                outputs = model(obs, done, agent_state)
 
-            outputs = nest.map(lambda t: t.cpu(), outputs)
+def inference(
+    flags,
+    inference_batcher,
+    model,
+    timings=None,
+    lock=threading.Lock(),
+    budgets=None,
+):
+    if timings is None:
+        timings = prof.ThreadSafeTimings()
+    if budgets is None:
+        budgets = thread_budgets.ThreadBudgets({})
+
+    @contextlib.contextmanager
+    def forward_context():
+        with lock, budgets.busy("inference"), timings.timer("inference_forward"):
+            with record_function("inference"):
+                yield
+
+    with torch.no_grad():
+        for batch in inference_batcher:
+            budgets.apply("inference")
+            outputs = infer(flags, model, batch.get_inputs(), forward_context)
             batch.set_outputs(outputs)
 
 
@@ -201,9 +411,9 @@ Batch = collections.namedtuple("Batch", "env agent")
 
 def tca_reward_function(flags, obs, new_frame, D):
     frame = obs["canvas"][:-1]
-    frame, new_frame = nest.map(lambda t: torch.flatten(t, 0, 1), (frame, new_frame))
+    frame, new_frame = tensor_nest.flatten((frame, new_frame), 0, 1)
 
-    with torch.no_grad():
+    with torch.no_grad(), autocast(flags, flags.learner_device):
         reward = torch.zeros(
             flags.unroll_length + 1, flags.batch_size, device=flags.learner_device
         )
@@ -217,7 +427,7 @@ def reward_function(flags, done, new_frame, D):
     index = done[1:].nonzero(as_tuple=False)
     new_frame = new_frame[index[:, 0], index[:, 1]]
 
-    with torch.no_grad():
+    with torch.no_grad(), autocast(flags, flags.learner_device):
         reward = torch.zeros(
             flags.unroll_length + 1, flags.batch_size, device=flags.learner_device
         )
@@ -244,117 +454,181 @@ def learn(
     scheduler,
     stats,
     plogger,
+    rate_controller=None,
+    grad_scaler=None,
+    timings=None,
+    profiler=None,
     lock=threading.Lock(),
+    budgets=None,
 ):
+    if timings is None:
+        timings = prof.ThreadSafeTimings()
+    if budgets is None:
+        budgets = thread_budgets.ThreadBudgets({})
+
+    dequeue_start = timeit.default_timer()
     for tensors in learner_queue:
-        new_obs = tensors[1]
-        tensors = edit_tuple(tensors, 1, new_obs["canvas"])
+        budgets.apply("learner")
+        timings.add("learner_dequeue", timeit.default_timer() - dequeue_start)
 
-        tensors = nest.map(
-            lambda t: t.to(flags.learner_device, non_blocking=True), tensors
-        )
+        terminal_obs, terminal_index = tensors[1]
+        tensors = edit_tuple(tensors, 1, (terminal_obs["canvas"], terminal_index))
 
-        batch, new_frame, initial_agent_state = tensors
+        with timings.timer("learner_h2d"):
+            tensors = tensor_nest.to(tensors, flags.learner_device, non_blocking=True)
+
+        batch, (terminal_frame, terminal_index), initial_agent_state = tensors
 
         env_outputs, actor_outputs = batch
         obs, reward, done, step, _ = env_outputs
 
-        lock.acquire()  # Only one thread learning at a time.
+        obs["canvas"] = decode_canvas(obs["canvas"])
+        new_frame = next_frames(
+            obs["canvas"], decode_canvas(terminal_frame), terminal_index
+        )
 
-        if flags.use_tca:
-            discriminator_reward = tca_reward_function(flags, obs, new_frame, D)
+        # Only one thread learning at a time.
+        with lock, budgets.busy("learner"), record_function("learn"):
+            forward_start = timeit.default_timer()
 
-            reward = env_outputs[1]
-            env_outputs = edit_tuple(env_outputs, 1, reward + discriminator_reward)
-            batch = edit_tuple(batch, 0, env_outputs)
-        else:
-            if done.any().item():
-                discriminator_reward = reward_function(flags, done, new_frame, D)
+            if flags.use_tca:
+                discriminator_reward = tca_reward_function(flags, obs, new_frame, D)
 
                 reward = env_outputs[1]
                 env_outputs = edit_tuple(env_outputs, 1, reward + discriminator_reward)
                 batch = edit_tuple(batch, 0, env_outputs)
+            else:
+                if done.any().item():
+                    discriminator_reward = reward_function(flags, done, new_frame, D)
 
-        optimizer.zero_grad()
-
-        actor_outputs = AgentOutput._make(actor_outputs)
-
-        learner_outputs, agent_state = model(obs, done, initial_agent_state)
+                    reward = env_outputs[1]
+                    env_outputs = edit_tuple(
+                        env_outputs, 1, reward + discriminator_reward
+                    )
+                    batch = edit_tuple(batch, 0, env_outputs)
 
-        # Take final value function slice for bootstrapping.
-        learner_outputs = AgentOutput._make(learner_outputs)
-        bootstrap_value = learner_outputs.baseline[-1]
+            optimizer.zero_grad()
 
-        # Move from obs[t] -> action[t] to action[t] -> obs[t].
-        batch = nest.map(lambda t: t[1:], batch)
-        learner_outputs = nest.map(lambda t: t[:-1], learner_outputs)
+            actor_outputs = AgentOutput._make(actor_outputs)
+
+            with autocast(flags, flags.learner_device):
+                learner_outputs, agent_state = model(obs, done, initial_agent_state)
+
+            # V-trace and the losses are computed in fp32.
+            learner_outputs = nest.map(to_fp32, learner_outputs)
+
+            # Take final value function slice for bootstrapping.
+            learner_outputs = AgentOutput._make(learner_outputs)
+            bootstrap_value = learner_outputs.baseline[-1]
+
+            # Move from obs[t] -> action[t] to action[t] -> obs[t].
+            batch = tensor_nest.slice(batch, 0, 1)
+            learner_outputs = tensor_nest.slice(learner_outputs, 0, end=-1)
+
+            # Turn into namedtuples again.
+            env_outputs, actor_outputs = batch
+
+            env_outputs = EnvOutput._make(env_outputs)
+            actor_outputs = AgentOutput._make(actor_outputs)
+            learner_outputs = AgentOutput._make(learner_outputs)
+
+            discounts = (~env_outputs.done).float() * flags.discounting
+
+            # Skipped heads sampled action 0, which the losses ignore.
+            head_mask = model.policy.head_mask(actor_outputs.action)
+
+            if flags.behavior_log_probs:
+                # Log-probs of each head, [T, B, num_heads].
+                behavior_action_log_probs = torch.sum(
+                    actor_outputs.policy_logits * head_mask, dim=-1
+                )
+            else:
+                behavior_action_log_probs = vtrace.action_log_probs(
+                    actor_outputs.policy_logits, actor_outputs.action, head_mask
+                )
+
+            vtrace_returns = vtrace.from_log_probs(
+                behavior_action_log_probs=behavior_action_log_probs,
+                target_policy_logits=learner_outputs.policy_logits,
+                actions=actor_outputs.action,
+                discounts=discounts,
+                rewards=env_outputs.reward,
+                values=learner_outputs.baseline,
+                bootstrap_value=bootstrap_value,
+                head_mask=head_mask,
+            )
 
-        # Turn into namedtuples again.
-        env_outputs, actor_outputs = batch
+            vtrace_returns = vtrace.VTraceFromLogitsReturns._make(vtrace_returns)
 
-        env_outputs = EnvOutput._make(env_outputs)
-        actor_outputs = AgentOutput._make(actor_outputs)
-        learner_outputs = AgentOutput._make(learner_outputs)
+            pg_loss = compute_policy_gradient_loss(
+                learner_outputs.policy_logits,
+                actor_outputs.action,
+                vtrace_returns.pg_advantages,
+                head_mask,
+            )
+            baseline_loss = flags.baseline_cost * compute_baseline_loss(
+                vtrace_returns.vs - learner_outputs.baseline
+            )
+            entropy_loss = flags.entropy_cost * compute_entropy_loss(
+                learner_outputs.policy_logits
+            )
 
-        discounts = (~env_outputs.done).float() * flags.discounting
+            total_loss = pg_loss + baseline_loss + entropy_loss
+            timings.add("learner_forward", timeit.default_timer() - forward_start)
 
-        vtrace_returns = vtrace.from_logits(
-            behavior_policy_logits=actor_outputs.policy_logits,
-            target_policy_logits=learner_outputs.policy_logits,
-            actions=actor_outputs.action,
-            discounts=discounts,
-            rewards=env_outputs.reward,
-            values=learner_outputs.baseline,
-            bootstrap_value=bootstrap_value,
-        )
+            backward_and_step(
+                total_loss,
+                optimizer,
+                model.parameters(),
+                flags.grad_norm_clipping,
+                grad_scaler,
+                timings,
+            )
+            scheduler.step()
 
-        vtrace_returns = vtrace.VTraceFromLogitsReturns._make(vtrace_returns)
+            with timings.timer("learner_publish"):
+                actor_model.load_state_dict(model.state_dict())
 
-        pg_loss = compute_policy_gradient_loss(
-            learner_outputs.policy_logits,
-            actor_outputs.action,
-            vtrace_returns.pg_advantages,
-        )
-        baseline_loss = flags.baseline_cost * compute_baseline_loss(
-            vtrace_returns.vs - learner_outputs.baseline
-        )
-        entropy_loss = flags.entropy_cost * compute_entropy_loss(
-            learner_outputs.policy_logits
-        )
+            if rate_controller is not None:
+                rate_controller.policy_step()
 
-        total_loss = pg_loss + baseline_loss + entropy_loss
+            episode_returns = env_outputs.episode_return[env_outputs.done]
 
-        total_loss.backward()
+            stats["step"] = (
+                stats.get("step", 0) + flags.unroll_length * flags.batch_size
+            )
+            stats["episode_returns"] = tuple(episode_returns.cpu().numpy())
+            stats["mean_environment_return"] = episode_returns.mean().item()
+            stats["mean_discriminator_return"] = discriminator_reward.mean().item()
+            stats["mean_episode_return"] = (
+                stats["mean_environment_return"] + stats["mean_discriminator_return"]
+            )
+            stats["total_loss"] = total_loss.item()
+            stats["pg_loss"] = pg_loss.item()
+            stats["baseline_loss"] = baseline_loss.item()
+            stats["entropy_loss"] = entropy_loss.item()
+            stats["learner_queue_size"] = learner_queue.size()
 
-        nn.utils.clip_grad_norm_(model.parameters(), flags.grad_norm_clipping)
+            if flags.condition and new_frame.size() != 0:
+                stats["l2_loss"] = F.mse_loss(
+                    *new_frame.split(split_size=new_frame.shape[1] // 2, dim=1)
+                ).item()
 
-        optimizer.step()
-        scheduler.step()
+            plogger.log(stats)
 
-        actor_model.load_state_dict(model.state_dict())
+        if profiler is not None:
+            profiler.step()
+        dequeue_start = timeit.default_timer()
 
-        episode_returns = env_outputs.episode_return[env_outputs.done]
 
-        stats["step"] = stats.get("step", 0) + flags.unroll_length * flags.batch_size
-        stats["episode_returns"] = tuple(episode_returns.cpu().numpy())
-        stats["mean_environment_return"] = episode_returns.mean().item()
-        stats["mean_discriminator_return"] = discriminator_reward.mean().item()
-        stats["mean_episode_return"] = (
-            stats["mean_environment_return"] + stats["mean_discriminator_return"]
-        )
-        stats["total_loss"] = total_loss.item()
-        stats["pg_loss"] = pg_loss.item()
-        stats["baseline_loss"] = baseline_loss.item()
-        stats["entropy_loss"] = entropy_loss.item()
-        stats["learner_queue_size"] = learner_queue.size()
+def fill_replay_buffer(replay_queue, replay_buffer, stats):
+    # Drain final canvases as soon as they arrive so actors never block on
+    # the discriminator. Canvases the actors could not enqueue are dropped.
+    for tensors in replay_queue:
+        replay_buffer.add(tensors["canvas"].squeeze(0))
 
-        if flags.condition and new_frame.size() != 0:
-            stats["l2_loss"] = F.mse_loss(
-                *new_frame.split(split_size=new_frame.shape[1] // 2, dim=1)
-            ).item()
-
-        plogger.log(stats)
-        lock.release()
+        stats["replay_buffer_size"] = len(replay_buffer)
+        stats["replay_dropped"] = replay_queue.num_dropped()
 
 
 real_label = 1.0
@@ -365,48 +639,64 @@ def learn_D(
     flags,
     dataloader,
     replay_queue,
+    replay_buffer,
     D,
     D_eval,
     optimizer,
+    scheduler,
     stats,
     plogger,
+    rate_controller=None,
+    grad_scaler=None,
+    lock=threading.Lock(),
+    budgets=None,
 ):
+    if budgets is None:
+        budgets = thread_budgets.ThreadBudgets({})
+
     while True:
         for real, _ in dataloader:
-            fake = next(replay_queue)["canvas"].squeeze(0)
-            fake = fake.to(flags.learner_device, non_blocking=True)
+            budgets.apply("d_learner")
+            if rate_controller is not None and not rate_controller.wait_D_step():
+                return
+
+            fake = replay_buffer.sample(flags.batch_size, device=flags.learner_device)
 
             real = real.to(flags.learner_device, non_blocking=True)
 
             if flags.condition:
                 real = real.repeat(1, 2, 1, 1)
 
-            optimizer.zero_grad()
+            with lock, budgets.busy("d_learner"), record_function("learn_D"):
+                optimizer.zero_grad()
 
-            p_real = D(real).view(-1)
+                with autocast(flags, flags.learner_device):
+                    p_real = D(real).view(-1).float()
+                    p_fake = D(fake).view(-1).float()
 
-            label = torch.full(
-                (flags.batch_size,), real_label, device=flags.learner_device
-            )
-            real_loss = F.binary_cross_entropy_with_logits(p_real, label)
+                label = torch.full(
+                    (flags.batch_size,), real_label, device=flags.learner_device
+                )
+                real_loss = F.binary_cross_entropy_with_logits(p_real, label)
 
-            D_x = torch.sigmoid(p_real).mean()
-            p_fake = D(fake).view(-1)
+                D_x = torch.sigmoid(p_real).mean()
 
-            label = torch.full(
-                (flags.batch_size,), fake_label, device=flags.learner_device
-            )
-            fake_loss = F.binary_cross_entropy_with_logits(p_fake, label)
+                label = torch.full(
+                    (flags.batch_size,), fake_label, device=flags.learner_device
+                )
+                fake_loss = F.binary_cross_entropy_with_logits(p_fake, label)
 
-            D_G_z1 = torch.sigmoid(p_fake).mean()
+                D_G_z1 = torch.sigmoid(p_fake).mean()
 
-            loss = real_loss + fake_loss
+                loss = real_loss + fake_loss
 
-            loss.backward()
+                backward_and_step(loss, optimizer, scaler=grad_scaler)
+                scheduler.step()
 
-            optimizer.step()
+                D_eval.load_state_dict(D.state_dict())
 
-            D_eval.load_state_dict(D.state_dict())
+            if rate_controller is not None:
+                rate_controller.D_step()
 
             stats["D_loss"] = loss.item()
             stats["fake_loss"] = fake_loss.item()
@@ -418,11 +708,27 @@ def learn_D(
                 return
 
 
+def example_inputs(model, obs_shape, num_actions, device, batch_size=2):
+    obs = dict(
+        canvas=torch.zeros((1, batch_size) + tuple(obs_shape)),
+        prev_action=torch.zeros(1, batch_size, num_actions, dtype=torch.int64),
+        action_mask=torch.ones(1, batch_size, num_actions),
+        noise_sample=torch.zeros(1, batch_size, 10),
+    )
+    done = torch.zeros(1, batch_size, dtype=torch.bool)
+    core_state = model.initial_state(batch_size)
+    return nest.map(lambda t: t.to(device), (obs, done, core_state))
+
+
 def train(flags):
     if flags.xpid is None:
         flags.xpid = "torchbeast-%s" % time.strftime("%Y%m%d-%H%M%S")
-    plogger = file_writer.FileWriter(
-        xpid=flags.xpid, xp_args=flags.__dict__, rootdir=flags.savedir
+    plogger = file_writer.AsyncFileWriter(
+        xpid=flags.xpid,
+        xp_args=flags.__dict__,
+        rootdir=flags.savedir,
+        log_format=flags.log_format,
+        flush_interval=flags.log_flush_interval,
     )
     checkpointpath = os.path.expandvars(
         os.path.expanduser("%s/%s/%s" % (flags.savedir, flags.xpid, "model.tar"))
@@ -437,8 +743,13 @@ def train(flags):
         flags.learner_device = torch.device("cpu")
         flags.actor_device = torch.device("cpu")
 
+    if flags.num_inference_workers > 0 and flags.actor_device.type != "cpu":
+        raise Exception("--num_inference_workers needs --disable_cuda.")
+
     if flags.max_learner_queue_size is None:
         flags.max_learner_queue_size = flags.batch_size
+    if flags.max_terminal_frames is None:
+        flags.max_terminal_frames = -(-flags.unroll_length // flags.episode_length)
 
     # The queue the learner threads will get their data from.
     # Setting `minimum_batch_size == maximum_batch_size`
@@ -451,13 +762,15 @@ def train(flags):
         maximum_queue_size=flags.max_learner_queue_size,
     )
 
-    # The queue the actorpool stores final render image pairs.
+    # The queue the actorpool stores final render images in.
     # A seperate thread will load them to the ReplayBuffer.
-    # The batch size of the pairs will be dynamic.
+    # Actors don't block on this queue, when it is full frames are dropped.
+    # The batch size of the frames will be dynamic.
     replay_queue = libtorchbeast.BatchingQueue(
         batch_dim=1,
-        minimum_batch_size=flags.batch_size,
+        minimum_batch_size=1,
         maximum_batch_size=flags.batch_size,
+        timeout_ms=100,
         check_inputs=True,
         maximum_queue_size=flags.batch_size,
     )
@@ -468,9 +781,10 @@ def train(flags):
     inference_batcher = libtorchbeast.DynamicBatcher(
         batch_dim=1,
         minimum_batch_size=1,
-        maximum_batch_size=512,
+        maximum_batch_size=MAX_INFERENCE_BATCH_SIZE,
         timeout_ms=100,
         check_outputs=True,
+        compact_outputs=flags.compact_inference_outputs,
     )
 
     addresses = []
@@ -510,28 +824,50 @@ def train(flags):
         order=order,
         action_shape=action_shape,
         grid_shape=(grid_width, grid_width),
+        skip_masked_heads=flags.skip_masked_heads,
     )
-    model = model.to(device=flags.learner_device)
+    # Convolutions follow the memory format of their weights, so converting
+    # the models once is enough for the activations to stay channels last.
+    memory_format = MEMORY_FORMATS[flags.memory_format]
+
+    model = model.to(device=flags.learner_device, memory_format=memory_format)
 
     actor_model = models.Net(
         obs_shape=obs_shape,
         order=order,
         action_shape=action_shape,
         grid_shape=(grid_width, grid_width),
+        skip_masked_heads=flags.skip_masked_heads,
     ).eval()
-    actor_model.to(device=flags.actor_device)
+    actor_model.to(device=flags.actor_device, memory_format=memory_format)
 
     if flags.condition:
         D = models.ComplementDiscriminator(obs_shape)
     else:
         D = models.Discriminator(obs_shape)
-    D.to(device=flags.learner_device)
+    D.to(device=flags.learner_device, memory_format=memory_format)
 
     if flags.condition:
         D_eval = models.ComplementDiscriminator(obs_shape)
     else:
         D_eval = models.Discriminator(obs_shape)
-    D_eval = D_eval.to(device=flags.learner_device).eval()
+    D_eval = D_eval.to(device=flags.learner_device, memory_format=memory_format)
+    D_eval = D_eval.eval()
+
+    replay_buffer = replay.ReplayBuffer(
+        flags.replay_buffer_size, obs_shape, sampling=flags.replay_sampling
+    )
+
+    stats = {}
+
+    # Only fp16 needs loss scaling, bf16 has the range of fp32.
+    use_grad_scaler = flags.precision == "fp16"
+    grad_scaler = torch.amp.GradScaler(
+        flags.learner_device.type, enabled=use_grad_scaler
+    )
+    D_grad_scaler = torch.amp.GradScaler(
+        flags.learner_device.type, enabled=use_grad_scaler
+    )
 
     optimizer = optim.Adam(model.parameters(), lr=flags.policy_learning_rate)
     D_optimizer = optim.Adam(
@@ -547,6 +883,18 @@ def train(flags):
 
     scheduler = torch.optim.lr_scheduler.LambdaLR(optimizer, lr_lambda)
 
+    def D_lr_lambda(epoch):
+        # The discriminator doesn't step in lockstep with the policy, so
+        # anneal it by environment steps instead.
+        return 1 - min(stats.get("step", 0), flags.total_steps) / flags.total_steps
+
+    D_scheduler = torch.optim.lr_scheduler.LambdaLR(D_optimizer, D_lr_lambda)
+
+    rate_controller = rate_control.UpdateRateController(
+        policy_steps_per_D_step=flags.policy_steps_per_D_step,
+        max_D_steps_per_second=flags.max_D_steps_per_second,
+    )
+
     # The ActorPool that will run `flags.num_actors` many loops.
     actors = libtorchbeast.ActorPool(
         unroll_length=flags.unroll_length,
@@ -555,6 +903,8 @@ def train(flags):
         inference_batcher=inference_batcher,
         env_server_addresses=addresses,
         initial_agent_state=actor_model.initial_state(),
+        compress_rollouts=flags.compress_rollouts,
+        max_terminal_frames=flags.max_terminal_frames,
     )
 
     def run():
@@ -577,25 +927,84 @@ def train(flags):
         pin_memory=True,
     )
 
-    stats = {}
+    checkpointer = ckpt.AsyncCheckpointer(
+        checkpointpath,
+        keep=flags.checkpoint_keep,
+        per_component=flags.checkpoint_per_component,
+    )
 
     # Load state from a checkpoint, if possible.
-    if os.path.exists(checkpointpath):
-        checkpoint_states = torch.load(
-            checkpointpath, map_location=flags.learner_device
-        )
+    if checkpointer.exists():
+        checkpoint_states = checkpointer.load(map_location=flags.learner_device)
         model.load_state_dict(checkpoint_states["model_state_dict"])
         D.load_state_dict(checkpoint_states["D_state_dict"])
         optimizer.load_state_dict(checkpoint_states["optimizer_state_dict"])
         D_optimizer.load_state_dict(checkpoint_states["D_optimizer_state_dict"])
         scheduler.load_state_dict(checkpoint_states["scheduler_state_dict"])
-        stats = checkpoint_states["stats"]
+        if "D_scheduler_state_dict" in checkpoint_states:
+            D_scheduler.load_state_dict(checkpoint_states["D_scheduler_state_dict"])
+        # Empty unless saved from an fp16 run, which loading can't take.
+        if checkpoint_states.get("grad_scaler_state_dict"):
+            grad_scaler.load_state_dict(checkpoint_states["grad_scaler_state_dict"])
+        if checkpoint_states.get("D_grad_scaler_state_dict"):
+            D_grad_scaler.load_state_dict(checkpoint_states["D_grad_scaler_state_dict"])
+        stats.update(checkpoint_states["stats"])
         logging.info(f"Resuming preempted job, current stats:\n{stats}")
 
     # Initialize actor model like learner model.
     actor_model.load_state_dict(model.state_dict())
     D_eval.load_state_dict(D.state_dict())
 
+    if flags.inference_backend == "jit":
+        jit_cache_dir = os.path.expandvars(
+            os.path.expanduser("%s/%s" % (flags.savedir, "jit_cache"))
+        )
+        model_config = dict(
+            obs_shape=obs_shape,
+            order=order,
+            action_shape=action_shape,
+            grid_shape=(grid_width, grid_width),
+        )
+        actor_model = jit.trace(
+            actor_model,
+            example_inputs(
+                actor_model, obs_shape, len(action_shape), flags.actor_device
+            ),
+            flags.actor_device,
+            cache_dir=jit_cache_dir,
+            config=model_config,
+        )
+        D_eval = jit.trace(
+            D_eval,
+            torch.zeros((2,) + tuple(obs_shape), device=flags.learner_device),
+            flags.learner_device,
+            cache_dir=jit_cache_dir,
+            config=dict(obs_shape=obs_shape, condition=flags.condition),
+        )
+
+    # Held while updating the policy and D, so checkpoints see whole steps.
+    learner_lock = threading.Lock()
+    D_lock = threading.Lock()
+
+    # Per-stage timings of the learner and inference threads.
+    timings = prof.ThreadSafeTimings()
+
+    budgets = thread_budgets.ThreadBudgets.from_flags(flags)
+    logging.info(
+        "Intra-op threads%s: %s",
+        " (auto)" if budgets.auto else "",
+        budgets.budgets(),
+    )
+
+    profiler = trace.WindowedProfiler(
+        os.path.expandvars(
+            os.path.expanduser("%s/%s/%s" % (flags.savedir, flags.xpid, "traces"))
+        ),
+        steps=flags.profile_steps,
+        every=flags.profile_every,
+    )
+    signal.signal(signal.SIGUSR1, profiler.request)
+
     learner_threads = [
         threading.Thread(
             target=learn,
@@ -610,23 +1019,54 @@ def train(flags):
                 scheduler,
                 stats,
                 plogger,
+                rate_controller,
+                grad_scaler,
+                timings,
+                profiler,
+                learner_lock,
             ),
+            kwargs=dict(budgets=budgets),
         )
         for i in range(flags.num_learner_threads)
     ]
 
-    inference_threads = [
-        threading.Thread(
-            target=inference,
-            name="inference-thread-%i" % i,
-            args=(
-                flags,
-                inference_batcher,
-                actor_model,
-            ),
+    workers = None
+    inference_threads = []
+    if flags.num_inference_workers > 0:
+        # The workers keep the threads they start with and their busy time
+        # isn't seen here, so auto mode only rebalances the other roles.
+        budgets.pin("inference")
+        # The workers share the actor model's memory, publishing new
+        # weights updates them too.
+        workers = inference_workers.InferenceWorkers(
+            functools.partial(infer, flags),
+            actor_model,
+            flags.num_inference_workers,
+            # Unlike the threads, workers run at the same time.
+            num_threads=max(1, budgets.get("inference") // flags.num_inference_workers),
+            max_batch_size=MAX_INFERENCE_BATCH_SIZE,
         )
-        for i in range(flags.num_inference_threads)
-    ]
+    else:
+        inference_threads = [
+            threading.Thread(
+                target=inference,
+                name="inference-thread-%i" % i,
+                args=(
+                    flags,
+                    inference_batcher,
+                    actor_model,
+                    timings,
+                ),
+                kwargs=dict(budgets=budgets),
+            )
+            for i in range(flags.num_inference_threads)
+        ]
+
+    replay_thread = threading.Thread(
+        target=fill_replay_buffer,
+        name="replay-thread",
+        args=(replay_queue, replay_buffer, stats),
+    )
 
     d_learner = threading.Thread(
         target=learn_D,
@@ -635,43 +1075,57 @@ def train(flags):
             flags,
             dataloader,
             replay_queue,
+            replay_buffer,
             D,
             D_eval,
             D_optimizer,
+            D_scheduler,
             stats,
             plogger,
+            rate_controller,
+            D_grad_scaler,
+            D_lock,
         ),
+        kwargs=dict(budgets=budgets),
     )
 
     actorpool_thread.start()
 
-    threads = learner_threads + inference_threads
+    threads = learner_threads + inference_threads + [replay_thread]
 
     for t in inference_threads:
         t.start()
+    if workers is not None:
+        workers.start(inference_batcher, timings)
+    replay_thread.start()
 
     def checkpoint():
         if flags.disable_checkpoint:
             return
         logging.info("Saving checkpoint to %s", checkpointpath)
-        torch.save(
-            {
-                "model_state_dict": model.state_dict(),
-                "D_state_dict": D.state_dict(),
-                "optimizer_state_dict": optimizer.state_dict(),
-                "D_optimizer_state_dict": D_optimizer.state_dict(),
-                "scheduler_state_dict": scheduler.state_dict(),
-                "stats": stats,
-                "flags": vars(flags),
-            },
-            checkpointpath,
-        )
+        # Snapshots to CPU under the locks, the file is written in the
+        # background.
+        with learner_lock, D_lock:
+            checkpointer.save(
+                {
+                    "model_state_dict": model.state_dict(),
+                    "D_state_dict": D.state_dict(),
+                    "optimizer_state_dict": optimizer.state_dict(),
+                    "D_optimizer_state_dict": D_optimizer.state_dict(),
+                    "scheduler_state_dict": scheduler.state_dict(),
+                    "D_scheduler_state_dict": D_scheduler.state_dict(),
+                    "grad_scaler_state_dict": grad_scaler.state_dict(),
+                    "D_grad_scaler_state_dict": D_grad_scaler.state_dict(),
+                    "stats": dict(stats),
+                    "flags": vars(flags),
+                }
+            )
 
     def format_value(x):
         return f"{x:1.5}" if isinstance(x, float) else str(x)
 
     try:
-        while replay_queue.size() < flags.batch_size:
+        while len(replay_buffer) < flags.batch_size:
             if learner_queue.size() >= flags.batch_size:
                 next(learner_queue)
             time.sleep(0.01)
@@ -682,6 +1136,8 @@ def train(flags):
             t.start()
 
         last_checkpoint_time = timeit.default_timer()
+        last_actor_counters = {}
+        last_batcher_counters = {}
         while True:
             start_time = timeit.default_timer()
             start_step = stats.get("step", 0)
@@ -689,9 +1145,40 @@ def train(flags):
                 break
             time.sleep(5)
             end_step = stats.get("step", 0)
-
-            if timeit.default_timer() - last_checkpoint_time > 10 * 60:
-                # Save every 10 min.
+            stats.update(rate_controller.rates())
+            stats.update(timings.percentiles())
+            stats["log_dropped"] = plogger.num_dropped
+            if budgets.auto:
+                for role, num_threads in budgets.rebalance().items():
+                    stats["threads_" + role] = num_threads
+
+            actor_counters = actors.counters()
+            batcher_counters = inference_batcher.counters()
+            for key, value in counter_stats(
+                actor_counters, last_actor_counters
+            ).items():
+                stats["actor_" + key] = value
+            for key, value in counter_stats(
+                batcher_counters, last_batcher_counters
+            ).items():
+                stats["batcher_" + key] = value
+            dropped = actor_counters.get(
+                "terminal_frames_dropped", 0
+            ) - last_actor_counters.get("terminal_frames_dropped", 0)
+            if dropped > 0:
+                logging.warning(
+                    "Dropped %i terminal frames of episodes beyond "
+                    "--max_terminal_frames=%i in a rollout.",
+                    dropped,
+                    flags.max_terminal_frames,
+                )
+            last_actor_counters = actor_counters
+            last_batcher_counters = batcher_counters
+
+            if (
+                timeit.default_timer() - last_checkpoint_time
+                > flags.checkpoint_interval
+            ):
                 checkpoint()
                 last_checkpoint_time = timeit.default_timer()
 
@@ -718,6 +1205,7 @@ def train(flags):
     learner_queue.close()
 
     replay_queue.close()
+    rate_controller.close()
 
     actorpool_thread.join()
 
@@ -725,6 +1213,13 @@ def train(flags):
 
     for t in threads:
         t.join()
+    if workers is not None:
+        workers.join()
+
+    # Write a window cut short by the end of training.
+    profiler.close()
+    plogger.close()
+    checkpointer.close()
 
 
 def test(flags):
@@ -734,18 +1229,16 @@ def test(flags):
 def main(flags):
     if not flags.pipes_basename.startswith("unix:"):
         raise Exception("--pipes_basename has to be of the form unix:/some/path.")
+    if flags.num_inference_workers > 0 and flags.inference_backend == "jit":
+        # Traced modules can't be shared with the workers.
+        raise Exception("--num_inference_workers needs --inference_backend eager.")
+    if flags.skip_masked_heads and flags.inference_backend == "jit":
+        # Which rows are decoded depends on the sampled flags, tracing can't
+        # capture that.
+        raise Exception("--skip_masked_heads needs --inference_backend eager.")
 
     if flags.mode == "train":
-        if flags.write_profiler_trace:
-            logging.info("Running with profiler.")
-            with torch.autograd.profiler.profile() as prof:
-                train(flags)
-            filename = "chrome-%s.trace" % time.strftime("%Y%m%d-%H%M%S")
-            logging.info("Writing profiler trace to '%s.gz'", filename)
-            prof.export_chrome_trace(filename)
-            os.system("gzip %s" % filename)
-        else:
-            train(flags)
+        train(flags)
     else:
         test(flags)
 
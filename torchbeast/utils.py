@@ -3,9 +3,10 @@ from filelock import FileLock
 
 import torchvision.transforms as transforms
 from torch.utils.data import Dataset
-from torchvision.datasets import CelebA, Omniglot, MNIST
+from torchvision.datasets import CelebA, FakeData, Omniglot, MNIST
 
 from torchbeast import env_wrapper
+from torchbeast.core import replay_env
 from torchbeast.core.datasets import CelebAHQ
 
 frame_width = 64
@@ -44,6 +45,20 @@ def parse_flags(flags):
         config["shaders_basedir"] = SHADERS_BASEDIR
         env_name = "Fluid"
 
+    elif flags.env_type == "null":
+        config.update(
+            dict(
+                use_pressure=flags.use_pressure,
+                use_color=flags.use_color,
+                step_cost_ms=flags.null_step_cost_ms,
+            )
+        )
+        env_name = "Null"
+
+    elif flags.env_type == "replay":
+        config["replay_path"] = flags.replay_path
+        env_name = "Replay"
+
     if flags.use_compound:
         config.update(
             dict(
@@ -87,6 +102,12 @@ def create_dataset(name, grayscale):
         elif name == "celeba-hq":
             dataset = CelebAHQ(root="./", split="train", transform=tsfm, download=True)
 
+        elif name == "fake":
+            # Random images, for benchmarks on machines without the datasets.
+            dataset = FakeData(
+                size=1000, image_size=(3, frame_width, frame_width), transform=tsfm
+            )
+
         else:
             raise NotImplementedError
 
@@ -108,24 +129,61 @@ default_config = dict(
 
 
 def create_env(
-    env_name="Libmypaint-v0", config=default_config, grayscale=True, dataset=False
+    env_name="Libmypaint-v0",
+    config=default_config,
+    grayscale=True,
+    dataset=False,
+    fused_observation=False,
+    incremental_warp=False,
+    record_path=None,
+    record_episodes=100,
 ):
     env = env_wrapper.make_raw(env_name, config)
+    if record_path is not None:
+        env = replay_env.RecordEpisodes(env, record_path, record_episodes)
+    return wrap_env(
+        env, config, grayscale, dataset, fused_observation, incremental_warp
+    )
+
 
+def wrap_env(
+    env,
+    config,
+    grayscale=True,
+    dataset=False,
+    fused_observation=False,
+    incremental_warp=False,
+):
     env = env_wrapper.SampleNoise(env, noise_dim=10, dict_space_key="noise_sample")
     env = env_wrapper.SavePrevAction(env, dict_space_key="prev_action")
 
-    if frame_width != config["canvas_width"]:
+    warp = frame_width != config["canvas_width"]
+    if not isinstance(dataset, Dataset):
+        dataset = None
+
+    if fused_observation:
+        return env_wrapper.FusedObservation(
+            env,
+            width=frame_width if warp else None,
+            height=frame_width if warp else None,
+            grayscale=grayscale,
+            dataset=dataset,
+            dict_space_key="canvas",
+            incremental_warp=incremental_warp,
+        )
+
+    if warp:
         env = env_wrapper.WarpFrame(
             env,
             width=frame_width,
             height=frame_width,
             grayscale=grayscale,
             dict_space_key="canvas",
+            incremental=incremental_warp,
         )
     env = env_wrapper.FloatNCHW(env, dict_space_key="canvas")
 
-    if isinstance(dataset, Dataset):
+    if dataset is not None:
         env = env_wrapper.ConcatTarget(env, dataset)
 
     return env